@@ -0,0 +1,342 @@
+"""Reproducible benchmarks for the B-Tree Index Manager.
+
+Builds seeded datasets, runs each scenario against index files in a temporary
+directory (each in its own process, so peak RSS is per scenario), and prints
+the results as JSON. With --baseline the results are compared against an
+earlier run and the exit status is 1 if any scenario regressed.
+
+    python3 benchmark.py --sizes 10000,100000 --output results.json
+    python3 benchmark.py --baseline results.json
+"""
+
+import os
+import sys
+import io
+import json
+import time
+import random
+import argparse
+import bisect
+import itertools
+import tempfile
+import contextlib
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+import index_file_manager as ifm
+
+DATASETS = ('sequential', 'random', 'zipfian')
+SCENARIOS = ('insert', 'load', 'lookup_hit', 'lookup_miss', 'scan', 'extract', 'concurrent')
+DEFAULT_SIZES = (10000, 100000)
+DEFAULT_SEED = 4337
+DEFAULT_LOOKUPS = 10000
+DEFAULT_MAX_INSERTS = 20000
+DEFAULT_THRESHOLD = 0.10
+DEFAULT_THREADS = (1, 2, 4, 8)
+SCAN_EVERY = 16  # Every SCAN_EVERY-th concurrent read is a range scan instead of a lookup
+SCAN_WIDTH = 64  # Stored keys covered by each of those scans
+SCAN_BATCH = 1000  # Keys per latency sample of the scan scenario
+ZIPF_EXPONENT = 1.1
+KEY_SPACE = 1 << 40
+
+def zipf_sampler(rng, n, exponent=ZIPF_EXPONENT):
+    """Returns a function drawing ranks in [0, n) with Zipf-distributed popularity."""
+    cumulative = list(itertools.accumulate(1.0 / (rank + 1) ** exponent for rank in range(n)))
+    total = cumulative[-1]
+    return lambda: min(bisect.bisect_left(cumulative, rng.random() * total), n - 1)
+
+def generate_keys(dataset, size, seed):
+    """Returns `size` distinct keys in insertion order: 1..size, uniformly random or Zipf-drawn."""
+    rng = random.Random(seed)
+    if dataset == 'sequential':
+        return list(range(1, size + 1))
+    if dataset == 'random':
+        return rng.sample(range(1, KEY_SPACE), size)
+    if dataset == 'zipfian':
+        draw = zipf_sampler(rng, size * 10)
+        keys = {}
+        while len(keys) < size:
+            keys.setdefault(draw() + 1, None)
+        return list(keys)
+    raise ValueError(f"Unknown dataset '{dataset}'.")
+
+def lookup_keys(dataset, keys, count, seed, hits=True):
+    """Returns probe keys: stored keys (Zipf-popular ones for zipfian) or absent ones."""
+    rng = random.Random(seed + 1)
+    if not hits:
+        stored = set(keys)
+        probes = []
+        while len(probes) < count:
+            key = rng.randrange(1, KEY_SPACE)
+            if key not in stored:
+                probes.append(key)
+        return probes
+    if dataset == 'zipfian':
+        draw = zipf_sampler(rng, len(keys))
+        ordered = sorted(keys)
+        return [ordered[draw()] for _ in range(count)]
+    return [rng.choice(keys) for _ in range(count)]
+
+def peak_rss_kb():
+    """Returns the peak resident set size of this process in KiB, or None."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+def new_manager(options):
+    return ifm.IndexFileManager(cache_pages=options['cache_pages'], use_mmap=options['mmap'],
+                                wal=options['wal'])
+
+def build_index(manager, path, csv_path, options):
+    manager.create_and_open_index_file(path, options['block_size'], None,
+                                       options['file_format'])
+    manager.load_from_file(csv_path)
+    manager.close()
+
+def run_concurrent(manager, keys, threads, options):
+    """Runs reader threads against one inserting writer and returns (reads, writes)."""
+    ordered = sorted(keys)
+    per_thread = options['lookups'] // threads
+    done = threading.Event()
+    errors = []
+    written = [0]
+
+    def reader(index):
+        rng = random.Random(options['seed'] + index)
+        try:
+            for op in range(per_thread):
+                if op % SCAN_EVERY:
+                    key = rng.choice(keys)
+                    if manager.search_key(key) != key ^ 0x5555:
+                        raise RuntimeError(f"Lookup of {key} returned a wrong value.")
+                    continue
+                start = rng.randrange(len(ordered))
+                hi = ordered[min(start + SCAN_WIDTH, len(ordered) - 1)]
+                pairs = manager.scan(ordered[start], hi)
+                if [key for key, _ in pairs] != ordered[start:start + SCAN_WIDTH + 1]:
+                    raise RuntimeError(f"Scan from {ordered[start]} returned the wrong keys.")
+                low = KEY_SPACE + rng.randrange(written[0] + 1)
+                fresh = [key for key, _ in manager.scan(low, low + SCAN_WIDTH)]
+                if fresh != list(range(low, low + len(fresh))):
+                    raise RuntimeError("Writer's keys seen out of order or with gaps.")
+        except Exception as e:  # Reported by the main thread
+            errors.append(e)
+
+    def writer():
+        key = KEY_SPACE
+        while not done.is_set():
+            manager.insert_key_value(key, key ^ 0x5555)
+            key += 1
+            written[0] = key - KEY_SPACE
+
+    readers = [threading.Thread(target=reader, args=(index,)) for index in range(threads)]
+    writer_thread = threading.Thread(target=writer)
+    writer_thread.start()
+    for thread in readers:
+        thread.start()
+    for thread in readers:
+        thread.join()
+    done.set()
+    writer_thread.join()
+    if errors:
+        raise RuntimeError(f"{len(errors)} reader threads failed: {errors[0]}")
+    return per_thread * threads, written[0]
+
+def run_scenario(scenario, dataset, size, options, threads=1):
+    """Runs one scenario in a fresh temporary directory and returns its metrics."""
+    keys = generate_keys(dataset, size, options['seed'])
+    with tempfile.TemporaryDirectory(prefix='btree-bench-') as work_dir, \
+            contextlib.redirect_stdout(io.StringIO()):
+        index_path = os.path.join(work_dir, 'bench.idx')
+        csv_path = os.path.join(work_dir, 'pairs.csv')
+        with open(csv_path, 'w') as csv_file:
+            csv_file.writelines(f"{key},{key ^ 0x5555}\n" for key in keys)
+        manager = new_manager(options)
+        operation = None  # Timed operation whose latencies are reported
+        latency = None  # Or the latencies measured here
+        if scenario == 'insert':
+            keys = keys[:options['max_inserts']]
+            manager.create_and_open_index_file(index_path, options['block_size'], None,
+                                               options['file_format'])
+            manager.reset_stats()
+            start = time.perf_counter()
+            for key in keys:
+                manager.insert_key_value(key, key ^ 0x5555)
+            manager.close()
+            ops, operation = len(keys), 'insert'
+        elif scenario == 'load':
+            manager.create_and_open_index_file(index_path, options['block_size'], None,
+                                               options['file_format'])
+            manager.reset_stats()
+            start = time.perf_counter()
+            manager.load_from_file(csv_path)
+            manager.close()
+            ops, operation = len(keys), 'load'
+        else:
+            build_index(manager, index_path, csv_path, options)
+            manager = new_manager(options)
+            manager.open_index_file(index_path)
+            manager.reset_stats()
+            if scenario in ('lookup_hit', 'lookup_miss'):
+                probes = lookup_keys(dataset, keys, options['lookups'], options['seed'],
+                                     hits=scenario == 'lookup_hit')
+                start = time.perf_counter()
+                found = 0
+                for key in probes:
+                    try:
+                        manager.search_key(key)
+                        found += 1
+                    except ifm.KeyNotFoundError:
+                        pass
+                ops, operation = len(probes), 'search'
+                expected = len(probes) if scenario == 'lookup_hit' else 0
+                if found != expected:
+                    raise RuntimeError(f"{scenario} found {found} of {len(probes)} keys.")
+            elif scenario == 'scan':
+                batches = ifm.OperationStats()
+                start = batch_start = time.perf_counter()
+                ops = 0
+                for _ in manager.btree.scan():
+                    ops += 1
+                    if not ops % SCAN_BATCH:
+                        now = time.perf_counter()
+                        batches.record(now - batch_start)
+                        batch_start = now
+                latency = batches.snapshot()
+                if ops != len(keys):
+                    raise RuntimeError(f"scan returned {ops} of {len(keys)} keys.")
+            elif scenario == 'concurrent':
+                start = time.perf_counter()
+                ops, writes = run_concurrent(manager, keys, threads, options)
+            elif scenario == 'extract':
+                start = time.perf_counter()
+                manager.extract_to_file(os.path.join(work_dir, 'extract.csv'))
+                ops, operation = len(keys), 'extract'
+            else:
+                raise ValueError(f"Unknown scenario '{scenario}'.")
+            manager.close()
+        elapsed = time.perf_counter() - start
+        snapshot = manager.stats.snapshot()
+        file_size = os.path.getsize(index_path)
+    result = {'scenario': scenario, 'dataset': dataset, 'size': size, 'ops': ops,
+              'seconds': elapsed, 'ops_per_sec': ops / elapsed if elapsed else 0.0,
+              'block_reads': snapshot['counters']['block_reads'],
+              'block_writes': snapshot['counters']['block_writes'],
+              'node_splits': snapshot['counters']['node_splits'],
+              'cache_hit_rate': snapshot['cache_hit_rate'],
+              'file_size': file_size, 'peak_rss_kb': peak_rss_kb()}
+    if scenario == 'concurrent':
+        result['threads'] = threads
+        result['writes'] = writes
+        operation = 'search'
+    if operation is not None:
+        latency = snapshot['operations'][operation]
+    if latency is not None:
+        for name in ('p50_ms', 'p95_ms', 'p99_ms', 'max_ms'):
+            result[name] = latency[name]
+    return result
+
+def run_isolated(scenario, dataset, size, options, threads=1):
+    """Runs a scenario in a child process so its peak RSS is not inherited."""
+    with ProcessPoolExecutor(max_workers=1) as pool:
+        return pool.submit(run_scenario, scenario, dataset, size, options, threads).result()
+
+def result_key(result):
+    key = f"{result['scenario']}/{result['dataset']}/{result['size']}"
+    return f"{key}/{result['threads']}t" if 'threads' in result else key
+
+def compare(results, baseline, threshold):
+    """Returns a list of regression messages for results worse than the baseline."""
+    previous = {result_key(result): result for result in baseline['results']}
+    regressions = []
+    for result in results:
+        old = previous.get(result_key(result))
+        if old is None:
+            continue
+        if old['ops_per_sec'] and result['ops_per_sec'] < old['ops_per_sec'] * (1 - threshold):
+            regressions.append(f"{result_key(result)}: {result['ops_per_sec']:.0f} ops/sec, "
+                               f"was {old['ops_per_sec']:.0f}")
+        for counter in ('block_reads', 'block_writes'):
+            if result[counter] > old[counter] * (1 + threshold) + 1:
+                regressions.append(f"{result_key(result)}: {result[counter]} {counter}, "
+                                   f"was {old[counter]}")
+    return regressions
+
+def parse_list(text, choices=None):
+    items = [item.strip() for item in text.split(',') if item.strip()]
+    if choices is not None:
+        for item in items:
+            if item not in choices:
+                raise argparse.ArgumentTypeError(f"'{item}' is not one of {', '.join(choices)}")
+    return items
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the B-Tree Index Manager.")
+    parser.add_argument('--datasets', type=lambda text: parse_list(text, DATASETS),
+                        default=list(DATASETS), help="comma-separated: " + ', '.join(DATASETS))
+    parser.add_argument('--scenarios', type=lambda text: parse_list(text, SCENARIOS),
+                        default=list(SCENARIOS), help="comma-separated: " + ', '.join(SCENARIOS))
+    parser.add_argument('--sizes', type=lambda text: [int(size) for size in parse_list(text)],
+                        default=list(DEFAULT_SIZES), help="comma-separated key counts")
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    parser.add_argument('--lookups', type=int, default=DEFAULT_LOOKUPS,
+                        help="probes per lookup scenario")
+    parser.add_argument('--max-inserts', type=int, default=DEFAULT_MAX_INSERTS,
+                        help="cap on single inserts per insert scenario")
+    parser.add_argument('--threads', type=lambda text: [int(count) for count in parse_list(text)],
+                        default=list(DEFAULT_THREADS),
+                        help="comma-separated reader thread counts for the concurrent scenario")
+    parser.add_argument('--repeat', type=int, default=1,
+                        help="runs per scenario; the fastest is reported")
+    parser.add_argument('--block-size', type=int, default=ifm.BLOCK_SIZE)
+    parser.add_argument('--format', choices=ifm.FILE_FORMATS, default=ifm.FILE_FORMATS[0],
+                        help="node format of the index files")
+    parser.add_argument('--cache-pages', type=int, default=ifm.DEFAULT_CACHE_PAGES)
+    parser.add_argument('--mmap', action='store_true')
+    parser.add_argument('--wal', action='store_true')
+    parser.add_argument('--output', default=None, help="also write the JSON results to this file")
+    parser.add_argument('--baseline', default=None, help="JSON results of an earlier run to compare with")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help="fractional slowdown or I/O growth counted as a regression")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    options = {'repeat': args.repeat, 'seed': args.seed, 'lookups': args.lookups,
+               'max_inserts': args.max_inserts, 'block_size': args.block_size,
+               'file_format': args.format, 'cache_pages': args.cache_pages,
+               'mmap': args.mmap, 'wal': args.wal}
+    results = []
+    for size in args.sizes:
+        for dataset in args.datasets:
+            for scenario in args.scenarios:
+                for threads in (args.threads if scenario == 'concurrent' else [1]):
+                    runs = [run_isolated(scenario, dataset, size, options, threads)
+                            for _ in range(args.repeat)]
+                    result = max(runs, key=lambda run: run['ops_per_sec'])
+                    print(f"{result_key(result):<32} {result['ops_per_sec']:>12.0f} ops/sec",
+                          file=sys.stderr)
+                    results.append(result)
+    report = {'options': options, 'python': sys.version.split()[0], 'results': results}
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(text + '\n')
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.threshold)
+        for message in regressions:
+            print(f"Regression: {message}", file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
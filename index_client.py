@@ -0,0 +1,151 @@
+"""Small client for an index served with `index_file_manager.py --serve`.
+
+Used as a library (IndexClient) or from the command line:
+
+    python3 index_client.py put 5 50
+    python3 index_client.py get 5
+    python3 index_client.py mget 1 2 5
+    python3 index_client.py range 1 100
+    python3 index_client.py stats
+"""
+
+import argparse
+import json
+import socket
+import sys
+
+from index_file_manager import DEFAULT_SERVER_HOST, DEFAULT_SERVER_PORT
+
+
+class IndexClientError(Exception):
+    """Exception raised when the server answers a request with ERR."""
+    pass
+
+
+class IndexClient:
+    """A blocking connection to an index server speaking its line protocol."""
+
+    def __init__(self, host=DEFAULT_SERVER_HOST, port=DEFAULT_SERVER_PORT, unix_socket=None):
+        if unix_socket:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.connect(unix_socket)
+        else:
+            self.sock = socket.create_connection((host, port))
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.stream = self.sock.makefile('rb')
+
+    def close(self):
+        """Ends the session and closes the connection."""
+        try:
+            self.sock.sendall(b"quit\n")
+        except OSError:
+            pass
+        self.stream.close()
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def get(self, key):
+        """Returns the value stored under key, or None."""
+        return self.pipeline([('get', key)])[0]
+
+    def put(self, key, value):
+        """Inserts a pair; raises IndexClientError if the key exists."""
+        self.pipeline([('put', key, value)])
+
+    def delete(self, key):
+        """Deletes a key; returns False if it was not in the index."""
+        return self.pipeline([('del', key)])[0]
+
+    def mget(self, keys):
+        """Returns the values of many keys in order, None for misses."""
+        return self.pipeline([('mget',) + tuple(keys)])[0]
+
+    def range(self, lo, hi, limit=None):
+        """Returns the (key, value) pairs with lo <= key <= hi."""
+        request = ('range', lo, hi) if limit is None else ('range', lo, hi, limit)
+        return self.pipeline([request])[0]
+
+    def stats(self):
+        """Returns the server's statistics snapshot as a dict."""
+        return self.pipeline([('stats',)])[0]
+
+    def pipeline(self, requests):
+        """Sends several requests at once, then reads one result (or IndexClientError) for each."""
+        self.sock.sendall(b''.join(
+            ' '.join(str(part) for part in request).encode('ascii') + b"\n"
+            for request in requests))
+        results = []
+        error = None
+        for request in requests:
+            try:
+                results.append(self._read_response(request[0]))
+            except IndexClientError as e:
+                results.append(None)
+                error = error or e
+        if error is not None:
+            raise error
+        return results
+
+    def _read_response(self, command):
+        line = self.stream.readline()
+        if not line:
+            raise ConnectionError("The server closed the connection.")
+        status, _, rest = line.decode('ascii').rstrip('\n').partition(' ')
+        if status == 'ERR':
+            raise IndexClientError(rest)
+        if status == 'NOTFOUND':
+            return False if command == 'del' else None
+        if command == 'get':
+            return int(rest)
+        if command == 'mget':
+            return [None if value == '-' else int(value) for value in rest.split()]
+        if command == 'range':
+            pairs = []
+            for _ in range(int(rest)):
+                key, value = self.stream.readline().split()
+                pairs.append((int(key), int(value)))
+            return pairs
+        if command == 'stats':
+            return json.loads(rest)
+        return True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Send one request to an index server.")
+    parser.add_argument('--host', default=DEFAULT_SERVER_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_SERVER_PORT)
+    parser.add_argument('--unix-socket', default=None)
+    parser.add_argument('command', choices=('get', 'put', 'del', 'mget', 'range', 'stats'))
+    parser.add_argument('args', nargs='*', type=int)
+    args = parser.parse_args(argv)
+    try:
+        with IndexClient(args.host, args.port, args.unix_socket) as client:
+            result = client.pipeline([(args.command,) + tuple(args.args)])[0]
+    except (OSError, IndexClientError) as e:
+        print(f"Error: {e}")
+        return 1
+    if args.command == 'range':
+        for key, value in result:
+            print(f"{key},{value}")
+    elif args.command == 'stats':
+        print(json.dumps(result, indent=2))
+    elif args.command == 'mget':
+        for key, value in zip(args.args, result):
+            print(f"{key},{'' if value is None else value}")
+    elif result is None or result is False:
+        print("Not found.")
+        return 1
+    elif args.command == 'get':
+        print(result)
+    else:
+        print("OK")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -3,10 +3,96 @@ import struct
 import functools
 import sys
 import logging
+import argparse
+import bisect
+import mmap
+import contextlib
+import heapq
+import itertools
+import json
+import math
+import tempfile
+import threading
+import time
+import zlib
+import asyncio
+import signal
+import types
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from operator import itemgetter, lt
 
-BLOCK_SIZE = 512
+BLOCK_SIZE = 512  # Default block size, and the size of every pre-configurable index file
 HEADER_MAGIC = b'4337PRJ3'
-MIN_DEGREE = 10  # Minimal degree t of B-tree
+MIN_DEGREE = 10  # Default minimal degree t of B-tree for BLOCK_SIZE blocks
+MAX_BLOCK_SIZE = 1024 * 1024
+DEFAULT_CACHE_PAGES = 1024  # Buffer pool size in blocks
+MIN_CACHE_PAGES = 8  # Enough for one root-to-leaf path plus a split
+DEFAULT_FILL_FACTOR = 0.9  # Fraction of each node filled by the bulk loader
+DEFAULT_LOAD_MEMORY = 64 * 1024 * 1024  # Memory budget for sorting a load file
+MAX_MERGE_FAN_IN = 128  # Sorted runs merged at once by the external sort
+MAX_UINT64 = 2 ** 64 - 1
+OUTPUT_CHUNK_LINES = 4096  # Lines buffered per write by print/extract/range
+LOOKUP_BATCH_KEYS = 65536  # Keys resolved per tree walk by the lookup command
+# Loading into a non-empty index: what to do with keys already present, and
+# whether to insert in place or merge the batch with a scan into a new file
+DUPLICATE_POLICIES = ('reject', 'skip', 'overwrite')
+LOAD_MODES = ('auto', 'insert', 'merge')
+MERGE_LOAD_RATIO = 0.3  # Auto mode merge-rebuilds once a batch is this fraction of the index
+ESTIMATED_FILL = 0.7  # Assumed node fill when estimating the keys in an uncounted index
+MERGE_READ_BYTES = 1024 * 1024  # Read buffer for the sorted batch during a merge-rebuild
+
+# Write-ahead log: a file header, then page records (block_id, length, data)
+# each transaction closed by a commit record (sequence, CRC32 of its pages)
+WAL_SUFFIX = '.wal'
+WAL_MAGIC = b'4337WAL1'
+WAL_HEADER_STRUCT = struct.Struct('>8sI')
+WAL_RECORD_STRUCT = struct.Struct('>4sQI')
+WAL_PAGE = b'PAGE'
+WAL_COMMIT = b'CMIT'
+SYNC_POLICIES = ('always', 'batch', 'never')
+DEFAULT_SYNC_EVERY = 64  # Commits per fsync under the batch policy
+DEFAULT_SYNC_INTERVAL_MS = 20  # Longest a batched commit waits for its fsync
+DEFAULT_CHECKPOINT_BYTES = 16 * 1024 * 1024  # Log size that triggers a checkpoint
+WAL_BUFFER_BYTES = 1024 * 1024  # Log bytes buffered in memory before being written
+REORGANIZE_SUFFIX = '.reorg'  # The rewritten file is built here before replacing the index
+SNAPSHOT_CACHE_PAGES = 64  # Buffer pool size of each snapshot view
+VERIFY_READ_BYTES = 4 * 1024 * 1024  # Read size of the verify scan
+VERIFY_PARALLEL_BLOCKS = 16384  # Smaller files are verified in-process
+VERIFY_CHUNKS_PER_WORKER = 4  # Block ranges handed to each verify process, for balance
+VERIFY_MAX_PROBLEMS = 50  # Problems listed in a verify report; the rest are only counted
+# Bloom filter sidecar: a header (magic, bit count, hash count, capacity, keys
+# added, target false-positive rate, the index's root, next and free block when
+# saved, clean flag) followed by the bits
+BLOOM_SUFFIX = '.bloom'
+BLOOM_MAGIC = b'4337BLM1'
+BLOOM_HEADER_STRUCT = struct.Struct('>8sQIQQdQQQI')
+DEFAULT_BLOOM_FP_RATE = 0.01
+MIN_BLOOM_CAPACITY = 1024  # Smallest number of keys a filter is sized for
+BLOOM_HEADROOM = 2  # A rebuilt filter is sized for this many times the keys in the index
+SCRIPT_BUFFER_BYTES = 1024 * 1024  # Output buffered by --script between writes
+
+# Network server (serve mode)
+DEFAULT_SERVER_HOST = '127.0.0.1'
+DEFAULT_SERVER_PORT = 4337
+DEFAULT_SERVER_THREADS = 8  # Threads running read batches; one more applies write batches
+MAX_WRITE_BATCH = 1024  # Writes applied under one lock and one commit
+MAX_PIPELINE = 1024  # Requests a connection may have in flight before reading pauses
+
+# Header layout: magic, root block, next block, block size, minimal degree,
+# first free block, free block count, file format. Files written before the
+# block size and degree existed have zeros there and use BLOCK_SIZE and
+# MIN_DEGREE; files written before the free list existed have zeros there and
+# no free blocks; files written before the format existed are B-trees.
+HEADER_STRUCT = struct.Struct('>8sQQIIQQI')
+
+# Node layouts, stored in the header by their index in this tuple
+FILE_FORMATS = ('btree', 'bplus', 'counted')
+
+# A freed block holds FREE_MAGIC and the id of the next free block (0 ends the list)
+FREE_MAGIC = b'4337FREE'
+FREE_BLOCK_STRUCT = struct.Struct('>8sQ')
 
 # Configure logging
 logging.basicConfig(level=logging.ERROR)
@@ -33,16 +119,942 @@ class InvalidCommandError(Exception):
     """Exception raised for invalid commands."""
     pass
 
+class ProtocolError(Exception):
+    """Exception raised for malformed requests to the index server."""
+    pass
+
 def require_file_open(method):
     """Decorator to ensure a file is open before executing certain methods."""
     @functools.wraps(method)
     def wrapper(self, *args, **kwargs):
         if not self.current_file:
-            print("Error: No index file is open.")
+            _report_error("Error: No index file is open.")
             return
         return method(self, *args, **kwargs)
     return wrapper
 
+def shared(method):
+    """Decorator running a method under the manager's lock in shared (read) mode."""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock.reading():
+            return method(self, *args, **kwargs)
+    return wrapper
+
+def exclusive(method):
+    """Decorator running a method under the manager's lock in exclusive (write) mode."""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock.writing():
+            return method(self, *args, **kwargs)
+    return wrapper
+
+class ReadWriteLock:
+    """A re-entrant readers-writer lock whose turns alternate so neither side starves."""
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.readers = 0
+        self.waiting_readers = 0
+        self.waiting_writers = 0
+        self.admit = 0  # Readers let in ahead of waiting writers
+        self.writer = None  # Thread holding the write lock
+        self.local = threading.local()  # Per-thread read depth
+
+    @contextlib.contextmanager
+    def reading(self):
+        depth = getattr(self.local, 'depth', 0)
+        if depth or self.writer is threading.current_thread():
+            self.local.depth = depth + 1
+            try:
+                yield
+            finally:
+                self.local.depth = depth
+            return
+        with self.condition:
+            self.waiting_readers += 1
+            try:
+                while self.writer is not None or (self.waiting_writers and not self.admit):
+                    self.condition.wait()
+            except BaseException:
+                # An interrupted reader must not hold back writers as one still to be admitted
+                self.admit = min(self.admit, self.waiting_readers - 1)
+                self.condition.notify_all()
+                raise
+            finally:
+                self.waiting_readers -= 1
+            if self.admit:
+                self.admit -= 1
+            self.readers += 1
+        self.local.depth = 1
+        try:
+            yield
+        finally:
+            self.local.depth = 0
+            with self.condition:
+                self.readers -= 1
+                if not self.readers:
+                    self.condition.notify_all()
+
+    @contextlib.contextmanager
+    def writing(self):
+        me = threading.current_thread()
+        if self.writer is me:
+            yield
+            return
+        if getattr(self.local, 'depth', 0):
+            raise RuntimeError("A thread holding the read lock cannot take the write lock.")
+        with self.condition:
+            self.waiting_writers += 1
+            try:
+                while self.writer is not None or self.readers or self.admit:
+                    self.condition.wait()
+            except BaseException:
+                self.condition.notify_all()  # Readers held back for this writer may go in
+                raise
+            finally:
+                self.waiting_writers -= 1
+            self.writer = me
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.writer = None
+                self.admit = self.waiting_readers
+                self.condition.notify_all()
+
+def timed(operation):
+    """Decorator recording a method's latency and block I/O under an operation name."""
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self.stats.measure(operation):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+class OperationStats:
+    """Latency histogram (logarithmic, about 9% resolution) and block I/O totals for one operation."""
+
+    BUCKETS_PER_DOUBLING = 8
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.block_reads = 0
+        self.block_writes = 0
+
+    def record(self, seconds, block_reads=0, block_writes=0):
+        microseconds = max(seconds * 1e6, 1.0)
+        bucket = int(math.log2(microseconds) * self.BUCKETS_PER_DOUBLING)
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.block_reads += block_reads
+        self.block_writes += block_writes
+
+    def percentile(self, fraction):
+        """Returns the latency in seconds below which the given fraction of samples fall."""
+        if not self.count:
+            return 0.0
+        rank = fraction * self.count
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                upper = 2 ** ((bucket + 1) / self.BUCKETS_PER_DOUBLING) / 1e6
+                return min(upper, self.max)
+        return self.max
+
+    def snapshot(self):
+        count = self.count or 1
+        return {'count': self.count,
+                'mean_ms': self.total / count * 1000,
+                'p50_ms': self.percentile(0.50) * 1000,
+                'p95_ms': self.percentile(0.95) * 1000,
+                'p99_ms': self.percentile(0.99) * 1000,
+                'max_ms': self.max * 1000,
+                'block_reads_per_op': self.block_reads / count,
+                'block_writes_per_op': self.block_writes / count}
+
+class ThreadCounters:
+    """One thread's I/O counters; only that thread updates them, so they need no lock."""
+
+    __slots__ = ('block_reads', 'block_writes', 'header_writes', 'node_splits',
+                 'node_merges', 'cache_hits', 'cache_misses', 'bloom_skips', 'bloom_passes',
+                 'bloom_false_positives')
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, 0)
+
+class IndexStats:
+    """Session-wide I/O counters and per-operation latency statistics."""
+
+    COUNTERS = ThreadCounters.__slots__
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Zeroes every counter and forgets every latency sample."""
+        with self.lock:
+            self.local = threading.local()  # .counters: the calling thread's ThreadCounters
+            self.threads = []  # ThreadCounters of every thread that counted since the reset
+            self.operations = {}  # operation name -> OperationStats
+
+    def counters(self):
+        """Returns the calling thread's counters, creating them on its first use."""
+        try:
+            return self.local.counters
+        except AttributeError:
+            counters = ThreadCounters()
+            with self.lock:
+                self.local.counters = counters
+                self.threads.append(counters)
+            return counters
+
+    def total(self, name):
+        """Returns a counter summed over all threads."""
+        with self.lock:
+            return sum(getattr(counters, name) for counters in self.threads)
+
+    @contextlib.contextmanager
+    def measure(self, operation):
+        """Times the enclosed block and charges the block I/O of the calling thread to an operation."""
+        counters = self.counters()
+        reads, writes = counters.block_reads, counters.block_writes
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                stats = self.operations.get(operation)
+                if stats is None:
+                    stats = self.operations[operation] = OperationStats()
+                stats.record(elapsed, counters.block_reads - reads, counters.block_writes - writes)
+
+    def snapshot(self):
+        """Returns the counters and operation statistics as a plain dict."""
+        with self.lock:
+            totals = {name: sum(getattr(counters, name) for counters in self.threads)
+                      for name in self.COUNTERS}
+            operations = {name: stats.snapshot() for name, stats in self.operations.items()}
+        lookups = totals['cache_hits'] + totals['cache_misses']
+        return {'counters': totals,
+                'cache_hit_rate': totals['cache_hits'] / lookups if lookups else 0.0,
+                'operations': operations}
+
+class StatsDumper:
+    """Periodically writes an IndexFileManager's stats snapshot to a JSON file."""
+
+    def __init__(self, index_file_manager, path, interval):
+        self.index_file_manager = index_file_manager
+        self.path = path
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='stats-dumper', daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        """Stops the thread and writes a final snapshot."""
+        self.stopped.set()
+        self.thread.join()
+        self.dump()
+
+    def dump(self):
+        """Writes the current snapshot, replacing the file atomically."""
+        try:
+            # Taken without the manager's lock, so a file closed meanwhile can fail it
+            snapshot = self.index_file_manager.stats_snapshot()
+            snapshot['time'] = time.time()
+            with open(self.path + '.tmp', 'w') as stats_file:
+                json.dump(snapshot, stats_file, indent=2)
+            os.replace(self.path + '.tmp', self.path)
+        except Exception as e:  # The thread must outlive one failed dump
+            logger.error(f"Could not write statistics to '{self.path}'. {str(e)}")
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.dump()
+
+if hasattr(os, 'pread'):
+    def _pread(fd, size, offset):
+        return os.pread(fd, size, offset)
+
+    def _pwrite(fd, data, offset):
+        view = memoryview(data)
+        while view:
+            written = os.pwrite(fd, view, offset)
+            view = view[written:]
+            offset += written
+else:  # pragma: no cover - platforms without positioned I/O (Windows)
+    _seek_lock = threading.Lock()  # Seek and transfer must not interleave between threads
+
+    def _pread(fd, size, offset):
+        with _seek_lock:
+            os.lseek(fd, offset, os.SEEK_SET)
+            return os.read(fd, size)
+
+    def _pwrite(fd, data, offset):
+        with _seek_lock:
+            os.lseek(fd, offset, os.SEEK_SET)
+            view = memoryview(data)
+            while view:
+                view = view[os.write(fd, view):]
+
+def recover_wal(filename, fd):
+    """Replays a leftover log's committed transactions, then removes it; returns their count."""
+    path = filename + WAL_SUFFIX
+    if not os.path.exists(path):
+        return 0
+    committed = {}  # block_id -> (offset, length) of its latest committed image
+    transactions = 0
+    with open(path, 'rb') as log_file:
+        header = log_file.read(WAL_HEADER_STRUCT.size)
+        if len(header) == WAL_HEADER_STRUCT.size and header[:8] == WAL_MAGIC:
+            block_size = WAL_HEADER_STRUCT.unpack(header)[1]
+            pending = {}
+            crc = 0
+            while True:
+                record = log_file.read(WAL_RECORD_STRUCT.size)
+                if len(record) < WAL_RECORD_STRUCT.size:
+                    break
+                kind, number, size = WAL_RECORD_STRUCT.unpack(record)
+                if kind == WAL_PAGE:
+                    offset = log_file.tell()
+                    data = log_file.read(size)
+                    if len(data) < size:
+                        break
+                    crc = zlib.crc32(record + data, crc)
+                    pending[number] = (offset, size)
+                elif kind == WAL_COMMIT and size == crc:
+                    committed.update(pending)
+                    pending = {}
+                    crc = 0
+                    transactions += 1
+                else:
+                    break
+            for block_id, (offset, size) in sorted(committed.items()):
+                log_file.seek(offset)
+                _pwrite(fd, log_file.read(size), block_id * block_size)
+    if committed:
+        os.fsync(fd)
+    os.remove(path)
+    return transactions
+
+class WriteAheadLog:
+    """Logs page images per transaction and copies them into the file at checkpoints."""
+
+    def __init__(self, filename, block_size, sync_policy='always', sync_every=DEFAULT_SYNC_EVERY,
+                 sync_interval_ms=DEFAULT_SYNC_INTERVAL_MS, checkpoint_bytes=DEFAULT_CHECKPOINT_BYTES):
+        if sync_policy not in SYNC_POLICIES:
+            raise ValueError(f"Error: Sync policy must be one of {', '.join(SYNC_POLICIES)}.")
+        self.path = filename + WAL_SUFFIX
+        self.block_size = block_size
+        self.sync_policy = sync_policy
+        self.sync_every = max(1, sync_every)
+        self.sync_interval = sync_interval_ms / 1000
+        self.checkpoint_bytes = checkpoint_bytes
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0))
+        _pwrite(self.fd, WAL_HEADER_STRUCT.pack(WAL_MAGIC, block_size), 0)
+        self.size = WAL_HEADER_STRUCT.size  # Log length, including the unwritten buffer
+        self.buffer = bytearray()
+        self.buffer_start = self.size
+        self.committed = {}  # block_id -> log offset of its latest committed image
+        self.pending = {}  # block_id -> log offset of its image in the open transaction
+        self.crc = 0
+        self.sequence = 0
+        self.unsynced_commits = 0
+        self.last_sync = time.monotonic()
+        self.syncs = 0
+        self.lock = threading.Lock()
+        self.timer = None
+
+    def append_page(self, block_id, data):
+        """Adds a page image to the open transaction."""
+        with self.lock:
+            record = WAL_RECORD_STRUCT.pack(WAL_PAGE, block_id, len(data))
+            self.crc = zlib.crc32(data, zlib.crc32(record, self.crc))
+            self.pending[block_id] = self.size + len(record)
+            self.buffer += record
+            self.buffer += data
+            self.size += len(record) + len(data)
+            if len(self.buffer) >= WAL_BUFFER_BYTES:
+                self._write_buffer()
+
+    def read_page(self, block_id):
+        """Returns the newest logged image of a page, or None if it is not in the log."""
+        with self.lock:
+            offset = self.pending.get(block_id)
+            if offset is None:
+                offset = self.committed.get(block_id)
+                if offset is None:
+                    return None
+            if offset >= self.buffer_start:
+                start = offset - self.buffer_start
+                return bytes(self.buffer[start:start + self.block_size])
+            return _pread(self.fd, self.block_size, offset)
+
+    def committed_pages(self):
+        """Returns {block_id: log offset} of the latest committed image of every logged page."""
+        with self.lock:
+            return dict(self.committed)
+
+    def commit(self):
+        """Closes the open transaction and syncs the log as the policy requires."""
+        with self.lock:
+            if not self.pending:
+                return
+            self.sequence += 1
+            self.buffer += WAL_RECORD_STRUCT.pack(WAL_COMMIT, self.sequence, self.crc)
+            self.size += WAL_RECORD_STRUCT.size
+            self._write_buffer()
+            self.committed.update(self.pending)
+            self.pending = {}
+            self.crc = 0
+            self.unsynced_commits += 1
+            if self.sync_policy == 'always':
+                self._sync()
+            elif self.sync_policy == 'batch':
+                if (self.unsynced_commits >= self.sync_every
+                        or time.monotonic() - self.last_sync >= self.sync_interval):
+                    self._sync()
+                elif self.timer is None:
+                    self.timer = threading.Timer(self.sync_interval, self.sync)
+                    self.timer.daemon = True
+                    self.timer.start()
+
+    def sync(self):
+        """Makes every committed transaction durable."""
+        with self.lock:
+            self._sync()
+
+    def needs_checkpoint(self):
+        return self.size >= self.checkpoint_bytes
+
+    def checkpoint(self, fd):
+        """Copies committed pages into the index file and empties the log."""
+        with self.lock:
+            if self.pending:
+                raise IndexFileError("Error: Cannot checkpoint in the middle of a transaction.")
+            if not self.committed:
+                return
+            self._sync()
+            for block_id, offset in sorted(self.committed.items()):
+                _pwrite(fd, _pread(self.fd, self.block_size, offset), block_id * self.block_size)
+            if self.sync_policy != 'never':
+                os.fsync(fd)
+            os.ftruncate(self.fd, WAL_HEADER_STRUCT.size)
+            if self.sync_policy != 'never':
+                os.fsync(self.fd)
+            self.size = self.buffer_start = WAL_HEADER_STRUCT.size
+            self.committed = {}
+
+    def close(self, fd):
+        """Checkpoints into the index file and removes the log."""
+        if self.timer is not None:
+            self.timer.cancel()
+        self.checkpoint(fd)
+        os.close(self.fd)
+        self.fd = None
+        os.remove(self.path)
+
+    def _write_buffer(self):
+        if self.buffer:
+            _pwrite(self.fd, self.buffer, self.buffer_start)
+            self.buffer_start += len(self.buffer)
+            self.buffer = bytearray()
+
+    def _sync(self):
+        self._write_buffer()
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if self.unsynced_commits and self.sync_policy != 'never':
+            os.fsync(self.fd)
+            self.syncs += 1
+        self.unsynced_commits = 0
+        self.last_sync = time.monotonic()
+
+class Pager:
+    """Performs the index file's block I/O, optionally via mmap or a write-ahead log."""
+
+    def __init__(self, filename, block_size=BLOCK_SIZE, use_mmap=False, stats=None):
+        self.filename = filename
+        self.block_size = block_size
+        self.stats = stats or IndexStats()
+        self.fd = os.open(filename, os.O_RDWR | getattr(os, 'O_BINARY', 0))
+        self.wal = None
+        self.unlogged_writes = False
+        self.recovered = recover_wal(filename, self.fd)
+        self.map = None
+        self.map_lock = threading.Lock()
+        self.snapshots = []  # SnapshotPages of the open snapshots
+        self.snapshot_lock = threading.Lock()  # Orders snapshot reads against overwrites and checkpoints
+        if use_mmap:
+            self._remap()
+
+    def enable_wal(self, **options):
+        """Starts logging block writes to a write-ahead log (see WriteAheadLog)."""
+        self.wal = WriteAheadLog(self.filename, self.block_size, **options)
+
+    def _remap(self):
+        # The old mapping is left for garbage collection: readers may still be decoding from it
+        self.map = mmap.mmap(self.fd, 0, access=mmap.ACCESS_READ)
+
+    def block_buffer(self, block_id):
+        """Returns (buffer, offset) holding a block, without copying when mapped."""
+        self.stats.counters().block_reads += 1
+        if self.wal is not None:
+            data = self.wal.read_page(block_id)
+            if data is not None:
+                return data, 0
+        offset = block_id * self.block_size
+        if self.map is None:
+            return _pread(self.fd, self.block_size, offset), 0
+        mapped = self.map
+        if offset + self.block_size > len(mapped):
+            with self.map_lock:
+                if offset + self.block_size > len(self.map) and os.fstat(self.fd).st_size > len(self.map):
+                    self._remap()
+                mapped = self.map
+        return mapped, offset
+
+    def read_block(self, block_id):
+        """Returns the raw bytes of a block (short if past the end of file)."""
+        buffer, offset = self.block_buffer(block_id)
+        if offset == 0 and len(buffer) <= self.block_size:
+            return buffer
+        return buffer[offset:offset + self.block_size]
+
+    def write_block(self, block_id, data):
+        """Writes the raw bytes of a block at its position in the file (or to the log)."""
+        self.stats.counters().block_writes += 1
+        if self.wal is not None:
+            self.wal.append_page(block_id, data)
+        elif self.snapshots:
+            with self.snapshot_lock:
+                self._preserve(block_id)
+                _pwrite(self.fd, data, block_id * self.block_size)
+        else:
+            _pwrite(self.fd, data, block_id * self.block_size)
+
+    def write_unlogged(self, block_id, data):
+        """Writes a freshly allocated block straight to the file, bypassing the log."""
+        if self.snapshots:
+            self.write_block(block_id, data)
+            return
+        self.stats.counters().block_writes += 1
+        _pwrite(self.fd, data, block_id * self.block_size)
+        self.unlogged_writes = True
+
+    def commit(self):
+        """Ends a transaction: commits the log and checkpoints it once it grows large."""
+        if self.wal is None:
+            return
+        if self.unlogged_writes and self.wal.sync_policy != 'never':
+            os.fsync(self.fd)
+        self.unlogged_writes = False
+        self.wal.commit()
+        if self.wal.needs_checkpoint():
+            with self.snapshot_lock:
+                if not self.snapshots:
+                    self.wal.checkpoint(self.fd)
+
+    def truncate(self, block_count):
+        """Checkpoints the log, then cuts the file off after block_count blocks."""
+        with self.snapshot_lock:
+            if self.snapshots:
+                raise IndexFileError("Error: Cannot shrink the index file while snapshots are open.")
+        if self.wal is not None:
+            self.wal.checkpoint(self.fd)
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+            os.ftruncate(self.fd, block_count * self.block_size)
+            self._remap()
+        else:
+            os.ftruncate(self.fd, block_count * self.block_size)
+
+    def sync(self):
+        """Flushes written blocks to stable storage."""
+        if self.wal is not None:
+            self.wal.sync()
+        else:
+            os.fsync(self.fd)
+
+    def open_snapshot(self, pages):
+        """Starts keeping the blocks as of the last commit unchanged for a snapshot."""
+        with self.snapshot_lock:
+            if self.fd is None:
+                raise IndexFileError("Error: The index file is closed.")
+            if self.wal is not None:
+                pages.log_pages = self.wal.committed_pages()
+            self.snapshots.append(pages)
+
+    def close_snapshot(self, pages):
+        """Stops keeping blocks for a snapshot."""
+        with self.snapshot_lock:
+            if pages in self.snapshots:
+                self.snapshots.remove(pages)
+        pages.discard()
+
+    def read_snapshot_block(self, pages, block_id):
+        """Returns the raw bytes of a block as a snapshot sees it."""
+        self.stats.counters().block_reads += 1
+        with self.snapshot_lock:
+            if pages not in self.snapshots:
+                raise IndexFileError("Error: The snapshot was closed.")
+            data = pages.kept(block_id)
+            if data is not None:
+                return data
+            if self.wal is None:
+                return _pread(self.fd, self.block_size, block_id * self.block_size)
+            offset = pages.log_pages.get(block_id)
+        # Until the snapshot closes, the log is only appended to and the file not checkpointed
+        if offset is not None:
+            return _pread(self.wal.fd, self.block_size, offset)
+        return _pread(self.fd, self.block_size, block_id * self.block_size)
+
+    def _preserve(self, block_id):
+        """Copies a block's current image to every snapshot that sees it and has no copy yet."""
+        data = None
+        for pages in self.snapshots:
+            if 0 < block_id < pages.block_count and pages.kept(block_id) is None:
+                if data is None:
+                    data = _pread(self.fd, self.block_size, block_id * self.block_size)
+                pages.keep(block_id, data)
+
+    def close(self):
+        """Closes the underlying file descriptor; open snapshots become unreadable."""
+        with self.snapshot_lock:
+            snapshots, self.snapshots = self.snapshots, []
+        for pages in snapshots:
+            pages.discard()
+        if self.wal is not None:
+            self.wal.close(self.fd)
+            self.wal = None
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+class BufferPool:
+    """Caches decoded B-tree nodes with LRU eviction and dirty-page write-back."""
+
+    def __init__(self, index_file_manager, capacity=DEFAULT_CACHE_PAGES):
+        self.index_file_manager = index_file_manager
+        self.capacity = max(capacity, MIN_CACHE_PAGES)
+        self.pages = OrderedDict()  # block_id -> BTreeNode, least recently used first
+        self.pins = {}  # block_id -> pin count
+        self.dirty = set()
+        self.stats = index_file_manager.stats
+        self.mutex = threading.Lock()  # Concurrent readers share the pool
+
+    def get(self, block_id):
+        """Returns the node stored in a block, reading it outside the pool's mutex on a miss."""
+        with self.mutex:
+            node = self.pages.get(block_id)
+            if node is not None:
+                self.stats.counters().cache_hits += 1
+                self.pages.move_to_end(block_id)
+                return node
+        self.stats.counters().cache_misses += 1
+        node = self.index_file_manager.node_class(self.index_file_manager, block_id)
+        with self.mutex:
+            cached = self.pages.get(block_id)
+            if cached is not None:
+                return cached
+            self.pages[block_id] = node
+            self._evict()
+        return node
+
+    def mark_dirty(self, node):
+        """Records that a node changed; it is written on eviction or flush."""
+        with self.mutex:
+            self.pages[node.block_id] = node
+            self.pages.move_to_end(node.block_id)
+            self.dirty.add(node.block_id)
+            self._evict()
+
+    def pin(self, node):
+        """Keeps a node resident until it is unpinned."""
+        self.pins[node.block_id] = self.pins.get(node.block_id, 0) + 1
+
+    def unpin(self, node):
+        """Releases one pin on a node."""
+        count = self.pins.get(node.block_id, 0) - 1
+        if count > 0:
+            self.pins[node.block_id] = count
+        else:
+            self.pins.pop(node.block_id, None)
+
+    def flush(self):
+        """Writes every dirty node back to the index file in block order."""
+        for block_id in sorted(self.dirty):
+            self._write_back(self.pages[block_id])
+        self.dirty.clear()
+
+    def discard(self, block_id):
+        """Drops one cached node without writing it, e.g. because its block was freed."""
+        self.pages.pop(block_id, None)
+        self.pins.pop(block_id, None)
+        self.dirty.discard(block_id)
+
+    def clear(self):
+        """Drops every cached node without writing anything."""
+        self.pages.clear()
+        self.pins.clear()
+        self.dirty.clear()
+
+    @property
+    def hits(self):
+        return self.stats.total('cache_hits')
+
+    @property
+    def misses(self):
+        return self.stats.total('cache_misses')
+
+    def snapshot(self):
+        """Returns cache counters as a dict."""
+        return {'hits': self.hits, 'misses': self.misses, 'pages': len(self.pages),
+                'capacity': self.capacity, 'dirty': len(self.dirty)}
+
+    def _evict(self):
+        """Evicts least recently used unpinned nodes until within capacity."""
+        excess = len(self.pages) - self.capacity
+        if excess <= 0:
+            return
+        victims = []
+        for block_id in self.pages:
+            if block_id not in self.pins:
+                victims.append(block_id)
+                if len(victims) == excess:
+                    break
+        for block_id in victims:
+            node = self.pages.pop(block_id)
+            if block_id in self.dirty:
+                self.dirty.discard(block_id)
+                self._write_back(node)
+
+    def _write_back(self, node):
+        try:
+            self.index_file_manager.pager.write_block(node.block_id, node._encode())
+        except IOError as e:
+            logger.error(str(e))
+            _report_error(f"Error: Could not write node to file '{self.index_file_manager.current_file}'.")
+
+class SnapshotPages:
+    """A snapshot's blocks: those the pager preserved sit in a temporary file, the rest stay in place."""
+
+    def __init__(self, pager, temp_dir=None):
+        self.pager = pager
+        self.temp_dir = temp_dir
+        self.block_count = MAX_UINT64  # Lowered to the snapshot's next_block once its header is read
+        self.log_pages = {}  # block_id -> log offset of its committed image when the snapshot opened
+        self.offsets = {}  # block_id -> offset of its kept image in the spill file
+        self.spill = None
+
+    def block_buffer(self, block_id):
+        return self.pager.read_snapshot_block(self, block_id), 0
+
+    def read_block(self, block_id):
+        return self.pager.read_snapshot_block(self, block_id)
+
+    def keep(self, block_id, data):
+        """Stores a block's image before the index overwrites it."""
+        if self.spill is None:
+            self.spill = tempfile.TemporaryFile(prefix='btree-snapshot-', dir=self.temp_dir)
+        self.offsets[block_id] = len(self.offsets) * self.pager.block_size
+        _pwrite(self.spill.fileno(), data, self.offsets[block_id])
+
+    def kept(self, block_id):
+        """Returns a stored image, or None if the block was not overwritten."""
+        offset = self.offsets.get(block_id)
+        if offset is None:
+            return None
+        return _pread(self.spill.fileno(), self.pager.block_size, offset)
+
+    def close(self):
+        """Stops the pager keeping blocks for the snapshot."""
+        self.pager.close_snapshot(self)
+
+    def discard(self):
+        """Drops the stored images."""
+        if self.spill is not None:
+            self.spill.close()
+            self.spill = None
+        self.offsets = {}
+
+class Snapshot:
+    """A read-only view of an index as of its last commit, with its own buffer pool and BTree."""
+
+    def __init__(self, index_file_manager):
+        manager = index_file_manager
+        self.current_file = manager.current_file
+        self.block_size = manager.block_size
+        self.min_degree = manager.min_degree
+        self.file_format = manager.file_format
+        self.codec = manager.codec
+        self.node_class = manager.node_class
+        self.cursor_class = manager.cursor_class
+        self.stats = manager.stats
+        self.bloom = None  # The index's filter may have been rebuilt without keys deleted since
+        self.pager = SnapshotPages(manager.pager, manager.temp_dir)
+        manager.pager.open_snapshot(self.pager)
+        try:
+            (_, root_block, next_block, *_) = HEADER_STRUCT.unpack_from(self.pager.read_block(0))
+            self.pager.block_count = next_block
+            self.header = {'root_block': root_block, 'next_block': next_block}
+            self.buffer_pool = BufferPool(self, SNAPSHOT_CACHE_PAGES)
+            self.btree = BTree(self)
+        except BaseException:
+            self.close()
+            raise
+
+    def get_node(self, block_id):
+        return self.buffer_pool.get(block_id)
+
+    def scan(self, lo=None, hi=None, reverse=False):
+        """Lazily yields the snapshot's (key, value) pairs with lo <= key <= hi in key order."""
+        return self.btree.scan(lo, hi, reverse)
+
+    def search(self, key):
+        """Returns the value the key had in the snapshot, or None."""
+        return self.btree.search(key)
+
+    def close(self):
+        """Releases the blocks kept for the snapshot."""
+        self.pager.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def _mix64(x):
+    """splitmix64 finalizer: spreads the bits of a 64-bit integer over all 64."""
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & MAX_UINT64
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & MAX_UINT64
+    return x ^ (x >> 31)
+
+class BloomFilter:
+    """Bit array answering "might this key be in the index?", saved in a sidecar file on close."""
+
+    def __init__(self, path, num_bits, num_hashes, capacity, fp_rate, bits=None, count=0):
+        self.path = path
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        self.capacity = capacity
+        self.fp_rate = fp_rate
+        self.bits = bits if bits is not None else bytearray((num_bits + 7) // 8)
+        self.count = count  # Keys added; deletes leave their bits set
+        self.stamp = None  # (root_block, next_block, free_block) of the index when saved
+        self.changed = False
+
+    @classmethod
+    def sized(cls, path, capacity, fp_rate=DEFAULT_BLOOM_FP_RATE):
+        """Returns an empty filter giving fp_rate false positives at capacity keys."""
+        capacity = max(capacity, MIN_BLOOM_CAPACITY)
+        num_bits = math.ceil(-capacity * math.log(fp_rate) / math.log(2) ** 2)
+        num_hashes = max(1, round(num_bits / capacity * math.log(2)))
+        return cls(path, num_bits, num_hashes, capacity, fp_rate)
+
+    @classmethod
+    def load(cls, path):
+        """Reads a sidecar file; its stamp is None unless it was saved cleanly."""
+        with open(path, 'rb') as bloom_file:
+            data = bloom_file.read()
+        if len(data) < BLOOM_HEADER_STRUCT.size or data[:8] != BLOOM_MAGIC:
+            raise FileFormatError(f"Error: File '{path}' is not a valid Bloom filter.")
+        (_, num_bits, num_hashes, capacity, count, fp_rate,
+         root_block, next_block, free_block, clean) = BLOOM_HEADER_STRUCT.unpack_from(data)
+        bits = bytearray(data[BLOOM_HEADER_STRUCT.size:])
+        if len(bits) != (num_bits + 7) // 8:
+            raise FileFormatError(f"Error: Bloom filter '{path}' is truncated.")
+        bloom = cls(path, num_bits, num_hashes, capacity, fp_rate, bits, count)
+        if clean:
+            bloom.stamp = (root_block, next_block, free_block)
+        return bloom
+
+    def save(self, stamp):
+        """Writes the filter to its sidecar atomically, stamped with the index header."""
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'wb') as bloom_file:
+            bloom_file.write(BLOOM_HEADER_STRUCT.pack(BLOOM_MAGIC, self.num_bits, self.num_hashes,
+                                                      self.capacity, self.count, self.fp_rate,
+                                                      *stamp, 1))
+            bloom_file.write(self.bits)
+            bloom_file.flush()
+            os.fsync(bloom_file.fileno())
+        os.replace(temp_path, self.path)
+        self.stamp = stamp
+        self.changed = False
+
+    def _mark_unsaved(self):
+        """Clears the sidecar's clean flag, durably, before the filter first changes."""
+        self.changed = True
+        try:
+            with open(self.path, 'r+b') as bloom_file:
+                bloom_file.seek(BLOOM_HEADER_STRUCT.size - 4)
+                bloom_file.write(bytes(4))
+                bloom_file.flush()
+                os.fsync(bloom_file.fileno())
+        except FileNotFoundError:
+            pass
+
+    def add(self, key):
+        if not self.changed:
+            self._mark_unsaved()
+        bits, num_bits = self.bits, self.num_bits
+        position = _mix64(key)
+        step = _mix64(position) | 1
+        for _ in range(self.num_hashes):
+            position = (position + step) % num_bits
+            bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def adding(self, pairs):
+        """Yields (key, value) pairs unchanged, adding each key to the filter."""
+        for pair in pairs:
+            self.add(pair[0])
+            yield pair
+
+    def might_contain(self, key):
+        bits, num_bits = self.bits, self.num_bits
+        position = _mix64(key)
+        step = _mix64(position) | 1
+        for _ in range(self.num_hashes):
+            position = (position + step) % num_bits
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def snapshot(self):
+        """Returns the filter's size and expected false-positive rate as a dict."""
+        fill = 1 - math.exp(-self.num_hashes * self.count / self.num_bits)
+        return {'keys': self.count, 'capacity': self.capacity, 'bytes': len(self.bits),
+                'hashes': self.num_hashes, 'fp_rate': self.fp_rate,
+                'estimated_fp_rate': fill ** self.num_hashes}
+
+_command_status = threading.local()  # Whether the command running on this thread failed
+
+def _report_error(message):
+    """Prints an error message and marks the command running on this thread as failed."""
+    _command_status.failed = True
+    print(message)
+
 class CommandHandler:
     """Handles user commands and input parsing."""
 
@@ -60,16 +1072,18 @@ class CommandHandler:
                 try:
                     self.handle_command(user_input)
                 except InvalidCommandError as e:
-                    print(e)
+                    _report_error(e)
                 except KeyboardInterrupt:
                     print("\nExiting program.")
+                    self.index_file_manager.close()
                     sys.exit(0)
         except EOFError:
             print("\nExiting program.")
+            self.index_file_manager.close()
             sys.exit(0)
 
     def handle_command(self, user_input):
-        """Parses and dispatches the user command."""
+        """Parses and dispatches the user command; returns False if it reported an error."""
         parts = user_input.strip().split()
         command = parts[0].lower()
         args = parts[1:]
@@ -77,160 +1091,742 @@ class CommandHandler:
             'create': self._handle_create,
             'open': self._handle_open,
             'insert': self._handle_insert,
+            'delete': self._handle_delete,
             'search': self._handle_search,
+            'msearch': self._handle_msearch,
+            'lookup': self._handle_lookup,
             'load': self._handle_load,
             'print': self._handle_print,
             'extract': self._handle_extract,
+            'range': self._handle_range,
+            'count': self._handle_count,
+            'rank': self._handle_rank,
+            'select': self._handle_select,
+            'min': self._handle_min,
+            'max': self._handle_max,
+            'stats': self._handle_stats,
+            'vacuum': self._handle_vacuum,
+            'reorganize': self._handle_reorganize,
+            'verify': self._handle_verify,
+            'bloom': self._handle_bloom,
             'quit': self._handle_quit,
             'help': self._handle_help
         }
 
-        if command in command_methods:
-            command_methods[command](args)
-        else:
+        if command not in command_methods:
             raise InvalidCommandError("Invalid command. Type 'help' for a list of commands.")
+        _command_status.failed = False
+        command_methods[command](args)
+        return not _command_status.failed
 
     def _handle_create(self, args):
-        if len(args) != 1:
-            print("Usage: create <filename>")
+        file_format = FILE_FORMATS[0]
+        if len(args) > 1 and args[-1] in FILE_FORMATS:
+            file_format = args.pop()
+        if not 1 <= len(args) <= 3:
+            _report_error(f"Usage: create <filename> [block_size] [degree] [{'|'.join(FILE_FORMATS)}]")
             return
         filename = args[0]
-        self.index_file_manager.create_and_open_index_file(filename)
+        try:
+            block_size = int(args[1]) if len(args) > 1 else BLOCK_SIZE
+            min_degree = int(args[2]) if len(args) > 2 else None
+        except ValueError:
+            _report_error("Error: Block size and degree must be integers.")
+            return
+        self.index_file_manager.create_and_open_index_file(filename, block_size, min_degree,
+                                                           file_format)
 
     def _handle_open(self, args):
         if len(args) != 1:
-            print("Usage: open <filename>")
+            _report_error("Usage: open <filename>")
             return
         filename = args[0]
         self.index_file_manager.open_index_file(filename)
 
     def _handle_insert(self, args):
         if len(args) != 2:
-            print("Usage: insert <key> <value>")
+            _report_error("Usage: insert <key> <value>")
             return
         try:
             key = int(args[0])
             value = int(args[1])
             if key < 0 or value < 0:
-                print("Error: Keys and values must be unsigned integers.")
+                _report_error("Error: Keys and values must be unsigned integers.")
                 return
             self.index_file_manager.insert_key_value(key, value)
             print(f"Successfully inserted key {key}.")
         except ValueError:
-            print("Error: Keys and values must be unsigned integers.")
+            _report_error("Error: Keys and values must be unsigned integers.")
         except DuplicateKeyError as e:
-            print(e)
+            _report_error(e)
+
+    def _handle_delete(self, args):
+        if len(args) != 1:
+            _report_error("Usage: delete <key>")
+            return
+        try:
+            key = int(args[0])
+            if key < 0:
+                _report_error("Error: Keys must be unsigned integers.")
+                return
+            self.index_file_manager.delete_key(key)
+            print(f"Successfully deleted key {key}.")
+        except ValueError:
+            _report_error("Error: Keys must be unsigned integers.")
+        except KeyNotFoundError as e:
+            _report_error(e)
 
     def _handle_search(self, args):
         if len(args) != 1:
-            print("Usage: search <key>")
+            _report_error("Usage: search <key>")
             return
         try:
             key = int(args[0])
             if key < 0:
-                print("Error: Keys must be unsigned integers.")
+                _report_error("Error: Keys must be unsigned integers.")
                 return
             value = self.index_file_manager.search_key(key)
             print(f"Found key {key} with value {value}.")
         except ValueError:
-            print("Error: Keys must be unsigned integers.")
+            _report_error("Error: Keys must be unsigned integers.")
         except KeyNotFoundError as e:
-            print(e)
+            _report_error(e)
+
+    def _handle_msearch(self, args):
+        if not args:
+            _report_error("Usage: msearch <key> [<key> ...]")
+            return
+        try:
+            keys = [int(arg) for arg in args]
+        except ValueError:
+            _report_error("Error: Keys must be unsigned integers.")
+            return
+        if any(key < 0 for key in keys):
+            _report_error("Error: Keys must be unsigned integers.")
+            return
+        values = self.index_file_manager.search_many(keys)
+        if values is None:
+            return
+        lines = []
+        for key, value in zip(keys, values):
+            if value is None:
+                _command_status.failed = True  # A miss fails msearch as it fails search
+                lines.append(f"Error: Key {key} not found in the index.\n")
+            else:
+                lines.append(f"Found key {key} with value {value}.\n")
+        sys.stdout.write(''.join(lines))
+
+    def _handle_lookup(self, args):
+        if len(args) != 2:
+            _report_error("Usage: lookup <keys_filename> <output_filename>")
+            return
+        self.index_file_manager.lookup_to_file(args[0], args[1])
 
     def _handle_load(self, args):
-        if len(args) != 1:
-            print("Usage: load <filename>")
+        if not 1 <= len(args) <= 4:
+            _report_error("Usage: load <filename> [fill_factor] [reject|skip|overwrite] [auto|insert|merge]")
             return
         filename = args[0]
-        self.index_file_manager.load_from_file(filename)
+        fill_factor = DEFAULT_FILL_FACTOR
+        policy = 'skip'
+        mode = 'auto'
+        for option in args[1:]:
+            if option in DUPLICATE_POLICIES:
+                policy = option
+            elif option in LOAD_MODES:
+                mode = option
+            else:
+                try:
+                    fill_factor = float(option)
+                except ValueError:
+                    fill_factor = 0
+                if not 0 < fill_factor <= 1:
+                    _report_error("Error: Fill factor must be a number in (0, 1].")
+                    return
+        self.index_file_manager.load_from_file(filename, fill_factor, policy, mode)
 
     def _handle_print(self, args):
         self.index_file_manager.print_all()
 
     def _handle_extract(self, args):
         if len(args) != 1:
-            print("Usage: extract <filename>")
+            _report_error("Usage: extract <filename>")
             return
         filename = args[0]
         self.index_file_manager.extract_to_file(filename)
 
+    def _handle_range(self, args):
+        if len(args) != 2:
+            _report_error("Usage: range <lo> <hi>")
+            return
+        try:
+            lo = int(args[0])
+            hi = int(args[1])
+        except ValueError:
+            _report_error("Error: Keys must be unsigned integers.")
+            return
+        if lo < 0 or hi < 0:
+            _report_error("Error: Keys must be unsigned integers.")
+            return
+        self.index_file_manager.print_range(lo, hi)
+
+    def _handle_count(self, args):
+        if len(args) not in (0, 2):
+            _report_error("Usage: count [<lo> <hi>]")
+            return
+        try:
+            bounds = [int(arg) for arg in args]
+        except ValueError:
+            _report_error("Error: Keys must be unsigned integers.")
+            return
+        if any(bound < 0 for bound in bounds):
+            _report_error("Error: Keys must be unsigned integers.")
+            return
+        count = self.index_file_manager.count_keys(*bounds)
+        if count is None:
+            return
+        if bounds:
+            print(f"{count} keys from {bounds[0]} to {bounds[1]}.")
+        else:
+            print(f"{count} keys in the index.")
+
+    def _handle_rank(self, args):
+        if len(args) != 1:
+            _report_error("Usage: rank <key>")
+            return
+        try:
+            key = int(args[0])
+        except ValueError:
+            key = -1
+        if key < 0:
+            _report_error("Error: Keys must be unsigned integers.")
+            return
+        result = self.index_file_manager.rank_key(key)
+        if result is None:
+            return
+        below, found = result
+        if found:
+            print(f"Key {key} is number {below + 1} in key order.")
+        else:
+            _report_error(f"Error: Key {key} not found in the index; {below} keys are below it.")
+
+    def _handle_select(self, args):
+        if len(args) != 1:
+            _report_error("Usage: select <position>")
+            return
+        try:
+            position = int(args[0])
+        except ValueError:
+            position = 0
+        if position < 1:
+            _report_error("Error: Position must be a positive integer.")
+            return
+        pair = self.index_file_manager.select_pair(position - 1)
+        if pair is not None:
+            print(f"Key number {position} is {pair[0]} with value {pair[1]}.")
+        elif self.index_file_manager.current_file:
+            _report_error(f"Error: The index has fewer than {position} keys.")
+
+    def _handle_min(self, args):
+        self._print_extreme(self.index_file_manager.min_pair, "Smallest")
+
+    def _handle_max(self, args):
+        self._print_extreme(self.index_file_manager.max_pair, "Largest")
+
+    def _print_extreme(self, find, label):
+        pair = find()
+        if pair is not None:
+            print(f"{label} key is {pair[0]} with value {pair[1]}.")
+        elif self.index_file_manager.current_file:
+            print("The B-tree is empty.")
+
+    def _handle_stats(self, args):
+        if args == ['reset']:
+            self.index_file_manager.reset_stats()
+            print("Statistics reset.")
+            return
+        if args:
+            _report_error("Usage: stats [reset]")
+            return
+        snapshot = self.index_file_manager.stats_snapshot()
+        lines = ["Index statistics:"]
+        if snapshot['file']:
+            lines.append(f"  file: {snapshot['file']} ({snapshot['format']}, height {snapshot['tree_height']}, "
+                         f"{snapshot['blocks']} blocks, {snapshot['free_blocks']} free)")
+        for name, value in snapshot['counters'].items():
+            lines.append(f"  {name}: {value}")
+        lines.append(f"  cache_hit_rate: {snapshot['cache_hit_rate']:.1%}")
+        if snapshot['cache']:
+            lines.append(f"  cache_pages: {snapshot['cache']['pages']} of {snapshot['cache']['capacity']}")
+        if 'wal' in snapshot:
+            lines.append(f"  wal_bytes: {snapshot['wal']['bytes']}, wal_syncs: {snapshot['wal']['syncs']}")
+        if 'bloom' in snapshot:
+            bloom = snapshot['bloom']
+            lines.append(f"  bloom: {bloom['keys']} keys of {bloom['capacity']}, {bloom['bytes']} bytes, "
+                         f"{bloom['hashes']} hashes, estimated false positives "
+                         f"{bloom['estimated_fp_rate']:.2%} (target {bloom['fp_rate']:.2%})")
+        if snapshot['operations']:
+            lines.append("Operation latencies (ms) and block I/O per operation:")
+            for name, op in sorted(snapshot['operations'].items()):
+                lines.append(f"  {name:<8} count {op['count']:<8} p50 {op['p50_ms']:.3f}  "
+                             f"p95 {op['p95_ms']:.3f}  p99 {op['p99_ms']:.3f}  max {op['max_ms']:.3f}  "
+                             f"reads {op['block_reads_per_op']:.1f}  writes {op['block_writes_per_op']:.1f}")
+        print('\n'.join(lines))
+
+    def _handle_vacuum(self, args):
+        if args:
+            _report_error("Usage: vacuum")
+            return
+        self.index_file_manager.vacuum()
+
+    def _handle_reorganize(self, args):
+        if len(args) > 1:
+            _report_error("Usage: reorganize [fill_factor]")
+            return
+        fill_factor = DEFAULT_FILL_FACTOR
+        if args:
+            try:
+                fill_factor = float(args[0])
+            except ValueError:
+                fill_factor = 0
+            if not 0 < fill_factor <= 1:
+                _report_error("Error: Fill factor must be a number in (0, 1].")
+                return
+        self.index_file_manager.reorganize(fill_factor)
+
+    def _handle_verify(self, args):
+        workers = None
+        if len(args) > 1:
+            _report_error("Usage: verify [workers]")
+            return
+        if args:
+            try:
+                workers = int(args[0])
+            except ValueError:
+                workers = 0
+            if workers < 1:
+                _report_error("Error: Workers must be a positive integer.")
+                return
+        try:
+            report = self.index_file_manager.verify(workers)
+        except (IOError, IndexFileError) as e:
+            logger.error(str(e))
+            _report_error("Error: Could not read the index file to verify it.")
+            return
+        if report is None:
+            return
+        lines = [f"Verified '{report['file']}' ({report['format']}, {report['block_size']}-byte blocks, "
+                 f"degree {report['min_degree']}): {report['blocks']} blocks in "
+                 f"{report['seconds']:.2f} s with {report['workers']} "
+                 f"{'process' if report['workers'] == 1 else 'processes'}.",
+                 f"  height {report['height']}, {report['internal_nodes']} internal nodes, "
+                 f"{report['leaves']} leaves, {report['keys']} keys, {report['free_blocks']} free blocks"]
+        for label, fill in (('leaf fill', report['leaf_fill']), ('internal fill', report['internal_fill'])):
+            lines.append(f"  {label}: average {fill['average']:.1%}; nodes per tenth of capacity "
+                         f"{' '.join(str(count) for count in fill['deciles'])}")
+        used = report['blocks'] - 1
+        lines.append(f"  fragmentation: {report['leaf_jumps']:.1%} of leaf-to-leaf steps in key order "
+                     f"leave the next block; "
+                     f"{report['free_blocks'] / used if used else 0:.1%} of blocks are free")
+        if not report['problem_count']:
+            lines.append("No problems found.")
+        print('\n'.join(lines))
+        if report['problem_count']:
+            lines = [f"Error: Found {report['problem_count']} problems:"]
+            lines.extend(f"  {problem}" for problem in report['problems'])
+            if report['problem_count'] > len(report['problems']):
+                lines.append(f"  ... and {report['problem_count'] - len(report['problems'])} more.")
+            _report_error('\n'.join(lines))
+
+    def _handle_bloom(self, args):
+        if args in ([], ['status']):
+            snapshot = self.index_file_manager.stats_snapshot()
+            if not snapshot['file']:
+                _report_error("Error: No index file is open.")
+            elif 'bloom' not in snapshot:
+                print("The index has no Bloom filter. Use 'bloom rebuild [fp_rate]' to add one.")
+            else:
+                bloom = snapshot['bloom']
+                print(f"Bloom filter: {bloom['keys']} keys of {bloom['capacity']}, {bloom['bytes']} bytes, "
+                      f"{bloom['hashes']} hashes, estimated false positives "
+                      f"{bloom['estimated_fp_rate']:.2%} (target {bloom['fp_rate']:.2%}).")
+            return
+        if args == ['off']:
+            self.index_file_manager.drop_bloom()
+            return
+        if args[0] != 'rebuild' or len(args) > 2:
+            _report_error("Usage: bloom [status | rebuild [fp_rate] | off]")
+            return
+        fp_rate = None
+        if len(args) == 2:
+            try:
+                fp_rate = float(args[1])
+            except ValueError:
+                fp_rate = 0
+            if not 0 < fp_rate < 1:
+                _report_error("Error: False-positive rate must be a number in (0, 1).")
+                return
+        self.index_file_manager.rebuild_bloom(fp_rate)
+
     def _handle_quit(self, args):
         confirm = input("Are you sure you want to quit? (yes/no): ").strip().lower()
         if confirm == 'yes':
             print("Exiting program.")
+            self.index_file_manager.close()
             sys.exit(0)
 
     def _handle_help(self, args):
         help_text = """
 Available commands:
-  create <filename>      Create a new index file.
+  create <filename> [block_size] [degree] [btree|bplus|counted]
+                         Create a new index file. Larger blocks (e.g. 4096)
+                         hold more keys per node and make the tree shallower.
+                         bplus keeps values only in leaves, which are linked
+                         for scans, so internal nodes hold more keys. counted
+                         stores subtree sizes so count, rank and select take
+                         one walk from the root instead of a scan.
   open <filename>        Open an existing index file.
   insert <key> <value>   Insert a key/value pair into the index.
+  delete <key>           Delete a key and its value from the index.
   search <key>           Search for a key in the index.
-  load <filename>        Load key/value pairs from a file.
+  msearch <key> ...      Search for several keys in one pass over the tree.
+  lookup <keys> <out>    Look up every key listed in a file (one per line) and
+                         write the key,value pairs found to another file.
+  load <filename> [fill] [reject|skip|overwrite] [auto|insert|merge]
+                         Load key/value pairs from a file. An empty index is
+                         bulk-built with nodes filled to the given fraction; a
+                         large batch is merged with the index into a new file,
+                         a small one inserted. Keys already in the index are
+                         skipped, replaced (overwrite) or abort the load (reject).
   print                  Print all key/value pairs in the index.
   extract <filename>     Extract all key/value pairs to a file.
+  range <lo> <hi>        Print the key/value pairs with lo <= key <= hi.
+  count [<lo> <hi>]      Count all keys, or those with lo <= key <= hi.
+  rank <key>             Show a key's position in key order (1 = smallest).
+  select <position>      Show the key at a position in key order.
+  min / max              Show the smallest / largest key.
+  stats [reset]          Show (or reset) I/O counters and operation latencies.
+  vacuum                 Move blocks into freed space and shrink the file.
+  reorganize [fill]      Rewrite the index with its leaves in key order, nodes
+                         filled to the given fraction, so scans read sequentially.
+  verify [workers]       Check that the file holds a valid tree, using a pool of
+                         processes, and report its height, fill and fragmentation.
+  bloom [status | rebuild [fp_rate] | off]
+                         Show, build (or resize) or remove the Bloom filter that
+                         answers searches for absent keys without reading the tree.
   quit                   Exit the program.
   help                   Show this help message.
 """
         print(help_text)
 
-class IndexFileManager:
-    """Manages index file operations."""
+class ScriptOutput:
+    """Buffered stand-in for sys.stdout while a script runs."""
 
-    def __init__(self):
-        self.current_file = None
-        self.header = None  # {'root_block': int, 'next_block': int}
-        self.btree = None  # Instance of BTree
+    def __init__(self, stream, json_lines=False):
+        self.stream = stream
+        self.json_lines = json_lines
+        self.pending = []
+        self.pending_size = 0
+        self.command_output = []
 
-    def create_and_open_index_file(self, filename):
-        """Creates and opens a new index file."""
-        if os.path.exists(filename):
-            overwrite = input(f"File '{filename}' already exists. Overwrite? (yes/no): ").strip().lower()
-            if overwrite != 'yes':
-                print("Aborted file creation.")
-                return
-        try:
-            self._write_header_to_file(filename)
-            self.open_index_file(filename)
-            print(f"Index file '{filename}' created and opened successfully.")
-        except IndexFileError as e:
-            print(e)
+    def write(self, text):
+        if self.json_lines:
+            self.command_output.append(text)
+        else:
+            self._buffer(text)
+        return len(text)
 
-    def _write_header_to_file(self, filename):
-        """Writes the header to a new index file."""
-        try:
-            with open(filename, 'wb') as f:
-                f.write(HEADER_MAGIC)
-                f.write(struct.pack('>Q', 0))  # Root block ID (initially zero)
-                f.write(struct.pack('>Q', 1))  # Next block ID to be added (starts at 1)
-                padding_size = BLOCK_SIZE - len(HEADER_MAGIC) - (2 * 8)
-                f.write(b'\x00' * padding_size)  # Padding to fill header block
-        except IOError as e:
-            logger.error(f"Could not write header to file '{filename}'. {str(e)}")
+    def flush(self):
+        pass  # Output reaches the stream in SCRIPT_BUFFER_BYTES chunks and at the end
+
+    def end_command(self, number, command, succeeded):
+        """Finishes one command's output."""
+        if self.json_lines:
+            self._buffer(json.dumps({'line': number, 'command': command, 'ok': succeeded,
+                                     'output': ''.join(self.command_output).splitlines()}) + "\n")
+            self.command_output = []
+
+    def drain(self):
+        """Writes everything buffered to the stream and flushes it."""
+        self.stream.write(''.join(self.pending))
+        self.stream.flush()
+        self.pending = []
+        self.pending_size = 0
+
+    def _buffer(self, text):
+        self.pending.append(text)
+        self.pending_size += len(text)
+        if self.pending_size >= SCRIPT_BUFFER_BYTES:
+            self.drain()
+
+class ScriptHandler(CommandHandler):
+    """Runs commands read from a script, answering questions with the manager's auto_confirm."""
+
+    def __init__(self, index_file_manager, json_lines=False, stop_on_error=False):
+        super().__init__(index_file_manager)
+        self.json_lines = json_lines
+        self.stop_on_error = stop_on_error
+        self.finished = False
+
+    def run(self, script):
+        """Runs every command in a script stream; returns 0 if all succeeded, else 1."""
+        output = ScriptOutput(sys.stdout, self.json_lines)
+        status = 0
+        sys.stdout = output
+        try:
+            for number, line in enumerate(script, 1):
+                command = line.strip()
+                if not command or command.startswith('#'):
+                    continue
+                try:
+                    succeeded = self.handle_command(command)
+                except InvalidCommandError as e:
+                    print(e)
+                    succeeded = False
+                output.end_command(number, command, succeeded)
+                if not succeeded:
+                    status = 1
+                    if self.stop_on_error:
+                        break
+                if self.finished:
+                    break
+        finally:
+            sys.stdout = output.stream
+            output.drain()
+        return status
+
+    def _handle_quit(self, args):
+        self.finished = True
+
+class IndexFileManager:
+    """Manages index file operations."""
+
+    def __init__(self, cache_pages=None, cache_bytes=None, load_memory=DEFAULT_LOAD_MEMORY,
+                 load_workers=1, temp_dir=None, use_mmap=False, wal=False, sync_policy='always',
+                 sync_every=DEFAULT_SYNC_EVERY, sync_interval_ms=DEFAULT_SYNC_INTERVAL_MS):
+        self.current_file = None
+        self.header = None  # {'root_block', 'next_block', 'block_size', 'min_degree', 'free_block', 'free_count', 'file_format'}
+        self.btree = None  # Instance of BTree
+        self.pager = None  # Instance of Pager for the open file
+        self.buffer_pool = None  # Instance of BufferPool for the open file
+        self.header_dirty = False
+        self.stats = IndexStats()
+        self.lock = ReadWriteLock()  # Shared for lookups and scans, exclusive for changes
+        self.snapshot_gate = threading.Condition()  # Guards replacing and snapshot opening
+        self.replacing = False  # True while the file is replaced or truncated; snapshots wait
+        self.block_size = BLOCK_SIZE
+        self.min_degree = MIN_DEGREE
+        self.file_format = FILE_FORMATS[0]
+        self.codec = None  # Instance of NodeCodec for the open file's layout
+        self.node_class = BTreeNode
+        self.cursor_class = Cursor
+        self.cache_pages = cache_pages
+        self.cache_bytes = cache_bytes
+        self.load_memory = load_memory
+        self.load_workers = load_workers
+        self.temp_dir = temp_dir
+        self.use_mmap = use_mmap
+        self.wal = wal
+        self.wal_options = {'sync_policy': sync_policy, 'sync_every': sync_every,
+                            'sync_interval_ms': sync_interval_ms}
+        self.auto_confirm = None  # Answer to overwrite questions; None asks on the terminal
+        self.bloom = None  # BloomFilter for the open file, if it has a sidecar
+
+    def confirm(self, question):
+        """Asks a yes/no question, unless auto_confirm already answers it."""
+        if self.auto_confirm is not None:
+            return self.auto_confirm
+        return input(f"{question} (yes/no): ").strip().lower() == 'yes'
+
+    def create_and_open_index_file(self, filename, block_size=BLOCK_SIZE, min_degree=None,
+                                   file_format=FILE_FORMATS[0]):
+        """Creates and opens a new index file; without a degree, the widest that fits a block is used."""
+        if file_format not in FILE_FORMATS:
+            _report_error(f"Error: Format must be one of {', '.join(FILE_FORMATS)}.")
+            return
+        codec_class = NODE_LAYOUTS[file_format][0]
+        if min_degree is None:
+            min_degree = codec_class.max_degree(block_size)
+        if block_size % BLOCK_SIZE or not BLOCK_SIZE <= block_size <= MAX_BLOCK_SIZE:
+            _report_error(f"Error: Block size must be a multiple of {BLOCK_SIZE} up to {MAX_BLOCK_SIZE}.")
+            return
+        if not 2 <= min_degree <= codec_class.max_degree(block_size):
+            _report_error(f"Error: Degree must be between 2 and {codec_class.max_degree(block_size)} "
+                          f"for {block_size}-byte {file_format} blocks.")
+            return
+        if os.path.exists(filename):  # Asked before taking the lock, so readers need not wait
+            if not self.confirm(f"File '{filename}' already exists. Overwrite?"):
+                _report_error("Aborted file creation.")
+                return
+        self._create(filename, block_size, min_degree, file_format)
+
+    @exclusive
+    def _create(self, filename, block_size, min_degree, file_format):
+        """Writes a new index file, replacing any file of that name, and opens it."""
+        if self.current_file and os.path.abspath(self.current_file) == os.path.abspath(filename):
+            self.close()  # Recreating the open file: let go of it (and its log) first
+        if os.path.exists(filename + BLOOM_SUFFIX):
+            os.remove(filename + BLOOM_SUFFIX)  # The old file's filter would describe other keys
+        try:
+            self._write_header_to_file(filename, block_size, min_degree, file_format)
+            self.open_index_file(filename)
+            print(f"Index file '{filename}' created and opened successfully.")
+        except IndexFileError as e:
+            _report_error(e)
+
+    def _write_header_to_file(self, filename, block_size=BLOCK_SIZE, min_degree=MIN_DEGREE,
+                              file_format=FILE_FORMATS[0]):
+        """Writes the header to a new index file."""
+        try:
+            if os.path.exists(filename + WAL_SUFFIX):
+                os.remove(filename + WAL_SUFFIX)  # A leftover log belongs to the old file
+            with open(filename, 'wb') as f:
+                # Root block ID starts at zero, next block ID to be added at 1
+                f.write(self._encode_header({'root_block': 0, 'next_block': 1,
+                                             'block_size': block_size, 'min_degree': min_degree,
+                                             'free_block': 0, 'free_count': 0,
+                                             'file_format': file_format}))
+        except IOError as e:
+            logger.error(f"Could not write header to file '{filename}'. {str(e)}")
             raise IndexFileError(f"Error: Could not create index file '{filename}'.")
 
+    @staticmethod
+    def _encode_header(header):
+        """Serializes the header dict into a full header block."""
+        data = HEADER_STRUCT.pack(HEADER_MAGIC, header['root_block'], header['next_block'],
+                                  header['block_size'], header['min_degree'],
+                                  header['free_block'], header['free_count'],
+                                  FILE_FORMATS.index(header['file_format']))
+        return data + b'\x00' * (header['block_size'] - len(data))  # Padding to fill header block
+
+    @exclusive
     def open_index_file(self, filename):
         """Opens an existing index file."""
         if not os.path.exists(filename):
-            print(f"Error: File '{filename}' does not exist.")
+            _report_error(f"Error: File '{filename}' does not exist.")
             return
         try:
-            with open(filename, 'rb') as f:
-                magic = f.read(8)
-                if magic != HEADER_MAGIC:
-                    raise FileFormatError(f"Error: File '{filename}' is not a valid index file.")
-                root_block = struct.unpack('>Q', f.read(8))[0]
-                next_block = struct.unpack('>Q', f.read(8))[0]
-                self.header = {'root_block': root_block, 'next_block': next_block}
-            self.current_file = filename
-            self.btree = BTree(self)
+            self._attach(filename)
             print(f"Index file '{filename}' opened successfully.")
-        except (IOError, FileFormatError) as e:
+        except (IOError, ValueError, FileFormatError) as e:
             logger.error(str(e))
-            print(e)
+            _report_error(e)
+
+    def _attach(self, filename, bloom=None):
+        """Reads a file's header and makes it the open file, closing the previous one."""
+        pager = Pager(filename, use_mmap=self.use_mmap, stats=self.stats)
+        try:
+            if pager.recovered:
+                print(f"Recovered {pager.recovered} committed transactions from the write-ahead log.")
+            block = pager.read_block(0)
+            if len(block) < HEADER_STRUCT.size or block[:8] != HEADER_MAGIC:
+                raise FileFormatError(f"Error: File '{filename}' is not a valid index file.")
+            (_, root_block, next_block, block_size, min_degree,
+             free_block, free_count, format_id) = HEADER_STRUCT.unpack_from(block)
+            block_size = block_size or BLOCK_SIZE
+            min_degree = min_degree or MIN_DEGREE
+            if format_id >= len(FILE_FORMATS):
+                raise FileFormatError(f"Error: File '{filename}' has an unknown node format.")
+            file_format = FILE_FORMATS[format_id]
+            codec_class, node_class, cursor_class = NODE_LAYOUTS[file_format]
+            codec = codec_class(block_size, min_degree)
+            pager.block_size = block_size
+            if self.wal:
+                pager.enable_wal(**self.wal_options)
+            self.close()
+        except BaseException:
+            pager.close()
+            raise
+        self.pager = pager
+        self.block_size = block_size
+        self.min_degree = min_degree
+        self.codec = codec
+        self.file_format = file_format
+        self.node_class = node_class
+        self.cursor_class = cursor_class
+        if self.cache_pages is not None:
+            cache_pages = self.cache_pages
+        else:
+            cache_pages = self.cache_bytes // block_size if self.cache_bytes else DEFAULT_CACHE_PAGES
+        self.buffer_pool = BufferPool(self, cache_pages)
+        self.header = {'root_block': root_block, 'next_block': next_block,
+                       'block_size': block_size, 'min_degree': min_degree,
+                       'free_block': free_block, 'free_count': free_count,
+                       'file_format': file_format}
+        self.header_dirty = False
+        self.current_file = filename
+        self.btree = BTree(self)
+        self.bloom = bloom if bloom is not None else self._load_bloom(filename)
+
+    @exclusive
+    def close(self):
+        """Commits pending changes and closes the open index file, if any."""
+        if self.pager is None:
+            return
+        self.commit()
+        bloom = self.bloom
+        if bloom is not None and (bloom.changed or bloom.stamp != self._bloom_stamp()):
+            try:
+                bloom.save(self._bloom_stamp())
+            except IOError as e:
+                logger.error(str(e))
+                _report_error(f"Error: Could not save the Bloom filter '{bloom.path}'.")
+        self.bloom = None
+        self.pager.close()
+        self.pager = None
+        self.buffer_pool = None
+        self.current_file = None
+        self.header = None
+        self.btree = None
+
+    @exclusive
+    def commit(self):
+        """Writes back dirty nodes, then the header if the tree changed, as one transaction."""
+        if self.pager is None:
+            return
+        self.buffer_pool.flush()
+        if self.header_dirty:
+            self.update_header()
+        self.pager.commit()
+        if self.bloom is not None and self.bloom.count > self.bloom.capacity:
+            try:
+                self.bloom = self._build_bloom(self.bloom.path, self.bloom.fp_rate)
+            except IOError as e:
+                logger.error(str(e))
+                _report_error(f"Error: Could not write the Bloom filter '{self.bloom.path}'.")
+
+    def get_node(self, block_id):
+        """Returns the node stored in a block through the buffer pool."""
+        return self.buffer_pool.get(block_id)
+
+    def cache_stats(self):
+        """Returns buffer pool hit/miss counters, or None if no file is open."""
+        return self.buffer_pool.snapshot() if self.buffer_pool else None
+
+    def stats_snapshot(self):
+        """Returns I/O counters, cache, tree and per-operation latency statistics as a dict."""
+        snapshot = self.stats.snapshot()
+        snapshot['file'] = self.current_file
+        snapshot['format'] = self.file_format if self.current_file else None
+        snapshot['tree_height'] = self.btree.height if self.btree else 0
+        snapshot['blocks'] = self.header['next_block'] if self.header else 0
+        snapshot['free_blocks'] = self.header['free_count'] if self.header else 0
+        snapshot['cache'] = self.cache_stats()
+        snapshot['open_snapshots'] = len(self.pager.snapshots) if self.pager else 0
+        wal = self.pager.wal if self.pager else None
+        if wal is not None:
+            snapshot['wal'] = {'bytes': wal.size, 'syncs': wal.syncs}
+        if self.bloom is not None:
+            snapshot['bloom'] = self.bloom.snapshot()
+        return snapshot
 
+    def reset_stats(self):
+        """Zeroes the I/O counters and latency statistics."""
+        self.stats.reset()
+
+    @exclusive
     @require_file_open
+    @timed('insert')
     def insert_key_value(self, key, value):
         """Inserts a key/value pair into the B-tree."""
         try:
@@ -240,8 +1836,55 @@ class IndexFileManager:
         except DuplicateKeyError as e:
             logger.error(str(e))
             raise
+        finally:
+            self.commit()
+
+    @shared
+    @require_file_open
+    def scan(self, lo=None, hi=None, reverse=False, limit=None):
+        """Returns the pairs with lo <= key <= hi (at most limit) in key order as a list."""
+        return list(itertools.islice(self.btree.scan(lo, hi, reverse), limit))
+
+    @exclusive
+    @require_file_open
+    @timed('delete')
+    def delete_key(self, key):
+        """Deletes a key and its value from the B-tree."""
+        try:
+            if not self.btree:
+                self.btree = BTree(self)
+            if not self.btree.delete(key):
+                raise KeyNotFoundError(f"Error: Key {key} not found in the index.")
+        finally:
+            self.commit()
+
+    @exclusive
+    @require_file_open
+    @timed('batch')
+    def apply_batch(self, operations):
+        """Applies put and delete operations with one commit; returns an error or None for each."""
+        results = []
+        try:
+            for operation, key, value in operations:
+                try:
+                    if operation == 'put':
+                        self.btree.insert(key, value)
+                    elif not self.btree.delete(key):
+                        raise KeyNotFoundError(f"Error: Key {key} not found in the index.")
+                    results.append(None)
+                except (DuplicateKeyError, KeyNotFoundError) as e:
+                    results.append(str(e))
+        except (IOError, IndexFileError) as e:
+            # The operations before the failing one are still committed below
+            logger.error(str(e))
+            results.extend([str(e)] * (len(operations) - len(results)))
+        finally:
+            self.commit()
+        return results
 
+    @shared
     @require_file_open
+    @timed('search')
     def search_key(self, key):
         """Searches for a key in the B-tree."""
         if not self.btree:
@@ -252,86 +1895,634 @@ class IndexFileManager:
         else:
             raise KeyNotFoundError(f"Error: Key {key} not found in the index.")
 
+    @shared
     @require_file_open
-    def load_from_file(self, filename):
-        """Loads key/value pairs from a file into the B-tree."""
-        if not os.path.exists(filename):
-            print(f"Error: File '{filename}' does not exist.")
+    @timed('msearch')
+    def search_many(self, keys):
+        """Searches for many keys in one walk; returns values in input order, None for misses."""
+        if not self.btree:
+            self.btree = BTree(self)
+        return self.btree.search_many(keys)
+
+    @shared
+    @require_file_open
+    @timed('count')
+    def count_keys(self, lo=None, hi=None):
+        """Returns the number of keys with lo <= key <= hi, or of all keys without bounds."""
+        if lo is None:
+            return self.btree.count()
+        if lo > hi:
+            return 0
+        return self.btree.count_below(hi, inclusive=True) - self.btree.count_below(lo)
+
+    @shared
+    @require_file_open
+    @timed('rank')
+    def rank_key(self, key):
+        """Returns (number of keys below key, whether key is in the index)."""
+        return self.btree.count_below(key), self.btree.search(key) is not None
+
+    @shared
+    @require_file_open
+    @timed('select')
+    def select_pair(self, index):
+        """Returns the (key, value) pair at a 0-based position in key order, or None."""
+        return self.btree.select(index)
+
+    @shared
+    @require_file_open
+    @timed('min')
+    def min_pair(self):
+        """Returns the pair with the smallest key, or None if the index is empty."""
+        return next(self.btree.scan(), None)
+
+    @shared
+    @require_file_open
+    @timed('max')
+    def max_pair(self):
+        """Returns the pair with the largest key, or None if the index is empty."""
+        return next(self.btree.scan(reverse=True), None)
+
+    @require_file_open
+    @timed('lookup')
+    def lookup_to_file(self, keys_filename, output_filename):
+        """Looks up the keys listed in a file and writes the key,value pairs found."""
+        if not os.path.exists(keys_filename):
+            _report_error(f"Error: File '{keys_filename}' does not exist.")
             return
+        if os.path.exists(output_filename):  # Asked before taking the lock, so writers need not wait
+            if not self.confirm(f"File '{output_filename}' already exists. Overwrite?"):
+                _report_error("Aborted lookup.")
+                return
+        self._lookup_keys(keys_filename, output_filename)
+
+    @shared
+    @require_file_open
+    def _lookup_keys(self, keys_filename, output_filename):
+        """Writes the key,value pairs found for the keys in one file to another."""
+        found = missing = 0
+
+        def flush(keys):
+            nonlocal found, missing
+            lines = []
+            for key, value in zip(keys, self.search_many(keys)):
+                if value is None:
+                    missing += 1
+                else:
+                    found += 1
+                    lines.append(f"{key},{value}\n")
+            output_file.write(''.join(lines))
+
         try:
-            batch = []
-            with open(filename, 'r') as input_file:
-                for line in input_file:
+            with open(keys_filename, 'r') as keys_file, \
+                    open(output_filename, 'w', buffering=1024 * 1024) as output_file:
+                keys = []
+                for line in keys_file:
                     line = line.strip()
                     if not line:
                         continue
                     try:
-                        key_str, value_str = line.split(',')
-                        key = int(key_str.strip())
-                        value = int(value_str.strip())
-                        if key < 0 or value < 0:
-                            print(f"Error: Invalid key/value '{line}'. Skipping.")
-                            continue
-                        batch.append((key, value))
+                        key = int(line)
                     except ValueError:
-                        print(f"Error: Invalid line '{line}'. Skipping.")
-            # Batch insertion
-            for key, value in batch:
-                try:
-                    self.insert_key_value(key, value)
-                except DuplicateKeyError as e:
-                    print(e)
+                        key = -1
+                    if key < 0:
+                        _report_error(f"Error: Invalid key '{line}'. Skipping.")
+                        continue
+                    keys.append(key)
+                    if len(keys) == LOOKUP_BATCH_KEYS:
+                        flush(keys)
+                        keys = []
+                flush(keys)
+            print(f"Looked up {found + missing} keys: {found} found, {missing} not found.")
+        except IOError as e:
+            logger.error(str(e))
+            _report_error(f"Error: Could not look up keys from '{keys_filename}' into '{output_filename}'.")
+
+    @exclusive
+    @require_file_open
+    @timed('load')
+    def load_from_file(self, filename, fill_factor=DEFAULT_FILL_FACTOR, policy='skip', mode='auto'):
+        """Loads key/value pairs from a file into the B-tree."""
+        if not os.path.exists(filename):
+            _report_error(f"Error: File '{filename}' does not exist.")
+            return
+        try:
+            if self.header['root_block'] == 0:
+                self._bulk_load(filename, fill_factor)
+            elif not self._load_into_existing(filename, fill_factor, policy, mode):
+                return
             print(f"Loaded key/value pairs from '{filename}'.")
         except IOError as e:
             logger.error(str(e))
-            print(f"Error: Could not read from file '{filename}'.")
+            _report_error(f"Error: Could not read from file '{filename}'.")
+
+    def _load_into_existing(self, filename, fill_factor, policy, mode):
+        """Sorts a load file and adds it to a non-empty index; returns False if nothing was loaded."""
+        sorter = ExternalSorter(self.load_memory, self.load_workers, self.temp_dir)
+        with sorter.sorted_pairs(filename) as (pairs, count):
+            if mode == 'auto':
+                # One sequential merge beats a descent per key once the batch touches most leaves
+                large = count >= MERGE_LOAD_RATIO * self._estimate_key_count()
+                # Replacing the file would pull it from under open snapshots
+                mode = 'merge' if large and self._begin_replace() else 'insert'
+            elif mode == 'merge' and not self._begin_replace():
+                _report_error("Error: Cannot merge into the index while snapshots are open.")
+                return False
+            if mode == 'insert':
+                return self._insert_sorted(pairs, policy)
+            try:
+                return self._merge_load(pairs, fill_factor, policy)
+            finally:
+                self._end_replace()
+
+    def _estimate_key_count(self):
+        """Returns the keys in the index: exact for counted files, estimated from blocks otherwise."""
+        if self.btree.counted:
+            return self.btree.count()
+        blocks = self.header['next_block'] - 1 - self.header['free_count']
+        return blocks * (2 * self.min_degree - 1) * ESTIMATED_FILL
+
+    def _insert_sorted(self, pairs, policy):
+        """Inserts sorted pairs in place, committing once at the end; returns False if rejected."""
+        if policy != 'reject':
+            return self._insert_pairs(pairs, policy)
+        # Checked for keys already in the index in one pass over a run file, then streamed again
+        with tempfile.TemporaryDirectory(prefix='btree-insert-', dir=self.temp_dir) as temp_dir:
+            run_path = os.path.join(temp_dir, 'batch.bin')
+            _write_run(run_path, pairs)
+            run = _read_run(run_path, MERGE_READ_BYTES)
+            while True:
+                keys = [key for key, _ in itertools.islice(run, LOOKUP_BATCH_KEYS)]
+                if not keys:
+                    break
+                for key, found in zip(keys, self.btree.search_many(keys)):
+                    if found is not None:
+                        run.close()
+                        _report_error(f"Error: Key {key} already exists in the index. Nothing was loaded.")
+                        return False
+            return self._insert_pairs(_read_run(run_path, MERGE_READ_BYTES), policy)
+
+    def _insert_pairs(self, pairs, policy):
+        """Inserts pairs one at a time, skipping or overwriting keys already present."""
+        added = duplicates = 0
+        try:
+            for key, value in pairs:
+                try:
+                    self.btree.insert(key, value)
+                    added += 1
+                except DuplicateKeyError:
+                    duplicates += 1
+                    if policy == 'overwrite':
+                        self.btree.update(key, value)
+        finally:
+            self.commit()
+        print(_load_summary(added, duplicates, policy))
+        return True
+
+    def _merge_load(self, pairs, fill_factor, policy):
+        """Rebuilds the index merged with sorted pairs into a new file; returns False if rejected."""
+        overwrite = policy == 'overwrite'
+        with tempfile.TemporaryDirectory(prefix='btree-merge-', dir=self.temp_dir) as temp_dir:
+            run_path = os.path.join(temp_dir, 'batch.bin')
+            _write_run(run_path, pairs)
+            try:
+                self.commit()
+                merge = {}
+                total = sum(1 for _ in _merge_pairs(self.btree.scan(),
+                                                    _read_run(run_path, MERGE_READ_BYTES),
+                                                    overwrite, merge))
+                if policy == 'reject' and merge['duplicates']:
+                    _report_error(f"Error: {merge['duplicates']} keys already exist in the index. "
+                                  f"Nothing was loaded.")
+                    return False
+                batch = _read_run(run_path, MERGE_READ_BYTES)
+                if self.bloom is not None:
+                    batch = self.bloom.adding(batch)
+                self._rewrite(_merge_pairs(self.btree.scan(), batch, overwrite, {}),
+                              total, fill_factor)
+                self.commit()  # Regrows the Bloom filter if the batch outgrew it
+            except (IOError, IndexFileError) as e:
+                logger.error(str(e))
+                _report_error(f"Error: Could not merge the batch into '{self.current_file}'.")
+                return False
+        print(_load_summary(merge['new'], merge['duplicates'], policy))
+        return True
+
+    def _bulk_load(self, filename, fill_factor):
+        """Sorts a load file within the memory budget and builds the empty tree bottom-up."""
+        sorter = ExternalSorter(self.load_memory, self.load_workers, self.temp_dir)
+        with sorter.sorted_pairs(filename) as (pairs, count):
+            if self.bloom is not None:
+                self.bloom = BloomFilter.sized(self.bloom.path, count * BLOOM_HEADROOM,
+                                               self.bloom.fp_rate)
+                pairs = self.bloom.adding(pairs)
+            BulkBuilder(self, fill_factor).build(pairs, count)
+        self.btree = BTree(self)
+        self.commit()
 
     @require_file_open
+    def open_snapshot(self):
+        """Returns a Snapshot of the index as of the last commit; close it when done."""
+        if self.pager.wal is not None:
+            # Taken at once, even mid-write, unless the file is being replaced or truncated
+            with self.snapshot_gate:
+                while self.replacing:
+                    self.snapshot_gate.wait()
+                if self.pager is None:
+                    raise IndexFileError("Error: No index file is open.")
+                return Snapshot(self)
+        with self.lock.reading():  # Without a log, waits for the running write to commit
+            return Snapshot(self)
+
+    def _begin_replace(self):
+        """Holds off new snapshots until _end_replace; returns False if any are already open."""
+        with self.snapshot_gate:
+            if self.pager.snapshots:
+                return False
+            self.replacing = True
+            return True
+
+    def _end_replace(self):
+        """Lets the snapshots held off by _begin_replace open."""
+        with self.snapshot_gate:
+            self.replacing = False
+            self.snapshot_gate.notify_all()
+
+    @require_file_open
+    @timed('print')
     def print_all(self):
-        """Prints all key/value pairs in the B-tree."""
-        if not self.btree:
-            self.btree = BTree(self)
-        all_key_values = []
-        self.btree.traverse(all_key_values)
-        if all_key_values:
-            print("Key/Value pairs in the index:")
-            for key, value in all_key_values:
-                print(f"Key: {key}, Value: {value}")
-        else:
-            print("The B-tree is empty.")
+        """Prints all key/value pairs in the B-tree, from a snapshot."""
+        try:
+            with self.open_snapshot() as snapshot:
+                pairs = snapshot.scan()
+                first = next(pairs, None)
+                if first is not None:
+                    print("Key/Value pairs in the index:")
+                    _write_pairs(sys.stdout, first, pairs, "Key: {}, Value: {}\n")
+                else:
+                    print("The B-tree is empty.")
+        except IndexFileError as e:
+            logger.error(str(e))
+            _report_error(e)
 
     @require_file_open
+    @timed('range')
+    def print_range(self, lo, hi):
+        """Prints the key/value pairs with lo <= key <= hi, from a snapshot."""
+        try:
+            with self.open_snapshot() as snapshot:
+                pairs = snapshot.scan(lo, hi)
+                first = next(pairs, None)
+                if first is not None:
+                    print(f"Key/Value pairs with keys from {lo} to {hi}:")
+                    _write_pairs(sys.stdout, first, pairs, "Key: {}, Value: {}\n")
+                else:
+                    print(f"No keys from {lo} to {hi} in the index.")
+        except IndexFileError as e:
+            logger.error(str(e))
+            _report_error(e)
+
+    @require_file_open
+    @timed('extract')
     def extract_to_file(self, filename):
-        """Extracts all key/value pairs to a file."""
+        """Extracts all key/value pairs to a file from a snapshot, so writes can continue meanwhile."""
         if os.path.exists(filename):
-            overwrite = input(f"File '{filename}' already exists. Overwrite? (yes/no): ").strip().lower()
-            if overwrite != 'yes':
-                print("Aborted extraction.")
+            if not self.confirm(f"File '{filename}' already exists. Overwrite?"):
+                _report_error("Aborted extraction.")
                 return
         try:
-            with open(filename, 'w') as output_file:
-                all_key_values = []
-                self.btree.traverse(all_key_values)
-                for key, value in all_key_values:
-                    output_file.write(f"{key},{value}\n")
+            with self.open_snapshot() as snapshot, \
+                    open(filename, 'w', buffering=1024 * 1024) as output_file:
+                pairs = snapshot.scan()
+                first = next(pairs, None)
+                if first is not None:
+                    _write_pairs(output_file, first, pairs, "{},{}\n")
             print(f"Extracted all key/value pairs to '{filename}'.")
+        except (IOError, IndexFileError) as e:
+            logger.error(str(e))
+            _report_error(f"Error: Could not write to file '{filename}'.")
+
+    @exclusive
+    @require_file_open
+    @timed('reorganize')
+    def reorganize(self, fill_factor=DEFAULT_FILL_FACTOR):
+        """Rewrites the index into a new file in scan order and swaps it in atomically."""
+        filename = self.current_file
+        if not self._begin_replace():
+            _report_error("Error: Cannot reorganize while snapshots are open.")
+            return
+        old_blocks = self.header['next_block']
+        try:
+            self.commit()
+            count = sum(1 for _ in self.btree.scan())
+            new_blocks = self._rewrite(self.btree.scan(), count, fill_factor)
+            print(f"Reorganized '{filename}': {count} keys in {new_blocks} blocks "
+                  f"(was {old_blocks}).")
+        except (IOError, IndexFileError) as e:
+            logger.error(str(e))
+            _report_error(f"Error: Could not reorganize '{filename}'.")
+        finally:
+            self._end_replace()
+
+    def _rewrite(self, pairs, count, fill_factor):
+        """Bulk-builds count sorted pairs into a new file and swaps it in; returns its block count."""
+        # The caller holds off snapshots; pairs may come from the index, untouched until the swap
+        filename = self.current_file
+        temp_filename = filename + REORGANIZE_SUFFIX
+        target = IndexFileManager(cache_pages=MIN_CACHE_PAGES)
+        target.stats = self.stats
+        try:
+            target._write_header_to_file(temp_filename, self.block_size, self.min_degree,
+                                         self.file_format)
+            target._attach(temp_filename)
+            BulkBuilder(target, fill_factor).build(pairs, count)
+            target.commit()
+            target.pager.sync()
+            new_blocks = target.header['next_block']
+            target.close()
+            bloom, self.bloom = self.bloom, None  # Carried over: pairs held no keys it lacks
+            self.close()
+            os.replace(temp_filename, filename)
+            self._attach(filename, bloom)
+            return new_blocks
+        except (IOError, IndexFileError):
+            target.close()
+            if os.path.exists(temp_filename):
+                os.remove(temp_filename)
+            if self.current_file is None:
+                self.open_index_file(filename)
+            raise
+
+    def _bloom_stamp(self):
+        """Returns the header fields a saved Bloom filter must match to be trusted."""
+        return (self.header['root_block'], self.header['next_block'], self.header['free_block'])
+
+    def _load_bloom(self, filename):
+        """Loads a file's Bloom filter sidecar, rebuilding it if it may be stale; None if absent."""
+        path = filename + BLOOM_SUFFIX
+        if not os.path.exists(path):
+            return None
+        fp_rate = DEFAULT_BLOOM_FP_RATE
+        try:
+            bloom = BloomFilter.load(path)
+            if bloom.stamp == self._bloom_stamp():
+                return bloom
+            fp_rate = bloom.fp_rate
+        except (IOError, FileFormatError) as e:
+            logger.error(str(e))
+        bloom = self._build_bloom(path, fp_rate)
+        print(f"Rebuilt the out-of-date Bloom filter '{path}'.")
+        return bloom
+
+    def _build_bloom(self, path, fp_rate):
+        """Sizes a filter for the keys in the tree, fills it from a scan and saves it."""
+        count = sum(1 for _ in self.btree.scan())
+        bloom = BloomFilter.sized(path, count * BLOOM_HEADROOM, fp_rate)
+        bloom.changed = True  # Nothing on disk to mark: the save below replaces the sidecar
+        for key, _ in self.btree.scan():
+            bloom.add(key)
+        bloom.save(self._bloom_stamp())
+        return bloom
+
+    @exclusive
+    @require_file_open
+    @timed('bloom')
+    def rebuild_bloom(self, fp_rate=None):
+        """Creates or rebuilds the Bloom filter sidecar, sized for the keys now in the index."""
+        if fp_rate is None:
+            fp_rate = self.bloom.fp_rate if self.bloom else DEFAULT_BLOOM_FP_RATE
+        try:
+            self.commit()
+            self.bloom = self._build_bloom(self.current_file + BLOOM_SUFFIX, fp_rate)
+            print(f"Built a Bloom filter for {self.bloom.count} keys "
+                  f"({len(self.bloom.bits)} bytes, {self.bloom.num_hashes} hashes).")
         except IOError as e:
             logger.error(str(e))
-            print(f"Error: Could not write to file '{filename}'.")
+            _report_error(f"Error: Could not write the Bloom filter for '{self.current_file}'.")
+
+    @exclusive
+    @require_file_open
+    def drop_bloom(self):
+        """Stops using the Bloom filter and deletes its sidecar."""
+        self.bloom = None
+        if os.path.exists(self.current_file + BLOOM_SUFFIX):
+            os.remove(self.current_file + BLOOM_SUFFIX)
+        print(f"Removed the Bloom filter for '{self.current_file}'.")
+
+    @shared
+    @require_file_open
+    @timed('verify')
+    def verify(self, workers=None):
+        """Checks the structure of the open index and returns a report dict (see Verifier)."""
+        return Verifier(self, workers).run()
+
+    def allocate_block(self):
+        """Reserves a block ID, reusing a freed block if any; the header is written on commit."""
+        self.header_dirty = True
+        block_id = self.header['free_block']
+        if block_id:
+            magic, next_free = FREE_BLOCK_STRUCT.unpack_from(self.pager.read_block(block_id))
+            if magic == FREE_MAGIC:
+                self.header['free_block'] = next_free
+                self.header['free_count'] -= 1
+                return block_id
+            logger.error(f"Block {block_id} on the free list is not free; dropping the free list.")
+            self.header['free_block'] = self.header['free_count'] = 0
+        block_id = self.header['next_block']
+        self.header['next_block'] += 1
+        return block_id
+
+    def free_block(self, node):
+        """Puts a node's block on the free list for reuse; the header is written on commit."""
+        self.buffer_pool.discard(node.block_id)
+        data = FREE_BLOCK_STRUCT.pack(FREE_MAGIC, self.header['free_block'])
+        self.pager.write_block(node.block_id, data + b'\x00' * (self.block_size - len(data)))
+        self.header['free_block'] = node.block_id
+        self.header['free_count'] += 1
+        self.header_dirty = True
+
+    @exclusive
+    @require_file_open
+    @timed('vacuum')
+    def vacuum(self):
+        """Compacts the file: live blocks move into free ones and the file is truncated after them."""
+        if not self._begin_replace():
+            _report_error("Error: Cannot vacuum while snapshots are open.")
+            return
+        try:
+            self.commit()
+            parents = {}  # live block id -> parent block id (0 for the root)
+            stale = set()  # live blocks whose parent pointer is wrong
+            root_block = self.header['root_block']
+            pending = [(root_block, 0)] if root_block else []
+            while pending:
+                block_id, parent = pending.pop()
+                parents[block_id] = parent
+                node = self.get_node(block_id)
+                if node.parent_block != parent:
+                    stale.add(block_id)
+                pending.extend((child, block_id) for child in node.children)
+            live = len(parents)
+            movers = sorted(block_id for block_id in parents if block_id > live)
+            targets = [block_id for block_id in range(1, live + 1) if block_id not in parents]
+            moves = dict(zip(movers, targets))
+            touched = stale | set(movers)
+            for block_id in movers:
+                if parents[block_id]:
+                    touched.add(parents[block_id])
+                node = self.get_node(block_id)
+                touched.update(node.children)
+                touched.update(node.links())
+            for block_id in sorted(touched):
+                node = self.get_node(block_id)
+                node.parent_block = moves.get(parents[block_id], parents[block_id])
+                node.renumber(moves)
+                if block_id in moves:
+                    self.buffer_pool.discard(block_id)
+                    node.block_id = moves[block_id]
+                node._write_node()
+            old_blocks = self.header['next_block']
+            self.header['root_block'] = moves.get(root_block, root_block)
+            self.header['next_block'] = live + 1
+            self.header['free_block'] = self.header['free_count'] = 0
+            self.header_dirty = True
+            self.commit()
+            self.pager.truncate(live + 1)
+            self.buffer_pool.clear()
+            self.btree = BTree(self)
+            print(f"Vacuum moved {len(moves)} blocks and shrank the file from "
+                  f"{old_blocks} to {live + 1} blocks.")
+        except (IOError, IndexFileError) as e:
+            logger.error(str(e))
+            _report_error(f"Error: Could not vacuum '{self.current_file}'.")
+        finally:
+            self._end_replace()
 
     def update_header(self):
         """Updates the header information in the index file."""
         try:
-            with open(self.current_file, 'r+b') as f:
-                f.seek(0)
-                f.write(HEADER_MAGIC)
-                f.write(struct.pack('>Q', self.header['root_block']))
-                f.write(struct.pack('>Q', self.header['next_block']))
-                padding_size = BLOCK_SIZE - len(HEADER_MAGIC) - (2 * 8)
-                f.write(b'\x00' * padding_size)  # Padding to fill header block
+            self.pager.write_block(0, self._encode_header(self.header))
+            self.stats.counters().header_writes += 1
+            self.header_dirty = False
         except IOError as e:
             logger.error(str(e))
-            print(f"Error: Could not update header in file '{self.current_file}'.")
+            _report_error(f"Error: Could not update header in file '{self.current_file}'.")
+
+class NodeCodec:
+    """Packs and unpacks nodes for one block size and minimal degree."""
+
+    def __init__(self, block_size, min_degree):
+        if not 2 <= min_degree <= self.max_degree(block_size):
+            raise FileFormatError(f"Error: Degree {min_degree} does not fit in {block_size}-byte blocks.")
+        self.max_keys = 2 * min_degree - 1
+        self.struct = struct.Struct(f'>3Q{self.max_keys}Q{self.max_keys}Q{self.max_keys + 1}Q')
+        self.padding = b'\x00' * (block_size - self.struct.size)
+        self.zeros = (0,) * (self.max_keys + 1)
+
+    @staticmethod
+    def max_degree(block_size):
+        """Returns the largest minimal degree whose nodes fit in a block."""
+        return (block_size - 8) // 48
+
+    def encode(self, node):
+        """Serializes a node into a full block with a single pack call."""
+        k = self.max_keys
+        zeros = self.zeros
+        return self.struct.pack(node.block_id, node.parent_block, node.num_keys,
+                                *node.keys, *zeros[:k - len(node.keys)],
+                                *node.values, *zeros[:k - len(node.values)],
+                                *node.children, *zeros[:k + 1 - len(node.children)]) + self.padding
+
+    def decode(self, node, buffer, offset=0):
+        """Fills a node from the block at buffer[offset:] with a single unpack call."""
+        fields = self.struct.unpack_from(buffer, offset)
+        k = self.max_keys
+        node.block_id, node.parent_block, num_keys = fields[:3]
+        node.num_keys = num_keys
+        node.keys = list(fields[3:3 + num_keys])
+        node.values = list(fields[3 + k:3 + k + num_keys])
+        # Block 0 is the header, so a leaf is a node whose first child is zero
+        children = 3 + 2 * k
+        node.children = list(fields[children:children + num_keys + 1]) if fields[children] else []
+
+class BPlusNodeCodec(NodeCodec):
+    """Packs and unpacks B+ tree nodes."""
+
+    def __init__(self, block_size, min_degree):
+        super().__init__(block_size, min_degree)
+        self.struct = struct.Struct(f'>6Q{self.max_keys}Q{self.max_keys + 1}Q')
+        self.padding = b'\x00' * (block_size - self.struct.size)
+
+    @staticmethod
+    def max_degree(block_size):
+        """Returns the largest minimal degree whose nodes fit in a block."""
+        return (block_size - 40) // 32
+
+    def encode(self, node):
+        """Serializes a node into a full block with a single pack call."""
+        k = self.max_keys
+        zeros = self.zeros
+        leaf = node.is_leaf()
+        payload = node.values if leaf else node.children
+        return self.struct.pack(node.block_id, node.parent_block, node.num_keys, leaf,
+                                node.prev_leaf, node.next_leaf,
+                                *node.keys, *zeros[:k - len(node.keys)],
+                                *payload, *zeros[:k + 1 - len(payload)]) + self.padding
+
+    def decode(self, node, buffer, offset=0):
+        """Fills a node from the block at buffer[offset:] with a single unpack call."""
+        fields = self.struct.unpack_from(buffer, offset)
+        k = self.max_keys
+        node.block_id, node.parent_block, num_keys, leaf, node.prev_leaf, node.next_leaf = fields[:6]
+        node.num_keys = num_keys
+        node.keys = list(fields[6:6 + num_keys])
+        if leaf:
+            node.values = list(fields[6 + k:6 + k + num_keys])
+            node.children = []
+        else:
+            node.values = []
+            node.children = list(fields[6 + k:7 + k + num_keys])
+
+class CountedNodeCodec(NodeCodec):
+    """Packs and unpacks order-statistic B-tree nodes."""
+
+    def __init__(self, block_size, min_degree):
+        super().__init__(block_size, min_degree)
+        k = self.max_keys
+        self.struct = struct.Struct(f'>3Q{k}Q{k}Q{k + 1}Q{k + 1}Q')
+        self.padding = b'\x00' * (block_size - self.struct.size)
+
+    @staticmethod
+    def max_degree(block_size):
+        """Returns the largest minimal degree whose nodes fit in a block."""
+        return (block_size - 8) // 64
+
+    def encode(self, node):
+        """Serializes a node into a full block with a single pack call."""
+        k = self.max_keys
+        zeros = self.zeros
+        return self.struct.pack(node.block_id, node.parent_block, node.num_keys,
+                                *node.keys, *zeros[:k - len(node.keys)],
+                                *node.values, *zeros[:k - len(node.values)],
+                                *node.children, *zeros[:k + 1 - len(node.children)],
+                                *node.counts, *zeros[:k + 1 - len(node.counts)]) + self.padding
+
+    def decode(self, node, buffer, offset=0):
+        """Fills a node from the block at buffer[offset:] with a single unpack call."""
+        fields = self.struct.unpack_from(buffer, offset)
+        k = self.max_keys
+        node.block_id, node.parent_block, num_keys = fields[:3]
+        node.num_keys = num_keys
+        node.keys = list(fields[3:3 + num_keys])
+        node.values = list(fields[3 + k:3 + k + num_keys])
+        children = 3 + 2 * k
+        if fields[children]:
+            counts = children + k + 1
+            node.children = list(fields[children:children + num_keys + 1])
+            node.counts = list(fields[counts:counts + num_keys + 1])
+        else:
+            node.children = []
+            node.counts = []
 
 class BTreeNode:
     """Represents a node in the B-tree."""
@@ -345,69 +2536,30 @@ class BTreeNode:
         self.values = []
         self.children = []
         if is_new:
-            self.block_id = self.index_file_manager.header['next_block']
-            self.index_file_manager.header['next_block'] += 1
+            self.block_id = self.index_file_manager.allocate_block()
             self._write_node()
-            self.index_file_manager.update_header()
         elif block_id is not None:
             self._read_node()
 
     def _write_node(self):
-        """Writes the node to the file at its block position."""
-        try:
-            with open(self.index_file_manager.current_file, 'r+b') as f:
-                f.seek(self.block_id * BLOCK_SIZE)
-                data = b''
-                data += struct.pack('>Q', self.block_id)
-                data += struct.pack('>Q', self.parent_block)
-                data += struct.pack('>Q', self.num_keys)
-                keys_padded = self.keys + [0] * (19 - len(self.keys))
-                values_padded = self.values + [0] * (19 - len(self.values))
-                for key in keys_padded:
-                    data += struct.pack('>Q', key)
-                for value in values_padded:
-                    data += struct.pack('>Q', value)
-                children_padded = self.children + [0] * (20 - len(self.children))
-                for child in children_padded:
-                    data += struct.pack('>Q', child)
-                data += b'\x00' * (BLOCK_SIZE - len(data))
-                f.write(data)
-        except IOError as e:
-            logger.error(str(e))
-            print(f"Error: Could not write node to file '{self.index_file_manager.current_file}'.")
+        """Hands the node to the buffer pool, which writes it back on eviction or commit."""
+        self.index_file_manager.buffer_pool.mark_dirty(self)
+
+    def _encode(self):
+        """Serializes the node into a full block."""
+        return self.index_file_manager.codec.encode(self)
 
     def _read_node(self):
         """Reads the node from the file at its block position."""
         try:
-            with open(self.index_file_manager.current_file, 'rb') as f:
-                f.seek(self.block_id * BLOCK_SIZE)
-                block_data = f.read(BLOCK_SIZE)
-                if len(block_data) < BLOCK_SIZE:
-                    print(f"Error: Incomplete block read for block_id {self.block_id}.")
-                    return
-                self.block_id, self.parent_block, self.num_keys = struct.unpack('>QQQ', block_data[:24])
-                offset = 24
-                self.keys = []
-                for _ in range(19):
-                    key = struct.unpack('>Q', block_data[offset:offset+8])[0]
-                    self.keys.append(key)
-                    offset += 8
-                self.values = []
-                for _ in range(19):
-                    value = struct.unpack('>Q', block_data[offset:offset+8])[0]
-                    self.values.append(value)
-                    offset += 8
-                self.children = []
-                for _ in range(20):
-                    child = struct.unpack('>Q', block_data[offset:offset+8])[0]
-                    self.children.append(child)
-                    offset += 8
-                self.keys = self.keys[:self.num_keys]
-                self.values = self.values[:self.num_keys]
-                self.children = self.children[:self.num_keys + 1] if any(self.children) else []
+            buffer, offset = self.index_file_manager.pager.block_buffer(self.block_id)
+            if len(buffer) - offset < self.index_file_manager.block_size:
+                _report_error(f"Error: Incomplete block read for block_id {self.block_id}.")
+                return
+            self.index_file_manager.codec.decode(self, buffer, offset)
         except IOError as e:
             logger.error(str(e))
-            print(f"Error: Could not read node from file '{self.index_file_manager.current_file}'.")
+            _report_error(f"Error: Could not read node from file '{self.index_file_manager.current_file}'.")
 
     def is_leaf(self):
         """Checks if the node is a leaf node."""
@@ -415,53 +2567,59 @@ class BTreeNode:
 
     def insert_non_full(self, key, value):
         """Inserts a key/value pair into a node that is not full."""
-        i = self.num_keys - 1
+        i = bisect.bisect_left(self.keys, key)
+        if i < self.num_keys and key == self.keys[i]:
+            raise DuplicateKeyError(f"Error: Key {key} already exists in the index.")
         if self.is_leaf():
-            self.keys.append(0)
-            self.values.append(0)
-            while i >= 0 and key < self.keys[i]:
-                self.keys[i + 1] = self.keys[i]
-                self.values[i + 1] = self.values[i]
-                i -= 1
-            if i >= 0 and key == self.keys[i]:
-                raise DuplicateKeyError(f"Error: Key {key} already exists in the index.")
-            self.keys[i + 1] = key
-            self.values[i + 1] = value
+            self.keys.insert(i, key)
+            self.values.insert(i, value)
             self.num_keys += 1
             self._write_node()
             return True
         else:
-            while i >= 0 and key < self.keys[i]:
-                i -= 1
-            i += 1
-            child_node = BTreeNode(self.index_file_manager, self.children[i])
-            if child_node.num_keys == 2 * MIN_DEGREE - 1:
+            child_node = self.index_file_manager.get_node(self.children[i])
+            if child_node.num_keys == 2 * self.index_file_manager.min_degree - 1:
                 self.split_child(i, child_node)
                 if key > self.keys[i]:
                     i += 1
                 elif key == self.keys[i]:
                     raise DuplicateKeyError(f"Error: Key {key} already exists in the index.")
-            child_node = BTreeNode(self.index_file_manager, self.children[i])
-            return child_node.insert_non_full(key, value)
+                child_node = self.index_file_manager.get_node(self.children[i])
+            return self._insert_into_child(i, child_node, key, value)
+
+    def _insert_into_child(self, i, child, key, value):
+        """Inserts a pair into child i, which is not full."""
+        return child.insert_non_full(key, value)
 
     def split_child(self, i, y):
         """Splits a full child node."""
-        z = BTreeNode(self.index_file_manager, is_new=True)
-        z.parent_block = self.block_id
-        t = MIN_DEGREE
+        buffer_pool = self.index_file_manager.buffer_pool
+        buffer_pool.pin(self)
+        buffer_pool.pin(y)
+        try:
+            self._split_child(i, y)
+        finally:
+            buffer_pool.unpin(y)
+            buffer_pool.unpin(self)
+
+    def _split_child(self, i, y):
+        self.index_file_manager.stats.counters().node_splits += 1
+        z = type(self)(self.index_file_manager, is_new=True)
+        t = self.index_file_manager.min_degree
         z.num_keys = t - 1
         z.keys = y.keys[t:]
         z.values = y.values[t:]
         if not y.is_leaf():
             z.children = y.children[t:]
+        median_key, median_value = y.keys[t - 1], y.values[t - 1]
         y.keys = y.keys[:t - 1]
         y.values = y.values[:t - 1]
         y.children = y.children[:t] if not y.is_leaf() else []
         y.num_keys = t - 1
-        y._write_node()
-        z._write_node()
-        self.keys.insert(i, y.keys.pop())
-        self.values.insert(i, y.values.pop())
+        for child_block in z.children:
+            self._adopt(child_block, z)
+        self.keys.insert(i, median_key)
+        self.values.insert(i, median_value)
         self.children.insert(i + 1, z.block_id)
         self.num_keys += 1
         self._write_node()
@@ -470,29 +2628,432 @@ class BTreeNode:
         z.parent_block = self.block_id
         z._write_node()
 
+    def links(self):
+        """Returns the blocks this node refers to besides its children (none in a B-tree)."""
+        return []
+
+    def renumber(self, moves):
+        """Rewrites the block ids this node refers to after blocks were moved."""
+        self.children = [moves.get(child, child) for child in self.children]
+
+    def _adopt(self, child_block, parent):
+        """Points a child's parent_block at its new parent."""
+        child = self.index_file_manager.get_node(child_block)
+        if child.parent_block != parent.block_id:
+            child.parent_block = parent.block_id
+            child._write_node()
+
+    def delete(self, key):
+        """Deletes a key from the subtree rooted at this node; returns whether it was found."""
+        get_node = self.index_file_manager.get_node
+        t = self.index_file_manager.min_degree
+        i = bisect.bisect_left(self.keys, key)
+        if i < self.num_keys and self.keys[i] == key:
+            if self.is_leaf():
+                del self.keys[i]
+                del self.values[i]
+                self.num_keys -= 1
+                self._write_node()
+                return True
+            left = get_node(self.children[i])
+            if left.num_keys >= t:
+                node = left
+                while not node.is_leaf():
+                    node = get_node(node.children[-1])
+                self.keys[i], self.values[i] = node.keys[-1], node.values[-1]
+                self._write_node()
+                return self._delete_from_child(left, node.keys[-1])
+            right = get_node(self.children[i + 1])
+            if right.num_keys >= t:
+                node = right
+                while not node.is_leaf():
+                    node = get_node(node.children[0])
+                self.keys[i], self.values[i] = node.keys[0], node.values[0]
+                self._write_node()
+                return self._delete_from_child(right, node.keys[0])
+            return self._delete_from_child(self._merge_children(i), key)
+        if self.is_leaf():
+            return False
+        child = get_node(self.children[i])
+        if child.num_keys < t:
+            child = self._fill_child(i, child)
+        return self._delete_from_child(child, key)
+
+    def _delete_from_child(self, child, key):
+        """Deletes a key from the subtree of a child holding at least t keys."""
+        return child.delete(key)
+
+    def _fill_child(self, i, child):
+        """Gives child i at least t keys; returns the node holding its keys afterwards."""
+        buffer_pool = self.index_file_manager.buffer_pool
+        t = self.index_file_manager.min_degree
+        get_node = self.index_file_manager.get_node
+        buffer_pool.pin(self)
+        buffer_pool.pin(child)
+        try:
+            if i > 0:
+                left = get_node(self.children[i - 1])
+                if left.num_keys >= t:
+                    self._rotate_right(i - 1, left, child)
+                    return child
+            if i < self.num_keys:
+                right = get_node(self.children[i + 1])
+                if right.num_keys >= t:
+                    self._rotate_left(i, child, right)
+                    return child
+                return self._merge_children(i)
+            return self._merge_children(i - 1)
+        finally:
+            buffer_pool.unpin(child)
+            buffer_pool.unpin(self)
+
+    def _rotate_right(self, i, left, right):
+        """Moves separator i down into right and left's last key up to replace it."""
+        right.keys.insert(0, self.keys[i])
+        right.values.insert(0, self.values[i])
+        self.keys[i], self.values[i] = left.keys.pop(), left.values.pop()
+        if not left.is_leaf():
+            moved = left.children.pop()
+            right.children.insert(0, moved)
+            self._adopt(moved, right)
+        self._write_siblings(left, right)
+
+    def _rotate_left(self, i, left, right):
+        """Moves separator i down into left and right's first key up to replace it."""
+        left.keys.append(self.keys[i])
+        left.values.append(self.values[i])
+        self.keys[i], self.values[i] = right.keys.pop(0), right.values.pop(0)
+        if not right.is_leaf():
+            moved = right.children.pop(0)
+            left.children.append(moved)
+            self._adopt(moved, left)
+        self._write_siblings(left, right)
+
+    def _write_siblings(self, left, right):
+        left.num_keys = len(left.keys)
+        right.num_keys = len(right.keys)
+        left._write_node()
+        right._write_node()
+        self._write_node()
+
+    def _merge_children(self, i):
+        """Merges child i + 1 and separator i into child i, frees child i + 1 and returns child i."""
+        index_file_manager = self.index_file_manager
+        buffer_pool = index_file_manager.buffer_pool
+        left = index_file_manager.get_node(self.children[i])
+        buffer_pool.pin(self)
+        buffer_pool.pin(left)
+        try:
+            right = index_file_manager.get_node(self.children[i + 1])
+            index_file_manager.stats.counters().node_merges += 1
+            self._absorb(i, left, right)
+            left.num_keys = len(left.keys)
+            del self.children[i + 1]
+            self.num_keys -= 1
+            left._write_node()
+            self._write_node()
+            index_file_manager.free_block(right)
+            return left
+        finally:
+            buffer_pool.unpin(left)
+            buffer_pool.unpin(self)
+
+    def _absorb(self, i, left, right):
+        """Moves separator i and all of right's contents onto the end of left."""
+        left.keys.append(self.keys.pop(i))
+        left.values.append(self.values.pop(i))
+        left.keys.extend(right.keys)
+        left.values.extend(right.values)
+        for child_block in right.children:
+            self._adopt(child_block, left)
+        left.children.extend(right.children)
+
     def search(self, key):
         """Searches for a key in the subtree rooted at this node."""
-        i = 0
-        while i < self.num_keys and key > self.keys[i]:
-            i += 1
+        i = bisect.bisect_left(self.keys, key)
         if i < self.num_keys and key == self.keys[i]:
             return self.values[i]
         elif self.is_leaf():
             return None
         else:
-            child_node = BTreeNode(self.index_file_manager, self.children[i])
+            child_node = self.index_file_manager.get_node(self.children[i])
             return child_node.search(key)
 
-    def traverse(self, result_list):
-        """Performs an in-order traversal of the subtree rooted at this node."""
-        for i in range(self.num_keys):
-            if not self.is_leaf():
-                child_node = BTreeNode(self.index_file_manager, self.children[i])
-                child_node.traverse(result_list)
-            result_list.append((self.keys[i], self.values[i]))
-        if not self.is_leaf():
-            child_node = BTreeNode(self.index_file_manager, self.children[self.num_keys])
-            child_node.traverse(result_list)
+    def update(self, key, value):
+        """Replaces the value stored under key in this subtree; returns whether key was found."""
+        i = bisect.bisect_left(self.keys, key)
+        if i < self.num_keys and key == self.keys[i]:
+            self.values[i] = value
+            self._write_node()
+            return True
+        if self.is_leaf():
+            return False
+        return self.index_file_manager.get_node(self.children[i]).update(key, value)
+
+    def search_many(self, keys, order, lo, hi, results):
+        """Resolves the sorted probes keys[lo:hi] in this subtree, visiting each child once."""
+        n = self.num_keys
+        j = lo
+        while j < hi:
+            key = keys[j]
+            i = bisect.bisect_left(self.keys, key)
+            if i < n and self.keys[i] == key:
+                stop = bisect.bisect_right(keys, key, j, hi)
+                value = self.values[i]
+                for p in range(j, stop):
+                    results[order[p]] = value
+            else:
+                # Every remaining probe below keys[i] falls into child i
+                stop = hi if i == n else bisect.bisect_left(keys, self.keys[i], j, hi)
+                if not self.is_leaf():
+                    child_node = self.index_file_manager.get_node(self.children[i])
+                    child_node.search_many(keys, order, j, stop, results)
+            j = stop
+
+class CountedTreeNode(BTreeNode):
+    """Represents a node in an order-statistic B-tree."""
+
+    def __init__(self, index_file_manager, block_id=None, is_new=False):
+        self.counts = []
+        super().__init__(index_file_manager, block_id, is_new)
+
+    def size(self):
+        """Returns the number of keys in the subtree rooted at this node."""
+        return self.num_keys + sum(self.counts)
+
+    def _insert_into_child(self, i, child, key, value):
+        self.counts[i] += 1
+        try:
+            return child.insert_non_full(key, value)
+        except DuplicateKeyError:
+            self.counts[i] -= 1
+            raise
+        finally:
+            # Written even on a duplicate: the node may have been evicted with the
+            # provisional count while the insert went down the tree
+            self._write_node()
+
+    def _split_child(self, i, y):
+        t = self.index_file_manager.min_degree
+        counts = y.counts
+        super()._split_child(i, y)
+        z = self.index_file_manager.get_node(self.children[i + 1])
+        y.counts, z.counts = counts[:t], counts[t:]
+        # A new root has no count for its only child yet, so assign the slice
+        self.counts[i:i + 1] = [y.size(), z.size()]
+        y._write_node()
+        z._write_node()
+        self._write_node()
+
+    def _delete_from_child(self, child, key):
+        found = child.delete(key)
+        if found:
+            self.counts[self.children.index(child.block_id)] -= 1
+            self._write_node()
+        return found
+
+    def _rotate_right(self, i, left, right):
+        moved = 0
+        if not left.is_leaf():
+            moved = left.counts.pop()
+            right.counts.insert(0, moved)
+        self.counts[i] -= 1 + moved
+        self.counts[i + 1] += 1 + moved
+        super()._rotate_right(i, left, right)
+
+    def _rotate_left(self, i, left, right):
+        moved = 0
+        if not right.is_leaf():
+            moved = right.counts.pop(0)
+            left.counts.append(moved)
+        self.counts[i] += 1 + moved
+        self.counts[i + 1] -= 1 + moved
+        super()._rotate_left(i, left, right)
+
+    def _absorb(self, i, left, right):
+        self.counts[i] += 1 + self.counts.pop(i + 1)
+        left.counts.extend(right.counts)
+        super()._absorb(i, left, right)
+
+class BPlusTreeNode(BTreeNode):
+    """Represents a node in a B+ tree."""
+
+    def __init__(self, index_file_manager, block_id=None, is_new=False):
+        self.prev_leaf = 0
+        self.next_leaf = 0
+        super().__init__(index_file_manager, block_id, is_new)
+
+    def links(self):
+        """Returns the neighbouring leaves' blocks."""
+        return [block_id for block_id in (self.prev_leaf, self.next_leaf) if block_id]
+
+    def renumber(self, moves):
+        """Rewrites the block ids this node refers to after blocks were moved."""
+        super().renumber(moves)
+        self.prev_leaf = moves.get(self.prev_leaf, self.prev_leaf)
+        self.next_leaf = moves.get(self.next_leaf, self.next_leaf)
+
+    def _leaf_for(self, key):
+        """Returns the leaf of this subtree where key belongs."""
+        get_node = self.index_file_manager.get_node
+        node = self
+        while not node.is_leaf():
+            node = get_node(node.children[bisect.bisect_right(node.keys, key)])
+        return node
+
+    def insert_non_full(self, key, value):
+        """Inserts a key/value pair into a node that is not full."""
+        if self.is_leaf():
+            i = bisect.bisect_left(self.keys, key)
+            if i < self.num_keys and key == self.keys[i]:
+                raise DuplicateKeyError(f"Error: Key {key} already exists in the index.")
+            self.keys.insert(i, key)
+            self.values.insert(i, value)
+            self.num_keys += 1
+            self._write_node()
+            return True
+        i = bisect.bisect_right(self.keys, key)
+        child_node = self.index_file_manager.get_node(self.children[i])
+        if child_node.num_keys == 2 * self.index_file_manager.min_degree - 1:
+            self.split_child(i, child_node)
+            if key >= self.keys[i]:
+                i += 1
+            child_node = self.index_file_manager.get_node(self.children[i])
+        return child_node.insert_non_full(key, value)
+
+    def _split_child(self, i, y):
+        self.index_file_manager.stats.counters().node_splits += 1
+        z = BPlusTreeNode(self.index_file_manager, is_new=True)
+        t = self.index_file_manager.min_degree
+        if y.is_leaf():
+            # The right half keeps every pair; its first key is copied up
+            z.keys = y.keys[t - 1:]
+            z.values = y.values[t - 1:]
+            y.keys = y.keys[:t - 1]
+            y.values = y.values[:t - 1]
+            separator = z.keys[0]
+            z.prev_leaf = y.block_id
+            z.next_leaf = y.next_leaf
+            y.next_leaf = z.block_id
+            if z.next_leaf:
+                following = self.index_file_manager.get_node(z.next_leaf)
+                following.prev_leaf = z.block_id
+                following._write_node()
+        else:
+            separator = y.keys[t - 1]
+            z.keys = y.keys[t:]
+            z.children = y.children[t:]
+            y.keys = y.keys[:t - 1]
+            y.children = y.children[:t]
+            for child_block in z.children:
+                self._adopt(child_block, z)
+        y.num_keys = len(y.keys)
+        z.num_keys = len(z.keys)
+        self.keys.insert(i, separator)
+        self.children.insert(i + 1, z.block_id)
+        self.num_keys += 1
+        self._write_node()
+        y.parent_block = self.block_id
+        y._write_node()
+        z.parent_block = self.block_id
+        z._write_node()
+
+    def delete(self, key):
+        """Deletes a key from the subtree rooted at this node; returns whether it was found."""
+        if self.is_leaf():
+            i = bisect.bisect_left(self.keys, key)
+            if i == self.num_keys or self.keys[i] != key:
+                return False
+            del self.keys[i]
+            del self.values[i]
+            self.num_keys -= 1
+            self._write_node()
+            return True
+        i = bisect.bisect_right(self.keys, key)
+        child = self.index_file_manager.get_node(self.children[i])
+        if child.num_keys < self.index_file_manager.min_degree:
+            child = self._fill_child(i, child)
+        return child.delete(key)
+
+    def _rotate_right(self, i, left, right):
+        """Moves left's last entry into right and updates separator i."""
+        if right.is_leaf():
+            right.keys.insert(0, left.keys.pop())
+            right.values.insert(0, left.values.pop())
+            self.keys[i] = right.keys[0]
+        else:
+            right.keys.insert(0, self.keys[i])
+            self.keys[i] = left.keys.pop()
+            moved = left.children.pop()
+            right.children.insert(0, moved)
+            self._adopt(moved, right)
+        self._write_siblings(left, right)
+
+    def _rotate_left(self, i, left, right):
+        """Moves right's first entry into left and updates separator i."""
+        if left.is_leaf():
+            left.keys.append(right.keys.pop(0))
+            left.values.append(right.values.pop(0))
+            self.keys[i] = right.keys[0]
+        else:
+            left.keys.append(self.keys[i])
+            self.keys[i] = right.keys.pop(0)
+            moved = right.children.pop(0)
+            left.children.append(moved)
+            self._adopt(moved, left)
+        self._write_siblings(left, right)
+
+    def _absorb(self, i, left, right):
+        """Moves right's contents onto the end of left and drops separator i."""
+        separator = self.keys.pop(i)
+        if left.is_leaf():
+            left.next_leaf = right.next_leaf
+            if right.next_leaf:
+                following = self.index_file_manager.get_node(right.next_leaf)
+                following.prev_leaf = left.block_id
+                following._write_node()
+        else:
+            left.keys.append(separator)
+            for child_block in right.children:
+                self._adopt(child_block, left)
+            left.children.extend(right.children)
+        left.keys.extend(right.keys)
+        left.values.extend(right.values)
+
+    def search(self, key):
+        """Searches for a key in the subtree rooted at this node."""
+        leaf = self._leaf_for(key)
+        i = bisect.bisect_left(leaf.keys, key)
+        if i < leaf.num_keys and leaf.keys[i] == key:
+            return leaf.values[i]
+        return None
+
+    def update(self, key, value):
+        """Replaces the value stored under key in this subtree; returns whether key was found."""
+        leaf = self._leaf_for(key)
+        i = bisect.bisect_left(leaf.keys, key)
+        if i < leaf.num_keys and leaf.keys[i] == key:
+            leaf.values[i] = value
+            leaf._write_node()
+            return True
+        return False
+
+    def search_many(self, keys, order, lo, hi, results):
+        """Resolves the sorted probes keys[lo:hi] in this subtree, visiting each child once."""
+        n = self.num_keys
+        if self.is_leaf():
+            for p in range(lo, hi):
+                i = bisect.bisect_left(self.keys, keys[p])
+                if i < n and self.keys[i] == keys[p]:
+                    results[order[p]] = self.values[i]
+            return
+        j = lo
+        while j < hi:
+            i = bisect.bisect_right(self.keys, keys[j])
+            stop = hi if i == n else bisect.bisect_left(keys, self.keys[i], j, hi)
+            child_node = self.index_file_manager.get_node(self.children[i])
+            child_node.search_many(keys, order, j, stop, results)
+            j = stop
 
 class BTree:
     """Represents the B-tree structure."""
@@ -500,53 +3061,1237 @@ class BTree:
     def __init__(self, index_file_manager):
         self.index_file_manager = index_file_manager
         self.root = None
+        self.height = 0  # Levels from the root to the leaves
         if self.index_file_manager.header['root_block'] == 0:
             pass
         else:
-            self.root = BTreeNode(self.index_file_manager, self.index_file_manager.header['root_block'])
+            self._set_root(self.index_file_manager.get_node(self.index_file_manager.header['root_block']))
+            node = self.root
+            self.height = 1
+            while not node.is_leaf():
+                node = self.index_file_manager.get_node(node.children[0])
+                self.height += 1
+
+    def _set_root(self, node):
+        """Makes node the root, keeping it pinned in the buffer pool."""
+        buffer_pool = self.index_file_manager.buffer_pool
+        if self.root is not None:
+            buffer_pool.unpin(self.root)
+        buffer_pool.pin(node)
+        self.root = node
 
     def insert(self, key, value):
         """Inserts a key/value pair into the B-tree."""
         if self.root is None:
-            self.root = BTreeNode(self.index_file_manager, is_new=True)
+            self._set_root(self.index_file_manager.node_class(self.index_file_manager, is_new=True))
+            self.height = 1
             self.root.keys.append(key)
             self.root.values.append(value)
             self.root.num_keys = 1
             self.index_file_manager.header['root_block'] = self.root.block_id
             self.root._write_node()
-            self.index_file_manager.update_header()
         else:
-            if self.root.num_keys == 2 * MIN_DEGREE - 1:
-                s = BTreeNode(self.index_file_manager, is_new=True)
+            if self.root.num_keys == 2 * self.index_file_manager.min_degree - 1:
+                s = self.index_file_manager.node_class(self.index_file_manager, is_new=True)
                 s.children.append(self.root.block_id)
                 s.num_keys = 0
-                self.root.parent_block = s.block_id
-                self.root._write_node()
                 s.split_child(0, self.root)
-                self.root = s
+                self._set_root(s)
+                self.height += 1
                 self.index_file_manager.header['root_block'] = self.root.block_id
-                self.index_file_manager.update_header()
                 self.root.insert_non_full(key, value)
             else:
                 self.root.insert_non_full(key, value)
+        if self.index_file_manager.bloom is not None:
+            self.index_file_manager.bloom.add(key)
+
+    def delete(self, key):
+        """Deletes a key from the B-tree; returns whether it was found."""
+        if self.root is None:
+            return False
+        found = self.root.delete(key)
+        if self.root.num_keys == 0:
+            # The root lost its last key: the tree is empty or one level shorter
+            old_root = self.root
+            if old_root.is_leaf():
+                self.index_file_manager.buffer_pool.unpin(old_root)
+                self.root = None
+                self.height = 0
+                self.index_file_manager.header['root_block'] = 0
+            else:
+                new_root = self.index_file_manager.get_node(old_root.children[0])
+                new_root.parent_block = 0
+                new_root._write_node()
+                self._set_root(new_root)
+                self.height -= 1
+                self.index_file_manager.header['root_block'] = new_root.block_id
+            self.index_file_manager.header_dirty = True
+            self.index_file_manager.free_block(old_root)
+        return found
 
     def search(self, key):
-        """Searches for a key in the B-tree."""
+        """Searches for a key in the B-tree, asking the Bloom filter first if there is one."""
         if self.root is None:
             return None
-        else:
+        bloom = self.index_file_manager.bloom
+        if bloom is None:
             return self.root.search(key)
+        counters = self.index_file_manager.stats.counters()
+        if not bloom.might_contain(key):
+            counters.bloom_skips += 1
+            return None
+        counters.bloom_passes += 1
+        value = self.root.search(key)
+        if value is None:
+            counters.bloom_false_positives += 1
+        return value
+
+    def update(self, key, value):
+        """Replaces the value stored under an existing key; returns whether key was found."""
+        return self.root is not None and self.root.update(key, value)
+
+    def search_many(self, keys):
+        """Searches for many keys in one walk; returns values in input order, None for misses."""
+        results = [None] * len(keys)
+        if self.root is not None and keys:
+            candidates = range(len(keys))
+            bloom = self.index_file_manager.bloom
+            if bloom is not None:
+                candidates = [i for i in candidates if bloom.might_contain(keys[i])]
+            order = sorted(candidates, key=keys.__getitem__)
+            self.root.search_many([keys[i] for i in order], order, 0, len(order), results)
+            if bloom is not None:
+                counters = self.index_file_manager.stats.counters()
+                counters.bloom_skips += len(keys) - len(order)
+                counters.bloom_passes += len(order)
+                counters.bloom_false_positives += sum(1 for i in order if results[i] is None)
+        return results
 
     def traverse(self, result_list):
         """Traverses the B-tree and collects key/value pairs."""
-        if self.root:
-            self.root.traverse(result_list)
+        result_list.extend(self.scan())
+
+    def cursor(self, reverse=False):
+        """Returns a cursor positioned before the first (or, reversed, last) key."""
+        return self.index_file_manager.cursor_class(self, reverse).seek(None)
+
+    def scan(self, lo=None, hi=None, reverse=False):
+        """Lazily yields (key, value) pairs with lo <= key <= hi in key order."""
+        if lo is not None and hi is not None and lo > hi:
+            return
+        cursor = self.index_file_manager.cursor_class(self, reverse).seek(hi if reverse else lo)
+        for key, value in cursor:
+            if reverse:
+                if lo is not None and key < lo:
+                    return
+            elif hi is not None and key > hi:
+                return
+            yield key, value
+
+    @property
+    def counted(self):
+        """Whether the nodes carry subtree counts (the 'counted' format)."""
+        return self.index_file_manager.file_format == 'counted'
+
+    def count(self):
+        """Returns the number of keys in the tree."""
+        if self.root is None:
+            return 0
+        if self.counted:
+            return self.root.size()
+        return sum(1 for _ in self.scan())
+
+    def count_below(self, key, inclusive=False):
+        """Returns how many keys are below key (or, inclusive, at most key)."""
+        if self.root is None:
+            return 0
+        if not self.counted:
+            return sum(1 for _ in self.scan(None, key if inclusive else key - 1))
+        find = bisect.bisect_right if inclusive else bisect.bisect_left
+        get_node = self.index_file_manager.get_node
+        node = self.root
+        total = 0
+        while True:
+            i = find(node.keys, key)
+            total += i
+            if node.is_leaf():
+                return total
+            total += sum(node.counts[:i])
+            if not inclusive and i < node.num_keys and node.keys[i] == key:
+                return total + node.counts[i]  # Child i lies wholly between keys[i - 1] and key
+            if inclusive and i and node.keys[i - 1] == key:
+                return total  # Child i lies wholly above key
+            node = get_node(node.children[i])
+
+    def select(self, index):
+        """Returns the (key, value) pair at a 0-based position in key order, or None."""
+        if self.root is None or index < 0:
+            return None
+        if not self.counted:
+            return next(itertools.islice(self.scan(), index, None), None)
+        get_node = self.index_file_manager.get_node
+        node = self.root
+        if index >= node.size():
+            return None
+        while not node.is_leaf():
+            for i, count in enumerate(node.counts):
+                if index < count:
+                    break
+                index -= count
+                if index == 0:
+                    return node.keys[i], node.values[i]
+                index -= 1
+            node = get_node(node.children[i])
+        return node.keys[index], node.values[index]
+
+class Cursor:
+    """Walks a B-tree in key order, holding only the nodes on one root-to-leaf path."""
+
+    def __init__(self, btree, reverse=False):
+        self.btree = btree
+        self.reverse = reverse
+        self.stack = []  # (node, index) from the root down; the tree must not change meanwhile
+
+    def seek(self, key):
+        """Positions at the first key >= key (last key <= key if reversed); None means an end."""
+        self.stack = []
+        node = self.btree.root
+        get_node = self.btree.index_file_manager.get_node
+        while node is not None and node.num_keys:
+            if self.reverse:
+                i = node.num_keys - 1 if key is None else bisect.bisect_right(node.keys, key) - 1
+                exact = key is not None and i >= 0 and node.keys[i] == key
+                child = i + 1
+            else:
+                i = 0 if key is None else bisect.bisect_left(node.keys, key)
+                exact = key is not None and i < node.num_keys and node.keys[i] == key
+                child = i
+            self.stack.append((node, i))
+            if exact or node.is_leaf():
+                break
+            node = get_node(node.children[child])
+        self._settle()
+        return self
+
+    def _settle(self):
+        """Pops exhausted entries so the top of the stack is the next pair."""
+        stack = self.stack
+        if self.reverse:
+            while stack and stack[-1][1] < 0:
+                stack.pop()
+        else:
+            while stack and stack[-1][1] >= stack[-1][0].num_keys:
+                stack.pop()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if not self.stack:
+            raise StopIteration
+        node, i = self.stack[-1]
+        pair = (node.keys[i], node.values[i])
+        step = -1 if self.reverse else 1
+        self.stack[-1] = (node, i + step)
+        if not node.is_leaf():
+            # Descend to the neighbouring key: the extreme end of the adjacent subtree
+            get_node = self.btree.index_file_manager.get_node
+            child = get_node(node.children[i + 1 if step == 1 else i])
+            while True:
+                self.stack.append((child, child.num_keys - 1 if self.reverse else 0))
+                if child.is_leaf():
+                    break
+                child = get_node(child.children[child.num_keys if self.reverse else 0])
+        self._settle()
+        return pair
+
+class LeafCursor:
+    """Walks a B+ tree in key order along its leaf chain, holding one leaf at a time."""
+
+    def __init__(self, btree, reverse=False):
+        self.btree = btree
+        self.reverse = reverse
+        self.node = None
+        self.index = 0
+
+    def seek(self, key):
+        """Positions at the first key >= key (last key <= key if reversed); None means an end."""
+        node = self.btree.root
+        get_node = self.btree.index_file_manager.get_node
+        if node is None:
+            self.node = None
+            return self
+        while not node.is_leaf():
+            if key is None:
+                i = node.num_keys if self.reverse else 0
+            else:
+                i = bisect.bisect_right(node.keys, key)
+            node = get_node(node.children[i])
+        if self.reverse:
+            self.index = node.num_keys - 1 if key is None else bisect.bisect_right(node.keys, key) - 1
+        else:
+            self.index = 0 if key is None else bisect.bisect_left(node.keys, key)
+        self.node = node
+        self._settle()
+        return self
+
+    def _settle(self):
+        """Moves along the chain until the position holds a pair (or the chain ends)."""
+        get_node = self.btree.index_file_manager.get_node
+        node, i = self.node, self.index
+        if self.reverse:
+            while node is not None and i < 0:
+                node = get_node(node.prev_leaf) if node.prev_leaf else None
+                i = node.num_keys - 1 if node is not None else 0
+        else:
+            while node is not None and i >= node.num_keys:
+                node = get_node(node.next_leaf) if node.next_leaf else None
+                i = 0
+        self.node, self.index = node, i
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        node = self.node
+        if node is None:
+            raise StopIteration
+        i = self.index
+        pair = (node.keys[i], node.values[i])
+        self.index = i - 1 if self.reverse else i + 1
+        if not 0 <= self.index < node.num_keys:
+            self._settle()
+        return pair
+
+# file format -> (codec class, node class, cursor class)
+NODE_LAYOUTS = {'btree': (NodeCodec, BTreeNode, Cursor),
+                'bplus': (BPlusNodeCodec, BPlusTreeNode, LeafCursor),
+                'counted': (CountedNodeCodec, CountedTreeNode, Cursor)}
+
+def _write_pairs(stream, first, pairs, line_format):
+    """Writes formatted pairs to a stream, OUTPUT_CHUNK_LINES lines per write."""
+    lines = [line_format.format(*first)]
+    for pair in pairs:
+        lines.append(line_format.format(*pair))
+        if len(lines) == OUTPUT_CHUNK_LINES:
+            stream.write(''.join(lines))
+            lines = []
+    stream.write(''.join(lines))
+
+class BulkBuilder:
+    """Builds a packed B-tree bottom-up from sorted, duplicate-free pairs."""
+
+    def __init__(self, index_file_manager, fill_factor=DEFAULT_FILL_FACTOR):
+        self.index_file_manager = index_file_manager
+        self.min_degree = t = index_file_manager.min_degree
+        # A node with n keys spans n + 1 "units" (children, or gaps in a leaf)
+        self.target_units = min(max(round(fill_factor * (2 * t - 1)) + 1, t), 2 * t)
+        # B+ leaves keep every pair and are linked; separators are copies of keys
+        self.linked = index_file_manager.file_format == 'bplus'
+        # Order-statistic nodes record each child's subtree size
+        self.counted = index_file_manager.file_format == 'counted'
+
+    def _plan_leaves(self, count):
+        """Like _plan_level, for B+ leaves holding between t - 1 and 2t - 1 pairs each."""
+        t = self.min_degree
+        if count <= 2 * t - 1:
+            return 1, count, 0
+        lowest = -(-count // (2 * t - 1))
+        highest = count // (t - 1)
+        nodes = min(max(round(count / (self.target_units - 1)), lowest), highest)
+        base, extra = divmod(count, nodes)
+        return nodes, base, extra
+
+    def _plan_level(self, units):
+        """Splits units into (node_count, base, extra); the first extra nodes get base + 1."""
+        t = self.min_degree
+        if units <= 2 * t:
+            return 1, units, 0
+        lowest = -(-units // (2 * t))
+        highest = units // t
+        nodes = min(max(round(units / self.target_units), lowest), highest)
+        base, extra = divmod(units, nodes)
+        return nodes, base, extra
+
+    @staticmethod
+    def _owner(index, base, extra):
+        """Returns which node of a planned level holds the given unit."""
+        if index < extra * (base + 1):
+            return index // (base + 1)
+        return extra + (index - extra * (base + 1)) // base
+
+    def build(self, pairs, count):
+        """Writes the tree for count pairs and points the header at its root."""
+        header = self.index_file_manager.header
+        if count == 0:
+            return
+        levels = []  # levels[0] is the leaf level
+        if self.linked:
+            levels.append(self._plan_leaves(count))
+            units = levels[0][0]
+        else:
+            units = count + 1
+        while not levels or levels[-1][0] > 1:
+            levels.append(self._plan_level(units))
+            units = levels[-1][0]
+        # Assign block IDs top-down: root, internal levels, then the leaves
+        starts = [0] * len(levels)
+        next_block = header['next_block']
+        for height in range(len(levels) - 1, -1, -1):
+            starts[height] = next_block
+            next_block += levels[height][0]
+
+        pager = self.index_file_manager.pager
+        top = len(levels) - 1
+        open_nodes = [None] * len(levels)
+        capacities = [0] * len(levels)  # Units the open node at each level takes
+        created = [0] * len(levels)
+        internal_blocks = []
+
+        def new_node(height):
+            index = created[height]
+            created[height] += 1
+            node = self.index_file_manager.node_class(self.index_file_manager)
+            node.block_id = starts[height] + index
+            if height == 0 and self.linked:
+                node.prev_leaf = node.block_id - 1 if index else 0
+                node.next_leaf = node.block_id + 1 if index < levels[0][0] - 1 else 0
+            if height < top:
+                _, base, extra = levels[height + 1]
+                node.parent_block = starts[height + 1] + self._owner(index, base, extra)
+            _, base, extra = levels[height]
+            capacities[height] = base + 1 if index < extra else base
+            open_nodes[height] = node
+            return node
+
+        def finish(height):
+            node = open_nodes[height]
+            open_nodes[height] = None
+            node.num_keys = len(node.keys)
+            if height == 0:
+                pager.write_unlogged(node.block_id, node._encode())
+            else:
+                internal_blocks.append((node.block_id, node._encode()))
+            if height < top:
+                parent = open_nodes[height + 1] or new_node(height + 1)
+                parent.children.append(node.block_id)
+                if self.counted:
+                    parent.counts.append(node.size())
+                if len(parent.children) == capacities[height + 1]:
+                    finish(height + 1)
+
+        needs_separator = False
+        for key, value in pairs:
+            if needs_separator:
+                # The pair between two finished siblings goes to the lowest open ancestor
+                height = 1
+                while open_nodes[height] is None:
+                    height += 1
+                needs_separator = False
+                if self.linked:
+                    # A copy of the next leaf's first key separates the two leaves
+                    open_nodes[height].keys.append(key)
+                    node = new_node(0)
+                else:
+                    node = open_nodes[height]
+            else:
+                node = open_nodes[0] or new_node(0)
+            node.keys.append(key)
+            node.values.append(value)
+            leaf_keys = capacities[0] if self.linked else capacities[0] - 1
+            if node is open_nodes[0] and len(node.keys) == leaf_keys:
+                finish(0)
+                needs_separator = True
+        if any(open_nodes) or created != [plan[0] for plan in levels]:
+            raise IndexFileError("Error: Bulk load received fewer pairs than planned.")
+        for block_id, data in sorted(internal_blocks):
+            pager.write_unlogged(block_id, data)
+        header['root_block'] = starts[top]
+        header['next_block'] = next_block
+        self.index_file_manager.header_dirty = True
+
+PAIR_STRUCT = struct.Struct('>QQ')
+_TEXT_EXPANSION = 12  # Rough bytes of parsed pairs in memory per byte of load file text
+_RUN_WRITE_PAIRS = 65536
+
+def _parse_load_line(line):
+    """Parses one 'key,value' line into (pair, error); blank lines give (None, None)."""
+    line = line.strip()
+    if not line:
+        return None, None
+    try:
+        key_str, value_str = line.split(',')
+        key = int(key_str.strip())
+        value = int(value_str.strip())
+    except ValueError:
+        return None, f"Error: Invalid line '{line}'. Skipping."
+    if not (0 <= key <= MAX_UINT64 and 0 <= value <= MAX_UINT64):
+        return None, f"Error: Invalid key/value '{line}'. Skipping."
+    return (key, value), None
+
+def _sort_unique(pairs):
+    """Sorts pairs by key in place, keeping the first occurrence of each key."""
+    pairs.sort(key=itemgetter(0))  # Stable, so the first occurrence of a key wins
+    unique = []
+    messages = []
+    for key, value in pairs:
+        if unique and unique[-1][0] == key:
+            messages.append(f"Error: Key {key} already exists in the index.")
+            continue
+        unique.append((key, value))
+    return unique, messages
+
+def _merge_pairs(existing, batch, overwrite, stats):
+    """Merges sorted existing and batch pairs into one pair per key, counting new and duplicate keys."""
+    new = duplicates = 0
+    stats['new'] = stats['duplicates'] = 0
+    current = next(batch, None)
+    for pair in existing:
+        while current is not None and current[0] < pair[0]:
+            yield current
+            new += 1
+            current = next(batch, None)
+        if current is not None and current[0] == pair[0]:
+            yield current if overwrite else pair
+            duplicates += 1
+            current = next(batch, None)
+        else:
+            yield pair
+    while current is not None:
+        yield current
+        new += 1
+        current = next(batch, None)
+    stats['new'] = new
+    stats['duplicates'] = duplicates
+
+def _load_summary(added, duplicates, policy):
+    """Describes the outcome of loading a batch into a non-empty index."""
+    action = 'replaced' if policy == 'overwrite' else 'skipped'
+    return f"Added {added} new keys; {duplicates} already in the index were {action}."
+
+def _write_run(path, pairs):
+    """Writes sorted pairs to a binary run file and returns how many were written."""
+    count = 0
+    with open(path, 'wb') as run_file:
+        chunk = []
+        for pair in pairs:
+            chunk.append(PAIR_STRUCT.pack(*pair))
+            if len(chunk) == _RUN_WRITE_PAIRS:
+                run_file.write(b''.join(chunk))
+                count += len(chunk)
+                chunk = []
+        run_file.write(b''.join(chunk))
+        count += len(chunk)
+    return count
+
+def _read_run(path, buffer_size):
+    """Yields the pairs of a binary run file, reading buffer_size bytes at a time."""
+    buffer_size -= buffer_size % PAIR_STRUCT.size
+    with open(path, 'rb', buffering=0) as run_file:
+        while True:
+            chunk = run_file.read(buffer_size)
+            if not chunk:
+                return
+            yield from PAIR_STRUCT.iter_unpack(chunk)
+
+def _sort_run(filename, start, end, run_path):
+    """Parses one byte range of a load file and spills it as a sorted run (pool worker)."""
+    with open(filename, 'rb') as input_file:
+        input_file.seek(start)
+        text = input_file.read(end - start).decode()
+    pairs = []
+    messages = []
+    for line in text.splitlines():
+        pair, error = _parse_load_line(line)
+        if error:
+            messages.append(error)
+        elif pair:
+            pairs.append(pair)
+    del text
+    unique, duplicates = _sort_unique(pairs)
+    del pairs
+    return _write_run(run_path, unique), messages + duplicates
+
+class ExternalSorter:
+    """Sorts the pairs of a load file, spilling sorted runs to disk past a memory budget."""
+
+    def __init__(self, memory_budget=DEFAULT_LOAD_MEMORY, workers=1, temp_dir=None):
+        self.memory_budget = memory_budget
+        self.workers = max(1, workers)
+        self.temp_dir = temp_dir
+
+    @contextlib.contextmanager
+    def sorted_pairs(self, filename):
+        """Yields (iterator of sorted unique pairs, count); temporary runs live until exit."""
+        size = os.path.getsize(filename)
+        if size * _TEXT_EXPANSION <= self.memory_budget:
+            pairs = []
+            with open(filename, 'r') as input_file:
+                for line in input_file:
+                    pair, error = _parse_load_line(line)
+                    if error:
+                        _report_error(error)
+                    elif pair:
+                        pairs.append(pair)
+            unique, duplicates = _sort_unique(pairs)
+            for message in duplicates:
+                _report_error(message)
+            yield iter(unique), len(unique)
+            return
+        with tempfile.TemporaryDirectory(prefix='btree-load-', dir=self.temp_dir) as temp_dir:
+            runs = self._spill_runs(filename, size, temp_dir)
+            if len(runs) == 1:
+                path, count = runs[0]
+            else:
+                path, count = self._merge_all(runs, temp_dir)
+            yield _read_run(path, self._buffer_size(1)), count
+
+    def _buffer_size(self, streams):
+        return max(self.memory_budget // (4 * (streams + 1)), 4096)
+
+    def _chunk_ranges(self, filename, size):
+        """Cuts the file into line-aligned byte ranges that each fit a worker's budget."""
+        chunk_bytes = max(self.memory_budget // (self.workers * _TEXT_EXPANSION), 4096)
+        bounds = [0]
+        with open(filename, 'rb') as input_file:
+            while bounds[-1] + chunk_bytes < size:
+                input_file.seek(bounds[-1] + chunk_bytes)
+                input_file.readline()
+                if input_file.tell() >= size:
+                    break
+                bounds.append(input_file.tell())
+        bounds.append(size)
+        return list(zip(bounds, bounds[1:]))
+
+    def _spill_runs(self, filename, size, temp_dir):
+        """Writes one sorted run per byte range and returns [(path, count)] in file order."""
+        ranges = self._chunk_ranges(filename, size)
+        paths = [os.path.join(temp_dir, f'run{index:06d}.bin') for index in range(len(ranges))]
+        args = ([filename] * len(ranges), [r[0] for r in ranges], [r[1] for r in ranges], paths)
+        if self.workers > 1 and len(ranges) > 1:
+            with ProcessPoolExecutor(max_workers=self.workers) as pool:
+                results = list(pool.map(_sort_run, *args))
+        else:
+            results = list(map(_sort_run, *args))
+        runs = []
+        for path, (count, messages) in zip(paths, results):
+            for message in messages:
+                _report_error(message)
+            runs.append((path, count))
+        return runs
+
+    def _merge_all(self, runs, temp_dir):
+        """Merges runs, at most MAX_MERGE_FAN_IN at a time, into a single run."""
+        generation = 0
+        while len(runs) > 1:
+            merged = []
+            for start in range(0, len(runs), MAX_MERGE_FAN_IN):
+                group = runs[start:start + MAX_MERGE_FAN_IN]
+                if len(group) == 1:
+                    merged.append(group[0])
+                    continue
+                path = os.path.join(temp_dir, f'merge{generation:03d}-{start:06d}.bin')
+                merged.append((path, self._merge(group, path)))
+                for old_path, _ in group:
+                    os.remove(old_path)
+            runs = merged
+            generation += 1
+        return runs[0]
+
+    def _merge(self, runs, path):
+        """K-way merges runs (earlier runs win on equal keys) into one deduplicated run."""
+        buffer_size = self._buffer_size(len(runs))
+        streams = [_read_run(run_path, buffer_size) for run_path, _ in runs]
+
+        def unique_pairs():
+            last_key = None
+            for key, value in heapq.merge(*streams, key=itemgetter(0)):
+                if key == last_key:
+                    _report_error(f"Error: Key {key} already exists in the index.")
+                    continue
+                last_key = key
+                yield key, value
+
+        return _write_run(path, unique_pairs())
+
+_LEAF_FIELDS = ('block', 'parent', 'num_keys', 'first', 'last', 'prev', 'next')
+
+def _verify_range(filename, block_size, min_degree, file_format, root_block, start, end,
+                  log_path=None, log_pages=None):
+    """Checks blocks start..end-1 in physical order and summarizes them (pool worker)."""
+    codec = NODE_LAYOUTS[file_format][0](block_size, min_degree)
+    t = min_degree
+    linked = file_format == 'bplus'
+    counted = file_format == 'counted'
+    problems = []
+    free = {}
+    internal = []
+    leaves = {field: array('Q') for field in _LEAF_FIELDS}
+    add_block, add_parent, add_num_keys, add_first, add_last, add_prev, add_next = (
+        leaves[field].append for field in _LEAF_FIELDS)
+    node = types.SimpleNamespace(prev_leaf=0, next_leaf=0, counts=[])
+    per_read = max(1, VERIFY_READ_BYTES // block_size)
+    log_file = open(log_path, 'rb') if log_pages else None
+    try:
+        with open(filename, 'rb') as index_file:
+            for first in range(start, end, per_read):
+                index_file.seek(first * block_size)
+                data = index_file.read(min(per_read, end - first) * block_size)
+                for block_id in range(first, min(first + per_read, end)):
+                    offset = (block_id - first) * block_size
+                    if block_id in (log_pages or ()):
+                        log_file.seek(log_pages[block_id])
+                        buffer, offset = log_file.read(block_size), 0
+                    else:
+                        buffer = data
+                    if len(buffer) < offset + block_size:
+                        problems.append((block_id, "lies past the end of the file"))
+                        continue
+                    if buffer[offset:offset + 8] == FREE_MAGIC:
+                        free[block_id] = FREE_BLOCK_STRUCT.unpack_from(buffer, offset)[1]
+                        continue
+                    codec.decode(node, buffer, offset)
+                    if node.block_id != block_id:
+                        problems.append((block_id, "is neither a node nor a free block"))
+                        continue
+                    if node.num_keys > codec.max_keys:
+                        problems.append((block_id, f"holds {node.num_keys} keys, more than "
+                                                   f"{codec.max_keys}"))
+                        continue
+                    if block_id != root_block and node.num_keys < t - 1:
+                        problems.append((block_id, f"holds {node.num_keys} keys, fewer than {t - 1}"))
+                    keys = node.keys
+                    if not all(map(lt, keys, keys[1:])):
+                        problems.append((block_id, "has keys out of order"))
+                    if node.children:
+                        if 0 in node.children or len(set(node.children)) != len(node.children):
+                            problems.append((block_id, "has a zero or repeated child pointer"))
+                        internal.append((block_id, node.parent_block, tuple(keys),
+                                         tuple(node.children), tuple(node.counts) if counted else None))
+                    else:
+                        if not keys and block_id != root_block:
+                            problems.append((block_id, "is an empty leaf"))
+                        add_block(block_id)
+                        add_parent(node.parent_block)
+                        add_num_keys(node.num_keys)
+                        add_first(keys[0] if keys else 0)
+                        add_last(keys[-1] if keys else 0)
+                        add_prev(node.prev_leaf if linked else 0)
+                        add_next(node.next_leaf if linked else 0)
+    finally:
+        if log_file is not None:
+            log_file.close()
+    return problems, free, internal, leaves
+
+class Verifier:
+    """Checks that an index file holds one valid tree and measures its shape."""
+
+    def __init__(self, index_file_manager, workers=None):
+        self.index_file_manager = index_file_manager
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self.problems = []
+
+    def problem(self, block_id, message):
+        self.problems.append(f"Block {block_id} {message}." if block_id else f"{message}.")
+
+    def run(self):
+        """Verifies the open file and returns the report as a dict."""
+        manager = self.index_file_manager
+        header = manager.header
+        pager = manager.pager
+        started = time.perf_counter()
+        log_pages = pager.wal.committed_pages() if pager.wal is not None else {}
+        file_blocks = os.path.getsize(manager.current_file) // manager.block_size
+        end_block = max([file_blocks, header['next_block']] + [b + 1 for b in log_pages])
+        stored_blocks = max([file_blocks] + [b + 1 for b in log_pages])
+        if stored_blocks != header['next_block']:
+            self.problem(0, f"The header's next_block is {header['next_block']} but the file "
+                            f"holds {stored_blocks} blocks")
+        chunks = self._chunks(end_block)
+        args = [(manager.current_file, manager.block_size, manager.min_degree, manager.file_format,
+                 header['root_block'], start, end, pager.wal.path if log_pages else None,
+                 {b: o for b, o in log_pages.items() if start <= b < end})
+                for start, end in chunks]
+        if len(chunks) > 1:
+            with ProcessPoolExecutor(max_workers=self.workers) as pool:
+                results = list(pool.map(_verify_range, *zip(*args)))
+        else:
+            results = [_verify_range(*arg) for arg in args]
+        free = {}
+        internal = {}
+        leaves = {field: array('Q') for field in _LEAF_FIELDS}
+        for problems, chunk_free, chunk_internal, chunk_leaves in results:
+            for block_id, message in problems:
+                self.problem(block_id, message)
+            free.update(chunk_free)
+            internal.update((node[0], node) for node in chunk_internal)
+            for field, values in chunk_leaves.items():
+                leaves[field].extend(values)
+        report = self._check_tree(internal, leaves)
+        reachable = report.pop('reachable')
+        self._check_free_list(free, reachable)
+        unreachable = (sum(1 for block_id in internal if block_id not in reachable) +
+                       sum(1 for block_id in leaves['block'] if block_id not in reachable))
+        if unreachable:
+            self.problem(0, f"{unreachable} nodes are not reachable from the root")
+        report.update({'file': manager.current_file, 'format': manager.file_format,
+                       'block_size': manager.block_size, 'min_degree': manager.min_degree,
+                       'blocks': end_block, 'free_blocks': len(free),
+                       'workers': self.workers if len(chunks) > 1 else 1,
+                       'seconds': time.perf_counter() - started,
+                       'problem_count': len(self.problems),
+                       'problems': self.problems[:VERIFY_MAX_PROBLEMS]})
+        return report
+
+    def _chunks(self, end_block):
+        """Cuts blocks 1..end_block-1 into ranges, one per worker task."""
+        blocks = end_block - 1
+        if blocks < VERIFY_PARALLEL_BLOCKS or self.workers == 1:
+            return [(1, end_block)] if blocks > 0 else []
+        count = self.workers * VERIFY_CHUNKS_PER_WORKER
+        bounds = [1 + blocks * i // count for i in range(count + 1)]
+        return list(zip(bounds, bounds[1:]))
+
+    def _check_tree(self, internal, leaves):
+        """Walks the tree from the root over the block summaries, checking it as a whole."""
+        manager = self.index_file_manager
+        root_block = manager.header['root_block']
+        linked = manager.file_format == 'bplus'
+        counted = manager.file_format == 'counted'
+        leaf_index = {block_id: i for i, block_id in enumerate(leaves['block'])}
+        parents = {root_block: 0} if root_block else {}
+        depth = {}
+        order = []  # Internal nodes, parents before children
+        leaf_depths = set()
+        reached_leaves = []
+        pending = [(root_block, None, None, 1)] if root_block else []
+        while pending:
+            block_id, lo, hi, level = pending.pop()
+            if block_id in leaf_index:
+                i = leaf_index[block_id]
+                if leaves['parent'][i] != parents[block_id]:
+                    self.problem(block_id, f"has parent {leaves['parent'][i]}, "
+                                           f"not {parents[block_id]}")
+                if leaves['num_keys'][i]:
+                    self._check_range(block_id, leaves['first'][i], leaves['last'][i], lo, hi, linked)
+                leaf_depths.add(level)
+                depth[block_id] = level
+                reached_leaves.append(i)
+                continue
+            node = internal.get(block_id)
+            if node is None:
+                if parents[block_id]:
+                    self.problem(parents[block_id], f"refers to block {block_id}, which is not a node")
+                else:
+                    self.problem(0, f"The header's root block {block_id} is not a node")
+                continue
+            _, parent, keys, children, _ = node
+            if parent != parents[block_id]:
+                self.problem(block_id, f"has parent {parent}, not {parents[block_id]}")
+            if keys:
+                self._check_range(block_id, keys[0], keys[-1], lo, hi, linked, separators=linked)
+            depth[block_id] = level
+            order.append(block_id)
+            bounds = (lo,) + keys + (hi,)
+            for i, child in enumerate(children):
+                if child in parents:
+                    self.problem(child, f"is referenced by both {parents[child]} and {block_id}")
+                    continue
+                parents[child] = block_id
+                pending.append((child, bounds[i], bounds[i + 1], level + 1))
+        if len(leaf_depths) > 1:
+            self.problem(0, f"Leaves lie at different depths {sorted(leaf_depths)}")
+        if counted:
+            self._check_counts(internal, order, leaves, leaf_index)
+        leaf_order = sorted(reached_leaves, key=leaves['first'].__getitem__)
+        if linked:
+            self._check_leaf_chain(leaves, leaf_order)
+        max_keys = 2 * manager.min_degree - 1
+        jumps = sum(1 for a, b in zip(leaf_order, leaf_order[1:])
+                    if leaves['block'][b] != leaves['block'][a] + 1)
+        return {'reachable': set(parents),
+                'height': max(leaf_depths) if leaf_depths else 0,
+                'internal_nodes': len(order),
+                'leaves': len(reached_leaves),
+                'keys': sum(leaves['num_keys'][i] for i in reached_leaves) +
+                        (0 if linked else sum(len(internal[b][2]) for b in order)),
+                'leaf_fill': _fill_report([leaves['num_keys'][i] for i in reached_leaves], max_keys),
+                'internal_fill': _fill_report([len(internal[b][2]) for b in order], max_keys),
+                'leaf_jumps': jumps / (len(leaf_order) - 1) if len(leaf_order) > 1 else 0.0}
+
+    def _check_range(self, block_id, first, last, lo, hi, linked, separators=False):
+        """Checks a node's keys against the range its parent routes to it."""
+        if linked:  # A B+ child starts at its left separator; separators may equal the right one
+            low_ok = lo is None or first >= lo
+            high_ok = hi is None or last < hi or (separators and last <= hi)
+        else:
+            low_ok = lo is None or first > lo
+            high_ok = hi is None or last < hi
+        if not (low_ok and high_ok):
+            self.problem(block_id, f"has keys {first}..{last} outside the range its parent "
+                                   f"gives it ({lo}, {hi})")
+
+    def _check_counts(self, internal, order, leaves, leaf_index):
+        """Checks every stored subtree count against the keys actually below it."""
+        sizes = {block_id: leaves['num_keys'][i] for block_id, i in leaf_index.items()}
+        for block_id in reversed(order):
+            _, _, keys, children, counts = internal[block_id]
+            actual = [sizes.get(child, 0) for child in children]
+            if list(counts) != actual:
+                self.problem(block_id, f"stores subtree counts {list(counts)} but holds {actual}")
+            sizes[block_id] = len(keys) + sum(actual)
+
+    def _check_leaf_chain(self, leaves, leaf_order):
+        """Checks that the B+ leaf links connect the leaves in key order."""
+        blocks = leaves['block']
+        for position, i in enumerate(leaf_order):
+            expected_prev = blocks[leaf_order[position - 1]] if position else 0
+            expected_next = blocks[leaf_order[position + 1]] if position + 1 < len(leaf_order) else 0
+            if leaves['prev'][i] != expected_prev or leaves['next'][i] != expected_next:
+                self.problem(blocks[i], f"links to leaves {leaves['prev'][i]} and {leaves['next'][i]}, "
+                                        f"not {expected_prev} and {expected_next}")
+
+    def _check_free_list(self, free, reachable):
+        """Walks the free list: every entry must be a free block, once, and the count must match."""
+        header = self.index_file_manager.header
+        seen = set()
+        block_id = header['free_block']
+        while block_id:
+            if block_id in seen:
+                self.problem(block_id, "appears twice on the free list")
+                break
+            if block_id not in free:
+                kind = "a node in the tree" if block_id in reachable else "not a free block"
+                self.problem(block_id, f"is on the free list but is {kind}")
+                break
+            seen.add(block_id)
+            block_id = free[block_id]
+        if len(seen) != header['free_count']:
+            self.problem(0, f"The header counts {header['free_count']} free blocks but the "
+                            f"free list holds {len(seen)}")
+        lost = len(free) - len(seen)
+        if lost > 0:
+            self.problem(0, f"{lost} free blocks are not on the free list")
+
+def _fill_report(key_counts, max_keys):
+    """Summarizes node fill: the average, and node counts per tenth of capacity."""
+    deciles = [0] * 10
+    for count in key_counts:
+        deciles[min(count * 10 // max_keys, 9)] += 1
+    average = sum(key_counts) / (len(key_counts) * max_keys) if key_counts else 0.0
+    return {'average': average, 'deciles': deciles}
+
+def _parse_uint(text):
+    """Parses an unsigned 64-bit integer from a request argument."""
+    try:
+        number = int(text)
+    except ValueError:
+        number = -1
+    if not 0 <= number <= MAX_UINT64:
+        raise ProtocolError(f"'{text}' is not an unsigned integer")
+    return number
+
+class IndexServer:
+    """Serves an open IndexFileManager over TCP or a Unix socket."""
+
+    WRITE_COMMANDS = ('put', 'del')
+
+    def __init__(self, index_file_manager, threads=DEFAULT_SERVER_THREADS,
+                 max_batch=MAX_WRITE_BATCH):
+        self.index_file_manager = index_file_manager
+        self.threads = threads
+        self.max_batch = max_batch
+        self.executor = None
+        self.reads = None
+        self.writes = None
+
+    async def serve(self, host=DEFAULT_SERVER_HOST, port=DEFAULT_SERVER_PORT, unix_path=None,
+                    ready=None):
+        """Accepts connections until cancelled; calls ready(server) once listening."""
+        self.executor = ThreadPoolExecutor(self.threads + 1, thread_name_prefix='index-server')
+        self.reads = asyncio.Queue()
+        self.writes = asyncio.Queue()
+        workers = [asyncio.create_task(self._apply_writes())]
+        workers.extend(asyncio.create_task(self._execute_reads()) for _ in range(self.threads))
+        try:
+            if unix_path:
+                server = await asyncio.start_unix_server(self._handle_connection, path=unix_path)
+                address = unix_path
+            else:
+                server = await asyncio.start_server(self._handle_connection, host, port)
+                address = ', '.join(f"{sock.getsockname()[0]}:{sock.getsockname()[1]}"
+                                    for sock in server.sockets)
+            print(f"Serving '{self.index_file_manager.current_file}' on {address}.")
+            with contextlib.suppress(NotImplementedError):
+                asyncio.get_running_loop().add_signal_handler(
+                    signal.SIGTERM, asyncio.current_task().cancel)
+            if ready is not None:
+                ready(server)
+            async with server:
+                await server.serve_forever()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            self.executor.shutdown(wait=True)
+            if unix_path and os.path.exists(unix_path):
+                os.unlink(unix_path)
+
+    async def _handle_connection(self, reader, writer):
+        """Reads pipelined requests and queues their responses in order."""
+        responses = asyncio.Queue(MAX_PIPELINE)
+        sender = asyncio.create_task(self._send_responses(responses, writer))
+        # A read waits for the connection's earlier writes, and a write for all
+        # of its earlier requests, so each connection sees its own requests in order.
+        last_write = None
+        since_write = set()  # Reads since the last write that are still pending
+        try:
+            while not sender.done():
+                line = await reader.readline()
+                if not line:
+                    break
+                request = line.decode('ascii', 'replace').split()
+                if not request:
+                    continue
+                command = request[0].lower()
+                if command == 'quit':
+                    break
+                if command in self.WRITE_COMMANDS:
+                    after = list(since_write) + ([last_write] if last_write else [])
+                    last_write = asyncio.ensure_future(self._write(command, request[1:], after))
+                    since_write = set()
+                    response = last_write
+                else:
+                    response = asyncio.ensure_future(self._read(command, request[1:], last_write))
+                    since_write.add(response)
+                    response.add_done_callback(since_write.discard)
+                await responses.put(response)
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+            pass
+        finally:
+            await responses.put(None)
+            await sender
+            writer.close()
+
+    async def _send_responses(self, responses, writer):
+        """Writes each response once it is ready, draining when the pipeline empties."""
+        try:
+            while True:
+                response = await responses.get()
+                if response is None:
+                    return
+                writer.write((await response).encode('ascii'))
+                if responses.empty():
+                    await writer.drain()
+        except ConnectionError:
+            # Keep consuming so the reader never blocks on a full queue
+            while await responses.get() is not None:
+                pass
+
+    async def _read(self, command, args, after):
+        if after is not None:
+            await asyncio.wait([after])
+        done = asyncio.get_running_loop().create_future()
+        await self.reads.put((command, args, done))
+        return await done
+
+    async def _execute_reads(self):
+        """Runs queued reads in batches, one pool thread per batch."""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.reads.get()]
+            while len(batch) < self.max_batch and not self.reads.empty():
+                batch.append(self.reads.get_nowait())
+            responses = await loop.run_in_executor(
+                self.executor, lambda: [self._execute_read(command, args)
+                                        for command, args, _ in batch])
+            for (_, _, done), response in zip(batch, responses):
+                done.set_result(response)
+
+    def _execute_read(self, command, args):
+        """Runs one read request on a pool thread and formats its response."""
+        manager = self.index_file_manager
+        try:
+            if command == 'get':
+                if len(args) != 1:
+                    raise ProtocolError("usage: get <key>")
+                try:
+                    return f"OK {manager.search_key(_parse_uint(args[0]))}\n"
+                except KeyNotFoundError:
+                    return "NOTFOUND\n"
+            if command == 'mget':
+                if not args:
+                    raise ProtocolError("usage: mget <key> [<key> ...]")
+                values = manager.search_many([_parse_uint(arg) for arg in args])
+                return "OK " + ' '.join('-' if value is None else str(value)
+                                        for value in values) + "\n"
+            if command == 'range':
+                if len(args) not in (2, 3):
+                    raise ProtocolError("usage: range <lo> <hi> [limit]")
+                lo, hi = _parse_uint(args[0]), _parse_uint(args[1])
+                limit = _parse_uint(args[2]) if len(args) == 3 else None
+                pairs = manager.scan(lo, hi, limit=limit)
+                lines = [f"OK {len(pairs)}\n"]
+                lines.extend(f"{key} {value}\n" for key, value in pairs)
+                return ''.join(lines)
+            if command == 'stats':
+                return "OK " + json.dumps(manager.stats_snapshot()) + "\n"
+            raise ProtocolError(f"unknown command '{command}'")
+        except ProtocolError as e:
+            return f"ERR {e}\n"
+        except (IOError, IndexFileError) as e:
+            logger.error(str(e))
+            return f"ERR {str(e).replace('Error: ', '', 1)}\n"
+
+    async def _write(self, command, args, after):
+        try:
+            if len(args) != (2 if command == 'put' else 1):
+                raise ProtocolError("usage: put <key> <value>" if command == 'put'
+                                    else "usage: del <key>")
+            key = _parse_uint(args[0])
+            value = _parse_uint(args[1]) if command == 'put' else None
+        except ProtocolError as e:
+            return f"ERR {e}\n"
+        if after:
+            await asyncio.wait(after)
+        done = asyncio.get_running_loop().create_future()
+        await self.writes.put(('put' if command == 'put' else 'delete', key, value, done))
+        error = await done
+        if error is None:
+            return "OK\n"
+        if command == 'del' and error.startswith("Error: Key"):
+            return "NOTFOUND\n"
+        return f"ERR {error.replace('Error: ', '', 1)}\n"
+
+    async def _apply_writes(self):
+        """Applies queued writes in batches; writes arriving during a commit join the next batch."""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.writes.get()]
+            while len(batch) < self.max_batch and not self.writes.empty():
+                batch.append(self.writes.get_nowait())
+            operations = [(operation, key, value) for operation, key, value, _ in batch]
+            try:
+                results = await loop.run_in_executor(
+                    self.executor, self.index_file_manager.apply_batch, operations)
+            except (IOError, IndexFileError) as e:  # The commit failed: nothing was applied
+                logger.error(str(e))
+                results = [str(e)] * len(batch)
+            for (_, _, _, done), error in zip(batch, results):
+                done.set_result(error)
+
+def parse_args(argv=None):
+    """Parses command-line options."""
+    parser = argparse.ArgumentParser(description="B-Tree Index Manager")
+    cache = parser.add_mutually_exclusive_group()
+    cache.add_argument('--cache-pages', type=int, default=None,
+                       help=f"buffer pool size in blocks (default {DEFAULT_CACHE_PAGES})")
+    cache.add_argument('--cache-mb', type=float, default=None,
+                       help="buffer pool size in megabytes")
+    parser.add_argument('--load-memory-mb', type=float, default=DEFAULT_LOAD_MEMORY / (1024 * 1024),
+                        help="memory budget for sorting load files; larger files spill to disk")
+    parser.add_argument('--load-workers', type=int, default=1,
+                        help="processes used to parse and sort load file runs")
+    parser.add_argument('--temp-dir', default=None,
+                        help="directory for sorted runs spilled during load")
+    parser.add_argument('--mmap', action='store_true',
+                        help="serve block reads from a memory map of the index file")
+    parser.add_argument('--wal', action='store_true',
+                        help="log changes to a write-ahead log and commit them atomically")
+    parser.add_argument('--sync', choices=SYNC_POLICIES, default='always',
+                        help="when the write-ahead log is fsynced: every commit, in batches, or never")
+    parser.add_argument('--sync-every', type=int, default=DEFAULT_SYNC_EVERY,
+                        help="commits per fsync with --sync batch")
+    parser.add_argument('--sync-interval-ms', type=float, default=DEFAULT_SYNC_INTERVAL_MS,
+                        help="longest a commit waits for its fsync with --sync batch")
+    parser.add_argument('--stats-file', default=None,
+                        help="periodically write statistics to this file as JSON")
+    parser.add_argument('--stats-interval', type=float, default=60.0,
+                        help="seconds between --stats-file dumps")
+    parser.add_argument('--script', metavar='FILE', default=None,
+                        help="run the commands in FILE ('-' for standard input) without prompts")
+    parser.add_argument('--yes', action='store_true',
+                        help="with --script, answer yes when asked to overwrite a file")
+    parser.add_argument('--json', action='store_true',
+                        help="with --script, print one JSON object per command")
+    parser.add_argument('--stop-on-error', action='store_true',
+                        help="with --script, stop at the first command that fails")
+    parser.add_argument('--serve', metavar='INDEX_FILE', default=None,
+                        help="serve this index file over the network instead of reading commands")
+    parser.add_argument('--host', default=DEFAULT_SERVER_HOST,
+                        help="address the --serve server listens on")
+    parser.add_argument('--port', type=int, default=DEFAULT_SERVER_PORT,
+                        help="TCP port the --serve server listens on")
+    parser.add_argument('--unix-socket', default=None,
+                        help="listen on this Unix socket instead of TCP")
+    parser.add_argument('--server-threads', type=int, default=DEFAULT_SERVER_THREADS,
+                        help="threads running the server's read batches")
+    return parser.parse_args(argv)
+
+def run_script(index_file_manager, args):
+    """Runs the --script commands and closes the index; returns the exit status."""
+    index_file_manager.auto_confirm = args.yes
+    handler = ScriptHandler(index_file_manager, json_lines=args.json,
+                            stop_on_error=args.stop_on_error)
+    if args.script == '-':
+        script = sys.stdin
+    else:
+        try:
+            script = open(args.script, 'r', buffering=SCRIPT_BUFFER_BYTES)
+        except IOError as e:
+            logger.error(str(e))
+            _report_error(f"Error: Could not read script '{args.script}'.")
+            return 2
+    try:
+        return handler.run(script)
+    finally:
+        if script is not sys.stdin:
+            script.close()
+        index_file_manager.close()
+
+def serve(index_file_manager, args):
+    """Opens the --serve index file and serves it until interrupted."""
+    index_file_manager.open_index_file(args.serve)
+    if not index_file_manager.current_file:
+        sys.exit(1)
+    server = IndexServer(index_file_manager, threads=max(1, args.server_threads))
+    try:
+        asyncio.run(server.serve(args.host, args.port, args.unix_socket))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
+    except OSError as e:
+        logger.error(str(e))
+        _report_error(f"Error: Could not start the server. {str(e)}")
+    finally:
+        index_file_manager.close()
+        print("Server stopped.")
 
 def main():
     """Main function to start the program."""
-    index_file_manager = IndexFileManager()
+    args = parse_args()
+    cache_bytes = int(args.cache_mb * 1024 * 1024) if args.cache_mb else None
+    index_file_manager = IndexFileManager(cache_pages=args.cache_pages, cache_bytes=cache_bytes,
+                                          load_memory=int(args.load_memory_mb * 1024 * 1024),
+                                          load_workers=args.load_workers, temp_dir=args.temp_dir,
+                                          use_mmap=args.mmap, wal=args.wal, sync_policy=args.sync,
+                                          sync_every=args.sync_every,
+                                          sync_interval_ms=args.sync_interval_ms)
     command_handler = CommandHandler(index_file_manager)
-    command_handler.start()
+    dumper = None
+    if args.stats_file:
+        dumper = StatsDumper(index_file_manager, args.stats_file, args.stats_interval)
+        dumper.start()
+    status = 0
+    try:
+        if args.serve:
+            serve(index_file_manager, args)
+        elif args.script:
+            status = run_script(index_file_manager, args)
+        else:
+            command_handler.start()
+    finally:
+        if dumper is not None:
+            dumper.stop()
+    sys.exit(status)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,129 @@
+"""Load generator for an index served with `index_file_manager.py --serve`.
+
+Opens --connections connections, each keeping up to --depth pipelined
+requests in flight, and sends a seeded mix of point reads and inserts for
+--duration seconds. Prints throughput and p50/p95/p99 latency per request
+kind as JSON.
+
+    python3 index_file_manager.py --serve data.idx &
+    python3 load_generator.py --connections 16 --depth 32 --write-fraction 0.2
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+
+import index_file_manager as ifm
+
+DEFAULT_CONNECTIONS = 8
+DEFAULT_DEPTH = 16
+DEFAULT_DURATION = 10.0
+DEFAULT_KEY_RANGE = 100000
+DEFAULT_SEED = 4337
+PUT_KEY_BASE = 1 << 48  # Inserted keys start above here, clear of any preloaded keys
+
+
+async def run_connection(args, number, deadline, stats, counts):
+    """Drives one connection until the deadline; records latency per request."""
+    if args.unix_socket:
+        reader, writer = await asyncio.open_unix_connection(args.unix_socket)
+    else:
+        reader, writer = await asyncio.open_connection(args.host, args.port)
+    rng = random.Random(args.seed + number)
+    next_put = PUT_KEY_BASE + (rng.getrandbits(24) << 24)
+    in_flight = asyncio.Queue(args.depth)
+
+    async def send():
+        nonlocal next_put
+        while time.perf_counter() < deadline:
+            if rng.random() < args.write_fraction:
+                kind, line = 'put', f"put {next_put} {next_put}\n"
+                next_put += 1
+            elif args.mget > 1:
+                keys = ' '.join(str(rng.randint(1, args.key_range)) for _ in range(args.mget))
+                kind, line = 'mget', f"mget {keys}\n"
+            else:
+                kind, line = 'get', f"get {rng.randint(1, args.key_range)}\n"
+            await in_flight.put((kind, time.perf_counter()))
+            writer.write(line.encode('ascii'))
+            if in_flight.full():
+                await writer.drain()
+        await in_flight.put(None)
+        await writer.drain()
+
+    async def receive():
+        while True:
+            request = await in_flight.get()
+            if request is None:
+                return
+            kind, started = request
+            line = await reader.readline()
+            stats.setdefault(kind, ifm.OperationStats()).record(time.perf_counter() - started)
+            status = line.split(b' ', 1)[0].strip().decode('ascii') or 'CLOSED'
+            counts[status] = counts.get(status, 0) + 1
+
+    await asyncio.gather(send(), receive())
+    writer.write(b"quit\n")
+    writer.close()
+
+
+async def run(args):
+    stats = {}
+    counts = {}
+    started = time.perf_counter()
+    deadline = started + args.duration
+    await asyncio.gather(*(run_connection(args, number, deadline, stats, counts)
+                           for number in range(args.connections)))
+    elapsed = time.perf_counter() - started
+    total = sum(op.count for op in stats.values())
+    return {'connections': args.connections,
+            'depth': args.depth,
+            'write_fraction': args.write_fraction,
+            'seconds': elapsed,
+            'requests': total,
+            'ops_per_sec': total / elapsed if elapsed else 0.0,
+            'responses': counts,
+            'latency': {kind: {key: value for key, value in op.snapshot().items()
+                               if key.endswith('_ms') or key == 'count'}
+                        for kind, op in sorted(stats.items())}}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generate load against an index server.")
+    parser.add_argument('--host', default=ifm.DEFAULT_SERVER_HOST)
+    parser.add_argument('--port', type=int, default=ifm.DEFAULT_SERVER_PORT)
+    parser.add_argument('--unix-socket', default=None)
+    parser.add_argument('--connections', type=int, default=DEFAULT_CONNECTIONS)
+    parser.add_argument('--depth', type=int, default=DEFAULT_DEPTH,
+                        help="pipelined requests in flight per connection")
+    parser.add_argument('--duration', type=float, default=DEFAULT_DURATION,
+                        help="seconds to send requests for")
+    parser.add_argument('--write-fraction', type=float, default=0.1,
+                        help="fraction of requests that insert a new key")
+    parser.add_argument('--key-range', type=int, default=DEFAULT_KEY_RANGE,
+                        help="reads pick keys uniformly from 1..key-range")
+    parser.add_argument('--mget', type=int, default=1,
+                        help="keys per read; above 1 reads are sent as mget")
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    args = parser.parse_args(argv)
+    if args.connections < 1 or args.depth < 1 or not 0 <= args.write_fraction <= 1:
+        parser.error("--connections and --depth must be positive and --write-fraction in [0, 1]")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    try:
+        result = asyncio.run(run(args))
+    except OSError as e:
+        print(f"Error: Could not reach the server. {e}")
+        return 1
+    print(json.dumps(result, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,100 @@
+import contextlib
+import io
+import os
+import random
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from index_file_manager import IndexFileManager, ReadWriteLock
+
+class ReadWriteLockTest(unittest.TestCase):
+    def test_interrupted_reader_does_not_hold_back_writers(self):
+        lock = ReadWriteLock()
+        release = threading.Event()
+        holding = threading.Event()
+
+        def write():
+            with lock.writing():
+                holding.set()
+                release.wait()
+
+        writer = threading.Thread(target=write, daemon=True)
+        writer.start()
+        self.addCleanup(release.set)
+        holding.wait()
+        with mock.patch.object(lock.condition, 'wait', side_effect=KeyboardInterrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                with lock.reading():
+                    pass
+        self.assertEqual(lock.waiting_readers, 0)
+        release.set()
+        writer.join()
+        self.assertEqual(lock.admit, 0)
+        acquired = threading.Event()
+
+        def write_again():
+            with lock.writing():
+                acquired.set()
+
+        threading.Thread(target=write_again, daemon=True).start()
+        self.assertTrue(acquired.wait(5))
+
+class ConcurrentReadersTest(unittest.TestCase):
+    KEYS = 400
+    READERS = 3
+
+    def check_readers_alongside_writer(self, **options):
+        """Readers must always see the keys a writer inserts (then deletes) in order as a contiguous run."""
+        with tempfile.TemporaryDirectory() as temp_dir, \
+                contextlib.redirect_stdout(io.StringIO()):
+            manager = IndexFileManager(cache_pages=16, **options)
+            manager.create_and_open_index_file(os.path.join(temp_dir, 'test.idx'), 512)
+            done = threading.Event()
+            failures = []
+
+            def write():
+                try:
+                    for key in range(self.KEYS):
+                        manager.insert_key_value(key, key * 2)
+                    for key in range(self.KEYS):
+                        manager.delete_key(key)
+                finally:
+                    done.set()
+
+            def read(seed):
+                rng = random.Random(seed)
+                try:
+                    while not done.is_set():
+                        pairs = manager.scan()
+                        keys = [key for key, _ in pairs]
+                        if keys and keys != list(range(keys[0], keys[0] + len(keys))):
+                            failures.append(f"non-contiguous scan from {keys[0]}")
+                        if any(value != key * 2 for key, value in pairs):
+                            failures.append("scan returned a wrong value")
+                        probes = [rng.randrange(self.KEYS) for _ in range(20)]
+                        for key, value in zip(probes, manager.search_many(probes)):
+                            if value is not None and value != key * 2:
+                                failures.append(f"search for {key} returned {value}")
+                except Exception as e:
+                    failures.append(repr(e))
+
+            threads = [threading.Thread(target=write)]
+            threads.extend(threading.Thread(target=read, args=(seed,)) for seed in range(self.READERS))
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(failures, [])
+            self.assertEqual(manager.scan(), [])
+            manager.close()
+
+    def test_readers_alongside_writer(self):
+        self.check_readers_alongside_writer()
+
+    def test_readers_alongside_writer_with_wal(self):
+        self.check_readers_alongside_writer(wal=True, sync_policy='never')
+
+if __name__ == '__main__':
+    unittest.main()
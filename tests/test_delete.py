@@ -0,0 +1,96 @@
+import contextlib
+import io
+import os
+import random
+import tempfile
+import unittest
+
+from index_file_manager import FILE_FORMATS, IndexFileManager, KeyNotFoundError
+
+BLOCK_SIZE = 512
+MIN_DEGREE = 3  # Small nodes, so deletes borrow and merge often
+
+class DeleteTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+
+    def open_manager(self, file_format, **options):
+        path = os.path.join(self.temp_dir.name, f'{file_format}.idx')
+        manager = IndexFileManager(cache_pages=16, **options)
+        manager.auto_confirm = True
+        with contextlib.redirect_stdout(io.StringIO()):
+            manager.create_and_open_index_file(path, BLOCK_SIZE, MIN_DEGREE, file_format)
+        self.addCleanup(manager.close)
+        return manager, path
+
+    def check(self, manager, reference):
+        self.assertEqual(manager.scan(), sorted(reference.items()))
+        self.assertEqual(manager.verify(1)['problems'], [])
+
+    def run_phases(self, file_format, **options):
+        manager, path = self.open_manager(file_format, **options)
+        rng = random.Random(12)
+        reference = {}
+        with contextlib.redirect_stdout(io.StringIO()):
+            for key in rng.sample(range(10 ** 6), 1500):
+                manager.insert_key_value(key, key + 1)
+                reference[key] = key + 1
+            self.check(manager, reference)
+
+            # Random deletes, including keys that are not there, mixed with inserts
+            keys = list(reference)
+            for _ in range(3000):
+                if rng.random() < 0.7:
+                    index = rng.randrange(len(keys))
+                    manager.delete_key(keys[index])
+                    del reference[keys[index]]
+                    keys[index] = keys[-1]
+                    keys.pop()
+                    continue
+                key = rng.randrange(10 ** 6)
+                if key in reference:
+                    with self.assertRaises(KeyNotFoundError):
+                        manager.delete_key(key + 10 ** 6)
+                else:
+                    manager.insert_key_value(key, key + 1)
+                    reference[key] = key + 1
+                    keys.append(key)
+            self.check(manager, reference)
+            self.assertGreater(manager.stats.total('node_merges'), 0)
+
+            # Deleting most keys frees blocks, and later inserts reuse them
+            for key in list(reference)[:len(reference) - 100]:
+                manager.delete_key(key)
+                del reference[key]
+            self.check(manager, reference)
+            free = manager.header['free_count']
+            self.assertGreater(free, 10)
+            blocks = manager.header['next_block']
+            key = 2 * 10 ** 6
+            while manager.header['free_count'] > free // 2:
+                manager.insert_key_value(key, key + 1)
+                reference[key] = key + 1
+                key += 1
+            self.assertEqual(manager.header['next_block'], blocks)
+            self.check(manager, reference)
+
+            blocks = manager.header['next_block']
+            manager.vacuum()
+        self.check(manager, reference)
+        self.assertEqual(manager.header['free_count'], 0)
+        self.assertEqual(os.path.getsize(path), manager.header['next_block'] * BLOCK_SIZE)
+        self.assertLess(manager.header['next_block'], blocks)
+
+    def test_insert_delete_and_vacuum(self):
+        for file_format in FILE_FORMATS:
+            with self.subTest(file_format=file_format):
+                self.run_phases(file_format)
+
+    def test_insert_delete_and_vacuum_with_wal(self):
+        for file_format in FILE_FORMATS:
+            with self.subTest(file_format=file_format):
+                self.run_phases(file_format, wal=True, sync_policy='never')
+
+if __name__ == '__main__':
+    unittest.main()
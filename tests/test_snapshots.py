@@ -0,0 +1,79 @@
+import contextlib
+import io
+import os
+import random
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from index_file_manager import BulkBuilder, IndexFileManager
+
+class SnapshotTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.path = os.path.join(self.temp_dir.name, 'test.idx')
+        self.manager = IndexFileManager(wal=True, cache_pages=64)
+        self.manager.auto_confirm = True
+        self.addCleanup(self.quiet, self.manager.close)
+        rng = random.Random(1)
+        self.base = dict((key, key + 1) for key in rng.sample(range(10 ** 6), 2000))
+        self.batch = dict((key, key + 2) for key in rng.sample(range(10 ** 6, 2 * 10 ** 6), 2000))
+        self.quiet(self.manager.create_and_open_index_file, self.path)
+        self.quiet(self.manager.load_from_file, self.write_pairs('base.txt', self.base))
+
+    def quiet(self, function, *args):
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            function(*args)
+        return output.getvalue()
+
+    def write_pairs(self, name, pairs):
+        path = os.path.join(self.temp_dir.name, name)
+        with open(path, 'w') as pair_file:
+            pair_file.writelines(f"{key},{value}\n" for key, value in pairs.items())
+        return path
+
+    def test_snapshot_opened_during_merge_load_waits_for_it(self):
+        batch_file = self.write_pairs('batch.txt', self.batch)
+        result = {}
+        opened = threading.Event()
+
+        def read_snapshot():
+            try:
+                with self.manager.open_snapshot() as snapshot:
+                    opened.set()
+                    result['pairs'] = list(snapshot.scan())
+            except Exception as e:
+                result['error'] = e
+
+        build = BulkBuilder.build
+
+        def build_with_reader(builder, pairs, count):
+            reader = threading.Thread(target=read_snapshot)
+            reader.start()
+            result['reader'] = reader
+            # The reader must not get a snapshot of the file being replaced
+            result['opened_during_build'] = opened.wait(0.2)
+            return build(builder, pairs, count)
+
+        with mock.patch.object(BulkBuilder, 'build', build_with_reader):
+            output = self.quiet(self.manager.load_from_file, batch_file, 0.9, 'skip', 'merge')
+        result['reader'].join(10)
+        self.assertIn("Loaded key/value pairs", output)
+        self.assertFalse(result['opened_during_build'])
+        self.assertNotIn('error', result)
+        self.assertEqual(result['pairs'], sorted({**self.base, **self.batch}.items()))
+
+    def test_reorganize_and_vacuum_refuse_while_snapshot_is_open(self):
+        blocks = self.manager.header['next_block']
+        with self.manager.open_snapshot() as snapshot:
+            self.assertIn("Error: Cannot reorganize", self.quiet(self.manager.reorganize))
+            self.assertIn("Error: Cannot vacuum", self.quiet(self.manager.vacuum))
+            self.assertEqual(list(snapshot.scan()), sorted(self.base.items()))
+        self.assertEqual(self.manager.header['next_block'], blocks)
+        self.assertFalse(self.manager.replacing)
+        self.assertIn("Reorganized", self.quiet(self.manager.reorganize))
+
+if __name__ == '__main__':
+    unittest.main()
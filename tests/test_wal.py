@@ -0,0 +1,88 @@
+import contextlib
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import textwrap
+import unittest
+
+from index_file_manager import IndexFileManager, WAL_SUFFIX
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BLOCK_SIZE = 512
+
+# Inserts keys with a write-ahead log, optionally leaves some changes uncommitted,
+# and dies without closing the file, so nothing is checkpointed on the way out.
+CHILD = textwrap.dedent('''
+    import contextlib, io, os, sys
+    from index_file_manager import IndexFileManager
+    path, policy, count, checkpoint_bytes, uncommitted = sys.argv[1:]
+    manager = IndexFileManager(wal=True, sync_policy=policy, cache_pages=8)
+    manager.auto_confirm = True
+    with contextlib.redirect_stdout(io.StringIO()):
+        manager.create_and_open_index_file(path, %d)
+        if int(checkpoint_bytes):
+            manager.pager.wal.checkpoint_bytes = int(checkpoint_bytes)
+        for i in range(int(count)):
+            manager.insert_key_value(i * 7919 %% 100003, i)
+        for key in range(200000, 200000 + int(uncommitted)):
+            manager.btree.insert(key, 1)  # Never committed; evicted pages reach the log
+    os._exit(0)
+''' % BLOCK_SIZE)
+
+def expected_pairs(count):
+    return sorted((i * 7919 % 100003, i) for i in range(count))
+
+class WriteAheadLogRecoveryTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.path = os.path.join(self.temp_dir.name, 'test.idx')
+
+    def crash(self, count, policy='always', checkpoint_bytes=0, uncommitted=0):
+        env = dict(os.environ, PYTHONPATH=ROOT)
+        subprocess.run([sys.executable, '-c', CHILD, self.path, policy, str(count),
+                        str(checkpoint_bytes), str(uncommitted)], env=env, check=True)
+        self.assertTrue(os.path.exists(self.path + WAL_SUFFIX))
+
+    def reopen(self):
+        manager = IndexFileManager()
+        with contextlib.redirect_stdout(io.StringIO()):
+            manager.open_index_file(self.path)
+        self.addCleanup(manager.close)
+        self.assertFalse(os.path.exists(self.path + WAL_SUFFIX))
+        self.assertEqual(manager.verify(1)['problem_count'], 0)
+        return manager
+
+    def test_committed_writes_survive_a_crash_before_checkpoint(self):
+        for policy in ('always', 'batch'):
+            with self.subTest(policy=policy):
+                self.crash(600, policy, uncommitted=200)
+                # Nothing was checkpointed: the index file holds only its header
+                self.assertEqual(os.path.getsize(self.path), BLOCK_SIZE)
+                manager = self.reopen()
+                self.assertEqual(manager.scan(), expected_pairs(600))
+
+    def test_recovery_after_checkpoints(self):
+        self.crash(2000, checkpoint_bytes=64 * 1024, uncommitted=200)
+        self.assertGreater(os.path.getsize(self.path), BLOCK_SIZE)
+        manager = self.reopen()
+        self.assertEqual(manager.scan(), expected_pairs(2000))
+
+    def test_torn_tail_is_ignored(self):
+        self.crash(300)
+        with open(self.path + WAL_SUFFIX, 'r+b') as log_file:
+            log_file.truncate(os.path.getsize(self.path + WAL_SUFFIX) - 1)  # Tears the last commit
+        manager = self.reopen()
+        self.assertEqual(manager.scan(), expected_pairs(299))
+
+    def test_garbage_after_last_commit_is_ignored(self):
+        self.crash(300)
+        with open(self.path + WAL_SUFFIX, 'ab') as log_file:
+            log_file.write(b'PAGE' + os.urandom(100))
+        manager = self.reopen()
+        self.assertEqual(manager.scan(), expected_pairs(300))
+
+if __name__ == '__main__':
+    unittest.main()